@@ -1,26 +1,31 @@
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, SessionLocal
 from models import Student
 import schemas
-from config import JWT_SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+import passwords
+from catalog_cache import MemoryCache
+from config import JWT_SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_CACHE_MAX_ENTRIES
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Same scheme for endpoints that still accept a student_id parameter instead
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-# Verify password
+# Decoded tokens, each kept until the token itself expires
+principal_cache = MemoryCache(AUTH_CACHE_MAX_ENTRIES)
+
+# Verify password (runs on the bounded hashing pool)
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return passwords.verify_password(plain_password, hashed_password)
 
-# Hash password
+# Hash password (runs on the bounded hashing pool)
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return passwords.hash_password(password)
 
 # Authenticate user
 def authenticate_user(db: Session, email: str, password: str):
@@ -32,11 +37,16 @@ def authenticate_user(db: Session, email: str, password: str):
         return False
     
     print(f"User found: {user.name}, {user.email}")
-    password_matches = verify_password(password, user.password_hash)
+    password_matches, new_hash = passwords.verify_and_rehash(password, user.password_hash)
     print(f"Password match: {password_matches}")
     
     if not password_matches:
         return False
+    
+    # Upgrade hashes made with an old bcrypt cost
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
         
     return user
 
@@ -51,22 +61,87 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Get current user from token
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+# Token claims for a student: email as the subject plus the numeric id, so
+# requests carrying the token need no lookup to know who is calling
+def student_claims(student: Student) -> dict:
+    return {"sub": student.email, "uid": student.id}
+
+def credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+# Validate a token and return its claims, from the cache when possible
+def decode_principal(token: str) -> schemas.TokenData:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(email=email)
     except JWTError:
-        raise credentials_exception
-    user = db.query(Student).filter(Student.email == token_data.email).first()
+        raise credentials_exception()
+    email = payload.get("sub")
+    if email is None:
+        raise credentials_exception()
+    principal = schemas.TokenData(email=email, id=payload.get("uid"))
+    
+    # Tokens issued before ids were added to the claims are resolved once
+    if principal.id is None:
+        db = SessionLocal()
+        try:
+            student_id = db.query(Student.id).filter(Student.email == email).scalar()
+        finally:
+            db.close()
+        if student_id is None:
+            raise credentials_exception()
+        principal = schemas.TokenData(email=email, id=student_id)
+    
+    remaining = payload["exp"] - time.time() if "exp" in payload else ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    if remaining > 0:
+        principal_cache.set(token, principal, remaining)
+    return principal
+
+# Get current user from token
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    principal = decode_principal(token)
+    user = db.get(Student, principal.id)
     if user is None:
-        raise credentials_exception
-    return user 
\ No newline at end of file
+        raise credentials_exception()
+    return user
+
+# Resolve the calling student's id for the student endpoints.
+# A bearer token is checked without touching the database. Without one the
+# student_id parameter is still accepted and checked against the students
+# table, for clients that do not send the token yet.
+def current_student_id(
+    student_id: Optional[int] = Query(None, description="Student ID; not needed with a bearer token"),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+) -> int:
+    if token:
+        principal = decode_principal(token)
+        if student_id is not None and student_id != principal.id:
+            raise HTTPException(status_code=403, detail="Token does not belong to this student")
+        return principal.id
+    
+    if student_id is None:
+        raise credentials_exception()
+    
+    # Own short session: this also guards the long-lived notification stream,
+    # which must not hold a connection while it is open
+    db = SessionLocal()
+    try:
+        exists = db.query(Student.id).filter(Student.id == student_id).first() is not None
+    finally:
+        db.close()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return student_id
+
+def principal_cache_stats() -> dict:
+    stats = principal_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return stats 
\ No newline at end of file
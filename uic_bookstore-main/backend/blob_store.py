@@ -0,0 +1,313 @@
+"""Content-addressed storage for uploaded images.
+
+Every uploaded product image and profile picture is stored once, as
+<sha256><extension> in UPLOAD_DIR, however many rows use it: uploading the
+same picture again only adds a reference. upload_blobs keeps a reference
+count per file, changed in the same transaction as the row that starts or
+stops using it (store_image() and release()).
+
+Nothing is deleted when a reference goes away. The garbage collector
+removes files that have gone unreferenced for UPLOAD_GC_GRACE seconds,
+with their resized variants, UPLOAD_GC_BATCH at a time:
+
+1. blobs whose reference count is 0;
+2. files in UPLOAD_DIR named like blobs or their variants that are not
+   blobs and that no product, student or admin refers to, and temporary
+   files left by interrupted uploads.
+
+Images saved under other names before this store existed are only swept
+when asked for (include_legacy), since nothing but the referencing
+columns tells them apart from files put in UPLOAD_DIR by hand.
+
+Queue a run with POST /admin/uploads/gc[?include_legacy=true], or run this
+module from cron:
+
+    python blob_store.py [--grace 3600] [--include-legacy]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import catalog_cache
+import image_names
+import image_variants
+import jobs
+import models
+import uploads
+from config import UPLOAD_DIR, UPLOAD_GC_GRACE, UPLOAD_GC_BATCH, UPLOAD_GC_PAUSE
+
+# Temporary files written by uploads.receive_image()
+TEMPORARY_PREFIX = tempfile.gettempprefix()
+
+# Columns holding the name of a file in UPLOAD_DIR
+REFERENCING_COLUMNS = (models.Product.image_url, models.Student.profile_picture, models.AdminUser.profile_picture)
+
+
+def _add_reference(db: Session, filename: str) -> bool:
+    blobs = models.UploadBlob
+    result = db.execute(
+        update(blobs)
+        .where(blobs.filename == filename)
+        .values(refcount=blobs.refcount + 1, unreferenced_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def _acquire(db: Session, filename: str, size: int):
+    if _add_reference(db, filename):
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(models.UploadBlob).values(
+                filename=filename, size=size, refcount=1, created_at=datetime.datetime.utcnow()
+            ))
+    except IntegrityError:
+        # A concurrent upload of the same image created the row first
+        _add_reference(db, filename)
+
+
+def store_image(db: Session, upload) -> str:
+    """Store an uploaded image and reference it in the caller's transaction.
+
+    Returns the file name to save on the row. Raises 400 for files that
+    are not images and 413 for images over UPLOAD_MAX_BYTES.
+    """
+    received = uploads.receive_image(upload)
+    filename = f"{received.sha256}{received.extension}"
+    try:
+        _acquire(db, filename, received.size)
+    except BaseException:
+        os.remove(received.path)
+        raise
+    target = os.path.join(UPLOAD_DIR, filename)
+    if os.path.exists(target):
+        # The same image is already stored; touching it keeps a running
+        # garbage collection from taking it for an old orphan
+        os.utime(target)
+        os.remove(received.path)
+    else:
+        os.replace(received.path, target)
+    return filename
+
+
+def release(db: Session, filename: Optional[str]):
+    """Drop a reference to an image in the caller's transaction.
+
+    Images saved before the blob store have no reference count and are
+    left to the directory sweep.
+    """
+    if not filename:
+        return
+    blobs = models.UploadBlob
+    db.execute(
+        update(blobs)
+        .where(blobs.filename == filename, blobs.refcount > 0)
+        .values(refcount=blobs.refcount - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(blobs)
+        .where(blobs.filename == filename, blobs.refcount == 0, blobs.unreferenced_at.is_(None))
+        .values(unreferenced_at=datetime.datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _remove(filename: str) -> int:
+    # Returns the bytes freed by removing a file and its variants
+    freed = image_variants.delete(filename)
+    path = os.path.join(UPLOAD_DIR, filename)
+    if os.path.exists(path):
+        freed += os.path.getsize(path)
+        os.remove(path)
+    return freed
+
+
+def _announce_deletions():
+    # Processes serving /uploads drop their memory cache when this changes
+    catalog_cache.backend.bump_version("uploads")
+
+
+def _sweep_blobs(db: Session, cutoff: datetime.datetime, batch_size: int, totals: dict, progress):
+    blobs = models.UploadBlob
+    while True:
+        # Uploads that are re-referencing one of these blobs hold its row
+        # lock, so it is skipped rather than deleted under them
+        rows = (
+            db.query(blobs.id, blobs.filename)
+            .filter(blobs.refcount == 0, blobs.unreferenced_at < cutoff)
+            .order_by(blobs.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not rows:
+            db.rollback()
+            return
+
+        for _, filename in rows:
+            totals["bytes_reclaimed"] += _remove(filename)
+        db.execute(delete(blobs).where(blobs.id.in_([blob_id for blob_id, _ in rows])))
+        db.commit()
+        _announce_deletions()
+        totals["blobs_deleted"] += len(rows)
+        if progress:
+            progress(totals["blobs_deleted"] + totals["files_deleted"], 0)
+        if len(rows) < batch_size:
+            return
+        time.sleep(UPLOAD_GC_PAUSE)
+
+
+def _referenced_names(db: Session) -> set:
+    """Every file name that is a blob or is used by a row"""
+    names = set()
+    for column in (models.UploadBlob.filename,) + REFERENCING_COLUMNS:
+        rows = db.execute(select(column).where(column.isnot(None)).execution_options(yield_per=10000))
+        names.update(rows.scalars())
+    db.rollback()  # end the read transaction
+    return names
+
+
+def _unlink_if_old(filename: str, cutoff: float) -> int:
+    # Checked again right before deleting: a file can be re-used (and
+    # touched) by an upload of the same image while the sweep runs
+    path = os.path.join(UPLOAD_DIR, filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    if stat.st_mtime >= cutoff:
+        return 0
+    os.remove(path)
+    return stat.st_size
+
+
+def _sweep_directory(db: Session, cutoff: float, batch_size: int, include_legacy: bool, totals: dict, progress):
+    started = time.perf_counter()
+    originals = set()  # stems of every image, to find variants left without one
+    candidates = []  # images old enough to be collected if unreferenced
+    variants = []
+    stale = []  # temporary files of interrupted uploads
+    with os.scandir(UPLOAD_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            totals["files_scanned"] += 1
+            if entry.name.startswith(TEMPORARY_PREFIX) and entry.name.endswith(".tmp"):
+                if entry.stat().st_mtime < cutoff:
+                    stale.append(entry.name)
+                continue
+            variant = image_names.is_variant(entry.name)
+            if not variant:
+                originals.add(os.path.splitext(entry.name)[0])
+            if not include_legacy and not image_names.CONTENT_ADDRESSED.fullmatch(entry.name):
+                continue  # not ours to delete
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            (variants if variant else candidates).append(entry.name)
+
+    # Loaded after the scan: a row that starts using a file after this
+    # point uses a blob written (or touched) after the scan, which is too
+    # new to be a candidate. One pass per table instead of a lookup per
+    # file, since the image columns are not indexed.
+    referenced = _referenced_names(db)
+    orphans = [filename for filename in candidates if filename not in referenced]
+    for start in range(0, len(orphans), batch_size):
+        deleted = 0
+        for filename in orphans[start:start + batch_size]:
+            freed = _unlink_if_old(filename, cutoff)
+            if freed:
+                totals["bytes_reclaimed"] += freed + image_variants.delete(filename)
+                deleted += 1
+                originals.discard(os.path.splitext(filename)[0])
+        if deleted:
+            totals["files_deleted"] += deleted
+            _announce_deletions()
+        if progress:
+            progress(totals["blobs_deleted"] + totals["files_deleted"], 0)
+        if start + batch_size < len(orphans):
+            time.sleep(UPLOAD_GC_PAUSE)
+
+    deleted = 0
+    for filename in variants:
+        original = filename[:-len(image_names.EXTENSION)].rsplit("_", 1)[0]
+        if original not in originals:
+            freed = _unlink_if_old(filename, cutoff)
+            totals["bytes_reclaimed"] += freed
+            deleted += 1 if freed else 0
+    if deleted:
+        totals["files_deleted"] += deleted
+        _announce_deletions()
+    for filename in stale:
+        freed = _unlink_if_old(filename, cutoff)
+        totals["bytes_reclaimed"] += freed
+        totals["files_deleted"] += 1 if freed else 0
+    totals["scan_seconds"] = round(time.perf_counter() - started, 3)
+
+
+def collect_garbage(
+    db: Session,
+    grace: int = UPLOAD_GC_GRACE,
+    batch_size: int = UPLOAD_GC_BATCH,
+    progress: Optional[Callable[[int, int], None]] = None,
+    include_legacy: bool = False,
+) -> Dict[str, float]:
+    """Delete uploads unreferenced for more than `grace` seconds.
+
+    Files not named after their content are left alone unless
+    `include_legacy` is set. Returns the blobs and other files deleted, the bytes reclaimed, and
+    the number of files and time taken by the directory sweep.
+    """
+    totals = {"blobs_deleted": 0, "files_deleted": 0, "bytes_reclaimed": 0, "files_scanned": 0, "scan_seconds": 0.0}
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace)
+    _sweep_blobs(db, cutoff, batch_size, totals, progress)
+    _sweep_directory(db, time.time() - grace, batch_size, include_legacy, totals, progress)
+    return totals
+
+
+@jobs.register("upload_gc")
+def run_upload_gc_job(db: Session, payload: dict, progress) -> dict:
+    """Background job: delete unreferenced uploads"""
+    totals = collect_garbage(
+        db,
+        payload.get("grace", UPLOAD_GC_GRACE),
+        progress=progress,
+        include_legacy=payload.get("include_legacy", False),
+    )
+    message = (
+        f"Deleted {totals['blobs_deleted'] + totals['files_deleted']} unreferenced uploads, "
+        f"reclaiming {totals['bytes_reclaimed']} bytes"
+    )
+    return {"message": message, **totals}
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Delete uploaded images that nothing refers to any more")
+    parser.add_argument("--grace", type=int, default=UPLOAD_GC_GRACE, help="Keep unreferenced uploads this many seconds")
+    parser.add_argument("--batch-size", type=int, default=UPLOAD_GC_BATCH, help="Files deleted per transaction")
+    parser.add_argument(
+        "--include-legacy", action="store_true",
+        help="Also delete unreferenced files not named after their content (uploads saved before the blob store)",
+    )
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        totals = collect_garbage(session, args.grace, args.batch_size, include_legacy=args.include_legacy)
+        print(
+            f"Deleted {totals['blobs_deleted']} blobs and {totals['files_deleted']} other files, "
+            f"reclaiming {totals['bytes_reclaimed']} bytes; scanned {totals['files_scanned']} files "
+            f"in {totals['scan_seconds']}s"
+        )
+    finally:
+        session.close()
@@ -0,0 +1,240 @@
+"""Product catalog cache.
+
+`GET /products` pages and `GET /products/{id}` responses are cached as
+plain JSON-ready dicts, keyed by product id and by (category, skip, limit).
+Every write that can change what a shopper sees (product edits, stock
+adjustments, orders) bumps a catalog version that is part of every key, so
+stale entries are never served and simply age out of the LRU.
+
+The storage backend is pluggable. The default keeps entries in process
+memory with TTL + LRU eviction; setting CATALOG_CACHE_URL to a redis://
+URL shares one cache, and its invalidations, between API workers.
+
+Version counters are always shared, since a bump made by one worker must
+retire what every worker has cached. Redis keeps them next to the cache;
+with the memory backend they are rows of the cache_versions table, read
+with one primary key lookup.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from config import CATALOG_CACHE_URL, CATALOG_CACHE_TTL, CATALOG_CACHE_MAX_ENTRIES
+from database import engine
+
+try:
+    import redis
+except ImportError:  # optional dependency, only needed for a shared cache
+    redis = None
+
+
+class CacheBackend:
+    """Interface for catalog cache storage"""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: int):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def get_version(self, name: str) -> int:
+        raise NotImplementedError
+
+    def bump_version(self, name: str) -> int:
+        raise NotImplementedError
+
+    def get_versions(self, names) -> dict:
+        return {name: self.get_version(name) for name in names}
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """Thread-safe in-process cache with per-entry TTL and LRU eviction"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_version(self, name):
+        return self.get_versions([name])[name]
+
+    def get_versions(self, names):
+        versions = models.CacheVersion
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(versions.name, versions.version).where(versions.name.in_(names))
+            )
+            found = dict(rows.all())
+        return {name: found.get(name, 0) for name in names}
+
+    def bump_version(self, name):
+        versions = models.CacheVersion
+        with engine.begin() as connection:
+            bumped = connection.execute(
+                update(versions).where(versions.name == name).values(version=versions.version + 1)
+            ).rowcount
+            if not bumped:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(insert(versions).values(name=name, version=1))
+                except IntegrityError:
+                    # Another worker created the row first
+                    connection.execute(
+                        update(versions).where(versions.name == name).values(version=versions.version + 1)
+                    )
+            return connection.execute(select(versions.version).where(versions.name == name)).scalar_one()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class RedisCache(CacheBackend):
+    """Cache stored in Redis (or a Redis-compatible server) shared by all workers"""
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("CATALOG_CACHE_URL is set but the 'redis' package is not installed")
+        self._client = redis.Redis.from_url(url)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self._client.get(key)
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, json.dumps(value, default=str), ex=ttl)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def get_version(self, name):
+        return int(self._client.get(f"version:{name}") or 0)
+
+    def bump_version(self, name):
+        return self._client.incr(f"version:{name}")
+
+    def get_versions(self, names):
+        values = self._client.mget([f"version:{name}" for name in names])
+        return {name: int(value or 0) for name, value in zip(names, values)}
+
+    def stats(self):
+        info = self._client.info("stats")
+        with self._lock:
+            return {
+                "backend": "redis",
+                "hits": self.hits,
+                "misses": self.misses,
+                # Eviction and expiry are handled by the server
+                "evictions": info.get("evicted_keys", 0),
+                "expirations": info.get("expired_keys", 0),
+            }
+
+
+def build_backend() -> CacheBackend:
+    if CATALOG_CACHE_URL:
+        return RedisCache(CATALOG_CACHE_URL)
+    return MemoryCache(CATALOG_CACHE_MAX_ENTRIES)
+
+
+backend = build_backend()
+
+
+def _version() -> int:
+    return backend.get_version("catalog")
+
+
+def page_key(category: Optional[str], skip: int, limit: int,
+             cursor: Optional[str] = None, include_total: bool = True) -> str:
+    """Key for one page of GET /products.
+
+    Compute the key before querying the database: if a write bumps the
+    catalog version in between, the possibly stale result is stored under
+    the old version and never read.
+    """
+    category = category if category and category.lower() != "all" else "all"
+    return f"catalog:v{_version()}:page:{category}:{skip}:{limit}:{cursor or ''}:{int(include_total)}"
+
+
+def product_key(product_id: int) -> str:
+    """Key for GET /products/{product_id}; see page_key() for ordering"""
+    return f"catalog:v{_version()}:product:{product_id}"
+
+
+def get(key: str) -> Optional[Any]:
+    return backend.get(key)
+
+
+def put(key: str, value: Any):
+    backend.set(key, value, CATALOG_CACHE_TTL)
+
+
+def invalidate():
+    """Retire every cached product and page by bumping the catalog version.
+
+    Call after the write has been committed.
+    """
+    backend.bump_version("catalog")
+
+
+def stats() -> dict:
+    return backend.stats()
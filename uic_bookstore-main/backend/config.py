@@ -1,13 +1,111 @@
-# Database configuration
+import os
+
+# Database configuration (environment variables override the defaults)
 DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",
-    "password": "",
-    "database": "uic_bookstore",
-    "port": 3306,
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "database": os.getenv("DB_NAME", "uic_bookstore"),
+    "port": int(os.getenv("DB_PORT", "3306")),
 }
 
+# Full SQLAlchemy URL, e.g. "sqlite:///./sql_app.db" for a local stand-in.
+# When unset the MySQL URL is built from DB_CONFIG.
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # keep below MySQL's wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
 # JWT Authentication settings
 JWT_SECRET_KEY = "your-secret-key-for-jwt"  # Change this in production
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30 
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = 30 
+
+# Decoded access tokens cached per process, each until the token expires
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# Orders and order items are written in chunks of this many rows during CSV imports
+IMPORT_CHUNK_SIZE = 1000
+
+# Background jobs (CSV imports) run on a bounded thread pool so they cannot
+# starve the request handlers of database connections
+JOB_WORKERS = 2
+JOB_FILES_DIR = "job_files"
+# A running job whose heartbeat is this old is taken to have died with its
+# process and is queued again. The heartbeat is written every
+# JOB_HEARTBEAT_INTERVAL seconds while the job runs, whatever it is doing.
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "600"))  # seconds
+JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", "60"))  # seconds
+
+# Uploaded images, served at /uploads
+UPLOAD_DIR = "uploads"
+
+# Uploads are copied to disk UPLOAD_CHUNK_SIZE bytes at a time. Images over
+# UPLOAD_MAX_BYTES and CSV imports over IMPORT_MAX_BYTES are rejected with 413.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+# Uploaded images no longer referenced by any row are deleted by the upload
+# garbage collector once they have been unreferenced for UPLOAD_GC_GRACE
+# seconds, UPLOAD_GC_BATCH files per transaction
+UPLOAD_GC_GRACE = int(os.getenv("UPLOAD_GC_GRACE", "3600"))  # seconds
+UPLOAD_GC_BATCH = int(os.getenv("UPLOAD_GC_BATCH", "500"))
+UPLOAD_GC_PAUSE = float(os.getenv("UPLOAD_GC_PAUSE", "0.05"))  # seconds between batches
+
+# Serving of /uploads (see upload_serving.py). Turn SERVE_UPLOADS off when a
+# separate upload_serving process or a front proxy serves the directory.
+# Content-addressed files are cached for a year; other names for
+# UPLOAD_CACHE_MAX_AGE. Small content-addressed files are also kept in memory.
+SERVE_UPLOADS = os.getenv("SERVE_UPLOADS", "true").lower() in ("1", "true", "yes")
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", "3600"))  # seconds
+UPLOAD_MEMORY_CACHE_BYTES = int(os.getenv("UPLOAD_MEMORY_CACHE_BYTES", str(64 * 1024 * 1024)))
+UPLOAD_MEMORY_CACHE_FILE_MAX = int(os.getenv("UPLOAD_MEMORY_CACHE_FILE_MAX", str(256 * 1024)))
+# How often a process serving uploads checks whether the upload GC has
+# deleted files, and drops its memory cache if so
+UPLOAD_DELETION_POLL = float(os.getenv("UPLOAD_DELETION_POLL", "5"))  # seconds
+
+# Order transactions that hit a deadlock or lock wait timeout are retried
+# this many times in total before the error is returned
+STOCK_TX_ATTEMPTS = int(os.getenv("STOCK_TX_ATTEMPTS", "3"))
+
+# Password hashing: bcrypt cost and the dedicated hashing pool. Logins beyond
+# PASSWORD_HASH_MAX_PENDING queued hashes are rejected with 503.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))  # seconds
+
+# Product catalog cache. Leave CATALOG_CACHE_URL unset for a per-process
+# in-memory cache, or point it at redis://host:6379/0 to share it between workers.
+CATALOG_CACHE_URL = os.getenv("CATALOG_CACHE_URL")
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "60"))  # seconds
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "1000"))
+
+# Live notification stream. Leave NOTIFICATION_BROKER_URL unset to deliver
+# events within one process; point it at Redis to relay them between workers
+NOTIFICATION_BROKER_URL = os.getenv("NOTIFICATION_BROKER_URL")
+NOTIFICATION_STREAM_HEARTBEAT = int(os.getenv("NOTIFICATION_STREAM_HEARTBEAT", "15"))  # seconds
+NOTIFICATION_STREAM_QUEUE = int(os.getenv("NOTIFICATION_STREAM_QUEUE", "100"))  # events buffered per connection
+
+# Read notifications older than NOTIFICATION_RETENTION_DAYS are deleted by the
+# retention job, NOTIFICATION_RETENTION_BATCH rows per transaction
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+NOTIFICATION_RETENTION_BATCH = int(os.getenv("NOTIFICATION_RETENTION_BATCH", "1000"))
+NOTIFICATION_RETENTION_PAUSE = float(os.getenv("NOTIFICATION_RETENTION_PAUSE", "0.05"))  # seconds between batches
+
+# Product edits and stock adjustments for the same product within
+# NOTIFICATION_COALESCE_WINDOW seconds are merged into one notification per
+# subscriber, flushed every NOTIFICATION_FLUSH_INTERVAL seconds. 0 notifies immediately.
+NOTIFICATION_COALESCE_WINDOW = int(os.getenv("NOTIFICATION_COALESCE_WINDOW", "60"))  # seconds
+NOTIFICATION_FLUSH_INTERVAL = int(os.getenv("NOTIFICATION_FLUSH_INTERVAL", "5"))  # seconds
+
+# Resized copies of uploaded images (thumbnail, card, full) are written by
+# IMAGE_WORKERS background threads in this format and quality
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_VARIANT_FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "WEBP")  # WEBP, AVIF or JPEG
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
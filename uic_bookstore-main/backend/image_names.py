@@ -0,0 +1,51 @@
+"""Names of uploaded images and of their resized variants.
+
+Images stored by blob_store.py are named after the SHA-256 of their
+content, and image_variants.py writes their variants next to them:
+
+    <sha256>.jpg -> <sha256>_full.webp   (at most 1600px)
+                    <sha256>_card.webp   (at most 480px)
+                    <sha256>_thumb.webp  (at most 160px)
+
+Variant names follow from the image's name alone, so the API lists them
+without touching the disk, once upload_blobs records that they were
+written. Kept apart from image_variants.py so the models do not import
+Pillow and its worker pool.
+"""
+import os
+import re
+from typing import Dict, Optional
+
+from config import IMAGE_VARIANT_FORMAT
+
+# Variant name -> longest edge in pixels, largest first: each variant is
+# resized from the one before it
+VARIANTS = (("full", 1600), ("card", 480), ("thumb", 160))
+
+EXTENSION = {"WEBP": ".webp", "AVIF": ".avif", "JPEG": ".jpg"}[IMAGE_VARIANT_FORMAT.upper()]
+
+# <sha256><extension>, or a variant of one
+CONTENT_ADDRESSED_PATTERN = (
+    r"[0-9a-f]{64}(_(" + "|".join(variant for variant, _ in VARIANTS) + r"))?\.[a-z0-9]+"
+)
+CONTENT_ADDRESSED = re.compile(CONTENT_ADDRESSED_PATTERN)
+
+
+def variant_filename(filename: str, variant: str) -> str:
+    return f"{os.path.splitext(filename)[0]}_{variant}{EXTENSION}"
+
+
+def is_variant(filename: str) -> bool:
+    stem = os.path.splitext(filename)[0]
+    return filename.endswith(EXTENSION) and any(stem.endswith(f"_{variant}") for variant, _ in VARIANTS)
+
+
+def variant_names(filename: Optional[str]) -> Optional[Dict[str, str]]:
+    """{variant: filename under /uploads} for a stored image, else None.
+
+    Only images stored by content hash have variants; callers check that
+    they have been written (upload_blobs.variants_ready) before listing them.
+    """
+    if not filename or not CONTENT_ADDRESSED.fullmatch(filename) or is_variant(filename):
+        return None
+    return {variant: variant_filename(filename, variant) for variant, _ in VARIANTS}
@@ -0,0 +1,178 @@
+"""Resized variants of uploaded images.
+
+Product images and profile pictures are kept as uploaded, and a small
+thread pool writes three downscaled copies next to each one in
+IMAGE_VARIANT_FORMAT (WebP by default), named as described in
+image_names.py.
+
+The upload request only schedules the work. Once every variant is
+written the image's upload_blobs row is marked, and only then does the
+API list the variants; until then clients use the original. Pillow
+releases the GIL while decoding, resizing and encoding, so threads are
+enough to use IMAGE_WORKERS cores. Run this module directly to create
+variants for stored images that lack them, and to mark images whose
+variants were written before upload_blobs recorded them:
+
+    python image_variants.py
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from PIL import Image, ImageOps
+from sqlalchemy import update
+
+import models
+from config import UPLOAD_DIR, IMAGE_WORKERS, IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_QUALITY
+from database import engine
+from image_names import VARIANTS, EXTENSION, CONTENT_ADDRESSED, variant_filename, is_variant
+
+executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+# Images with variants being written; identical uploads share one file, so
+# the same image can be scheduled again before its first run finishes
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+
+
+class VariantMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.total_ms = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, duration: float, bytes_in: int, bytes_out: int):
+        with self._lock:
+            self.processed += 1
+            self.total_ms += duration * 1000
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def fail(self):
+        with self._lock:
+            self.failed += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "workers": IMAGE_WORKERS,
+                "format": IMAGE_VARIANT_FORMAT,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_ms": round(self.total_ms / self.processed, 3) if self.processed else None,
+                "original_bytes": self.bytes_in,
+                "variant_bytes": self.bytes_out,
+            }
+
+
+metrics = VariantMetrics()
+
+
+def has_variants(filename: str) -> bool:
+    # The smallest variant is written last, so it marks a complete set
+    return os.path.exists(os.path.join(UPLOAD_DIR, variant_filename(filename, VARIANTS[-1][0])))
+
+
+def mark_generated(filename: str):
+    """Record that an image's variants exist, so the API starts listing them"""
+    blobs = models.UploadBlob
+    with engine.begin() as connection:
+        connection.execute(
+            update(blobs).where(blobs.filename == filename, blobs.variants_ready.is_(False)).values(variants_ready=True)
+        )
+
+
+def _prepare(image: Image.Image) -> Image.Image:
+    # Apply the camera's orientation before the EXIF data is dropped
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    if image.mode == "RGBA" and IMAGE_VARIANT_FORMAT.upper() == "JPEG":
+        image = image.convert("RGB")
+    return image
+
+
+def generate(filename: str) -> int:
+    """Write every variant of an uploaded image; returns the bytes written"""
+    source = os.path.join(UPLOAD_DIR, filename)
+    written = 0
+    with Image.open(source) as image:
+        # Let JPEG decoding skip detail the largest variant cannot show
+        image.draft("RGB", (VARIANTS[0][1], VARIANTS[0][1]))
+        image = _prepare(image)
+        for variant, size in VARIANTS:
+            image.thumbnail((size, size), Image.LANCZOS)
+            target = os.path.join(UPLOAD_DIR, variant_filename(filename, variant))
+            temporary = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(temporary, format=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY)
+            os.replace(temporary, target)
+            written += os.path.getsize(target)
+    return written
+
+
+def _run(filename: str, on_done: Optional[Callable[[], None]]):
+    started = time.perf_counter()
+    try:
+        written = generate(filename)
+        mark_generated(filename)
+    except Exception as e:
+        metrics.fail()
+        print(f"Could not create image variants for {filename}: {str(e)}")
+        return
+    finally:
+        with _in_progress_lock:
+            _in_progress.discard(filename)
+    metrics.record(time.perf_counter() - started, os.path.getsize(os.path.join(UPLOAD_DIR, filename)), written)
+    if on_done:
+        on_done()
+
+
+def schedule(filename: str, on_done: Optional[Callable[[], None]] = None):
+    """Create an uploaded image's variants in the background.
+
+    on_done runs on the worker once they exist and are marked. Images
+    stored earlier with the same content already have theirs.
+    """
+    if has_variants(filename):
+        return
+    with _in_progress_lock:
+        if filename in _in_progress:
+            return
+        _in_progress.add(filename)
+    executor.submit(_run, filename, on_done)
+
+
+def delete(filename: Optional[str]) -> int:
+    """Remove an image's variants (the original is the caller's); returns the bytes freed"""
+    freed = 0
+    if not filename:
+        return freed
+    for variant, _ in VARIANTS:
+        path = os.path.join(UPLOAD_DIR, variant_filename(filename, variant))
+        if os.path.exists(path):
+            freed += os.path.getsize(path)
+            os.remove(path)
+    return freed
+
+
+def stats() -> dict:
+    return metrics.snapshot()
+
+
+if __name__ == "__main__":
+    images = [name for name in sorted(os.listdir(UPLOAD_DIR)) if CONTENT_ADDRESSED.fullmatch(name) and not is_variant(name)]
+    pending = [name for name in images if not has_variants(name)]
+    for name in images:
+        if name not in pending:
+            mark_generated(name)
+    started = time.perf_counter()
+    list(executor.map(lambda name: _run(name, None), pending))
+    print(
+        f"Created variants for {metrics.processed} images ({metrics.failed} failed) in {time.perf_counter() - started:.1f}s; "
+        f"{len(images) - len(pending)} already had them"
+    )
@@ -0,0 +1,230 @@
+"""Stock reservation.
+
+Stock is only ever changed with single-statement conditional updates
+(`stock = stock - :q WHERE stock >= :q`), so two orders racing for the last
+unit cannot both succeed and no read-modify-write window exists. Rows are
+touched in product-id order so concurrent multi-item orders lock them in
+the same sequence, and the whole order transaction is retried if the
+database still reports a deadlock.
+
+Hot products can have their stock split across rows of
+product_stock_shards (products.stock_shards = N, products.stock = 0), so
+orders decrement one randomly chosen shard instead of all queueing on the
+product row. A product's stock level is always products.stock plus its
+shards; levels() and stock_level_column() consolidate it for readers.
+"""
+import random
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import models
+from config import STOCK_TX_ATTEMPTS
+
+# MySQL: deadlock found, lock wait timeout exceeded
+RETRYABLE_MYSQL_ERRORS = {1213, 1205}
+
+MAX_SHARDS = 64
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: int, requested: int, available: int):
+        super().__init__(f"Product {product_id}: requested {requested}, available {available}")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+def collapse(lines: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    """Sum (product_id, quantity) lines into one quantity per product"""
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def reserve(db: Session, quantities: Dict[int, int], shard_counts: Optional[Dict[int, int]] = None):
+    """Take stock for every product or raise OutOfStock, in the caller's transaction.
+
+    `shard_counts` maps product ids to their stock_shards value. On
+    OutOfStock the caller must roll back to undo reservations already made.
+    """
+    shard_counts = shard_counts or {}
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        if shard_counts.get(product_id):
+            _reserve_sharded(db, product_id, quantity, shard_counts[product_id])
+            continue
+        result = db.execute(
+            update(models.Product)
+            .where(models.Product.id == product_id, models.Product.stock >= quantity)
+            .values(stock=models.Product.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            available = db.query(models.Product.stock).filter(models.Product.id == product_id).scalar()
+            raise OutOfStock(product_id, quantity, available or 0)
+
+
+def _reserve_sharded(db: Session, product_id: int, quantity: int, shards: int):
+    # Start at a random shard so concurrent orders spread over the rows
+    start = random.randrange(shards)
+    for offset in range(shards):
+        result = db.execute(
+            update(models.StockShard)
+            .where(
+                models.StockShard.product_id == product_id,
+                models.StockShard.shard == (start + offset) % shards,
+                models.StockShard.stock >= quantity,
+            )
+            .values(stock=models.StockShard.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return
+
+    # No single shard holds enough: lock them all and take from several
+    rows = _locked_shards(db, product_id)
+    available = sum(row.stock for row in rows)
+    if available < quantity:
+        raise OutOfStock(product_id, quantity, available)
+    remaining = quantity
+    for row in rows:
+        taken = min(row.stock, remaining)
+        row.stock -= taken
+        remaining -= taken
+    db.flush()
+
+
+def _locked_shards(db: Session, product_id: int) -> List[models.StockShard]:
+    return (
+        db.query(models.StockShard)
+        .filter(models.StockShard.product_id == product_id)
+        .order_by(models.StockShard.shard)
+        .with_for_update()
+        .all()
+    )
+
+
+def _distribute(level: int, shards: int) -> List[int]:
+    base, extra = divmod(level, shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+def release(db: Session, quantities: Dict[int, int], shard_counts: Optional[Dict[int, int]] = None):
+    """Return stock, e.g. when an order is deleted"""
+    shard_counts = shard_counts or {}
+    for product_id in sorted(quantities):
+        if shard_counts.get(product_id):
+            db.execute(
+                update(models.StockShard)
+                .where(
+                    models.StockShard.product_id == product_id,
+                    models.StockShard.shard == random.randrange(shard_counts[product_id]),
+                )
+                .values(stock=models.StockShard.stock + quantities[product_id])
+                .execution_options(synchronize_session=False)
+            )
+            continue
+        db.execute(
+            update(models.Product)
+            .where(models.Product.id == product_id)
+            .values(stock=models.Product.stock + quantities[product_id])
+            .execution_options(synchronize_session=False)
+        )
+
+
+def stock_level_column():
+    """SQL expression for a product's consolidated stock level"""
+    shard_total = (
+        select(func.coalesce(func.sum(models.StockShard.stock), 0))
+        .where(models.StockShard.product_id == models.Product.id)
+        .scalar_subquery()
+    )
+    return models.Product.stock + shard_total
+
+
+def stock_level_sql(alias: str = "products") -> str:
+    """stock_level_column() for raw SQL queries over `products AS alias`"""
+    return (
+        f"({alias}.stock + COALESCE((SELECT SUM(sh.stock) FROM product_stock_shards sh "
+        f"WHERE sh.product_id = {alias}.id), 0))"
+    )
+
+
+def levels(db: Session, products: List[models.Product]) -> Dict[int, int]:
+    """Consolidated stock for loaded products; only sharded ones cost a query"""
+    result = {product.id: product.stock for product in products}
+    sharded = [product.id for product in products if product.stock_shards]
+    if sharded:
+        rows = (
+            db.query(models.StockShard.product_id, func.sum(models.StockShard.stock))
+            .filter(models.StockShard.product_id.in_(sharded))
+            .group_by(models.StockShard.product_id)
+        )
+        for product_id, shard_total in rows:
+            result[product_id] += int(shard_total or 0)
+    return result
+
+
+def lock_level(db: Session, product: models.Product) -> int:
+    """Consolidated stock with the shard rows locked; lock the product row first"""
+    if not product.stock_shards:
+        return product.stock
+    return product.stock + sum(row.stock for row in _locked_shards(db, product.id))
+
+
+def set_level(db: Session, product: models.Product, level: int):
+    """Overwrite a product's stock level, spreading it over its shards if it has any"""
+    rows = _locked_shards(db, product.id) if product.stock_shards else []
+    if not rows:
+        product.stock = level
+        return
+    product.stock = 0
+    for row, amount in zip(rows, _distribute(level, len(rows))):
+        row.stock = amount
+
+
+def configure_shards(db: Session, product: models.Product, shards: int):
+    """Switch a product between plain and sharded stock, keeping its level.
+
+    The caller should hold the product row lock (SELECT ... FOR UPDATE).
+    """
+    level = lock_level(db, product)
+    db.execute(delete(models.StockShard).where(models.StockShard.product_id == product.id))
+    product.stock_shards = shards
+    if shards:
+        product.stock = 0
+        db.add_all([
+            models.StockShard(product_id=product.id, shard=shard, stock=amount)
+            for shard, amount in enumerate(_distribute(level, shards))
+        ])
+    else:
+        product.stock = level
+    db.flush()
+
+
+def is_retryable(error: OperationalError) -> bool:
+    orig = error.orig
+    code = orig.args[0] if getattr(orig, "args", None) else None
+    return code in RETRYABLE_MYSQL_ERRORS or "database is locked" in str(orig)
+
+
+def run_transaction(db: Session, work: Callable, attempts: int = STOCK_TX_ATTEMPTS):
+    """Run work() and retry it from scratch on deadlock or lock timeout.
+
+    work() must do all of its reads and writes in `db` and commit; it is
+    rolled back before each retry.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return work()
+        except OperationalError as e:
+            db.rollback()
+            if attempt == attempts or not is_retryable(e):
+                raise
+            # Short jittered backoff so the competing transactions do not collide again
+            time.sleep(random.uniform(0, 0.05 * attempt))
@@ -0,0 +1,245 @@
+"""Database-backed background jobs.
+
+Jobs are rows in the `jobs` table. The API inserts a queued row and hands
+the id to a small thread pool; a worker claims the row with a conditional
+UPDATE, runs the registered handler in its own session and records the
+outcome. Because the queue lives in the database, jobs that were still
+queued when a process stopped are picked up again on startup, and several
+API processes can share the table without running a job twice.
+
+Handlers report progress after each unit of work. The report is written
+through the handler's session and commits the work done so far with it,
+along with an optional checkpoint. While a handler runs, a timer thread
+writes the job's heartbeat every JOB_HEARTBEAT_INTERVAL seconds, so long
+steps that report nothing (a validation pass, a directory scan) do not
+look like a dead job. A running job whose heartbeat is older than
+JOB_STALE_AFTER seconds belonged to a process that died; it is queued
+again and its handler finds the last checkpoint in payload["checkpoint"].
+
+A job's input file, payload["path"] under JOB_FILES_DIR, is removed once
+the job is recorded as completed or failed, and kept for the retry
+otherwise.
+"""
+import json
+import os
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+import models
+from config import JOB_WORKERS, JOB_FILES_DIR, JOB_STALE_AFTER, JOB_HEARTBEAT_INTERVAL
+from database import SessionLocal, engine
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Job type -> handler(db, payload, progress) returning a JSON-serialisable result.
+# progress(processed, rejected, checkpoint=None) commits the handler's session.
+HANDLERS: Dict[str, Callable] = {}
+
+# Bounded so background work cannot take every database connection away
+# from the request handlers
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+os.makedirs(JOB_FILES_DIR, exist_ok=True)
+
+
+class JobError(Exception):
+    """Raised by handlers for expected failures; the message is shown to the user"""
+
+
+def register(job_type: str):
+    """Decorator registering a handler for a job type"""
+    def decorator(handler: Callable):
+        HANDLERS[job_type] = handler
+        return handler
+    return decorator
+
+
+def enqueue(db: Session, job_type: str, payload: Optional[dict] = None) -> models.Job:
+    """Persist a queued job and schedule it on the worker pool"""
+    if job_type not in HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+
+    job = models.Job(type=job_type, status=QUEUED, payload=json.dumps(payload or {}))
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    executor.submit(run_job, job.id)
+    return job
+
+
+def _progress(db: Session, job_id: int):
+    """Progress callback writing through the job's own session.
+
+    Committing here makes the handler's work so far durable together with
+    the counts and checkpoint describing it, so a job picked up again after
+    a crash resumes exactly where its last commit left off.
+    """
+    def report(processed: int, rejected: int, checkpoint: Optional[dict] = None):
+        values = {
+            "processed_count": processed,
+            "rejected_count": rejected,
+            "heartbeat_at": datetime.datetime.utcnow(),
+        }
+        if checkpoint is not None:
+            values["checkpoint"] = json.dumps(checkpoint)
+        db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    return report
+
+
+def _beat(job_id: int, stop: threading.Event):
+    # Runs on its own connection: the handler's session belongs to its thread
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    update(models.Job)
+                    .where(models.Job.id == job_id, models.Job.status == RUNNING)
+                    .values(heartbeat_at=datetime.datetime.utcnow())
+                )
+        except Exception as e:
+            print(f"Job {job_id} heartbeat failed: {str(e)}")
+
+
+def _remove_job_file(payload: dict):
+    path = payload.get("path")
+    if not path:
+        return
+    directory = os.path.abspath(JOB_FILES_DIR)
+    if os.path.dirname(os.path.abspath(path)) == directory and os.path.exists(path):
+        os.remove(path)
+
+
+def _finish(db: Session, job_id: int, status: str, result=None, error: Optional[str] = None):
+    values = {"status": status, "finished_at": datetime.datetime.utcnow(), "error": error}
+    if result is not None:
+        values["result"] = json.dumps(result, default=str)
+    db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def run_job(job_id: int):
+    """Claim and run one job. Safe to call for a job another worker already took."""
+    db = SessionLocal()
+    now = datetime.datetime.utcnow()
+    try:
+        claimed = db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == QUEUED)
+            .values(status=RUNNING, started_at=func.coalesce(models.Job.started_at, now), heartbeat_at=now)
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return
+
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        job_type = job.type
+        handler = HANDLERS[job_type]
+        payload = json.loads(job.payload or "{}")
+        if job.checkpoint:
+            payload["checkpoint"] = json.loads(job.checkpoint)
+
+        stop_beating = threading.Event()
+        threading.Thread(
+            target=_beat, args=(job_id, stop_beating), name=f"job-{job_id}-heartbeat", daemon=True
+        ).start()
+        try:
+            result = handler(db, payload, _progress(db, job_id))
+        except JobError as e:
+            db.rollback()
+            _finish(db, job_id, FAILED, error=str(e))
+        except Exception as e:
+            db.rollback()
+            print(f"Job {job_id} ({job_type}) failed: {str(e)}")
+            _finish(db, job_id, FAILED, error=f"Unexpected error: {str(e)}")
+        else:
+            # Commits whatever the handler left uncommitted with the outcome
+            _finish(db, job_id, COMPLETED, result=result)
+        finally:
+            stop_beating.set()
+        # Only reached once the outcome is committed: a job that could not
+        # be finished stays running and is retried with its file
+        _remove_job_file(payload)
+    finally:
+        db.close()
+
+
+def requeue_stale_jobs() -> int:
+    """Queue running jobs whose heartbeat stopped again; returns how many"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=JOB_STALE_AFTER)
+    db = SessionLocal()
+    try:
+        requeued = db.execute(
+            update(models.Job)
+            .where(
+                models.Job.status == RUNNING,
+                func.coalesce(models.Job.heartbeat_at, models.Job.started_at) < cutoff
+            )
+            .values(status=QUEUED)
+        ).rowcount
+        db.commit()
+    finally:
+        db.close()
+    return requeued
+
+
+def _schedule_queued_jobs():
+    db = SessionLocal()
+    try:
+        job_ids = [
+            job_id for (job_id,) in db.query(models.Job.id)
+            .filter(models.Job.status == QUEUED)
+            .order_by(models.Job.created_at)
+        ]
+    finally:
+        db.close()
+
+    # run_job claims each job, so one already taken by another worker is skipped
+    for job_id in job_ids:
+        executor.submit(run_job, job_id)
+
+
+def _watch_stale_jobs():
+    while True:
+        time.sleep(JOB_STALE_AFTER)
+        try:
+            if requeue_stale_jobs():
+                _schedule_queued_jobs()
+        except Exception as e:
+            print(f"Checking for stale jobs failed: {str(e)}")
+
+
+def resume_queued_jobs():
+    """Schedule jobs left queued, or left running by a crash, in a previous run of the API.
+
+    A job that was running when its process died is only recognised once its
+    heartbeat is JOB_STALE_AFTER seconds old, so a thread keeps checking.
+    """
+    requeue_stale_jobs()
+    _schedule_queued_jobs()
+    threading.Thread(target=_watch_stale_jobs, name="job-watchdog", daemon=True).start()
+
+
+def job_file_path(name: str) -> str:
+    """Location for files a job needs to read after the request has finished"""
+    return os.path.join(JOB_FILES_DIR, name)
@@ -1,24 +1,44 @@
 from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, selectinload, joinedload
 from typing import List, Optional, Dict, Any
 from datetime import timedelta, datetime, date
 import os
-import shutil
 import uuid
 from sqlalchemy import func, and_, text
 from decimal import Decimal
-from passlib.context import CryptContext
 import time
-import csv
-from io import StringIO
+import json
 
 import models
 import schemas
 import auth
-from database import engine, get_db
+import sales_rollup
+import order_stats
+import inventory
+import stock_adjustments
+import order_import
+import jobs
+import notifications
+import notification_stream
+import notification_retention
+import notification_coalescing
+import passwords
+import catalog_cache
+import conditional
+import pagination
+import product_search
+import image_variants
+import uploads
+import blob_store
+import upload_serving
+from query_helpers import within_days
+from config import UPLOAD_DIR, SERVE_UPLOADS
+from database import engine, get_db, SessionLocal
+from pool_metrics import pool_status
 from schemas import (
     FeedbackCreate, FeedbackResponse, FeedbackUpdate, AdminUserCreate, AdminUserResponse, AdminUserLogin, AdminUserUpdate, AdminAddressUpdate, AdminPasswordUpdate
 )
@@ -27,11 +47,19 @@ from schemas import (
 models.Base.metadata.create_all(bind=engine)
 
 # Create uploads directory if it doesn't exist
-UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 app = FastAPI(title="UIC Bookstore API")
 
+# Endpoints are plain `def` functions: they use the blocking SQLAlchemy Session
+# and bcrypt, so FastAPI runs them in its threadpool instead of on the event loop.
+# The notification stream is the exception: it is async so that idle
+# connections do not each hold a thread.
+
+# Cap upload sizes while the request body streams in (see uploads.py). Added
+# before CORS so the 413 still carries the CORS headers.
+app.add_middleware(uploads.UploadLimitMiddleware)
+
 # Add CORS middleware to allow frontend to connect
 app.add_middleware(
     CORSMiddleware,
@@ -41,15 +69,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount uploads directory to serve files
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# Mount uploads directory to serve files, with long-lived cache headers for
+# content-addressed images; off when another process or a proxy serves them
+if SERVE_UPLOADS:
+    app.mount("/uploads", upload_serving.files, name="uploads")
+
+# ETag + If-None-Match handling for polled read endpoints, keyed on the
+# version counters of the tables each response is built from
+CATALOG_ETAG = Depends(conditional.conditional_get(conditional.CATALOG, cache_control=conditional.PUBLIC_REVALIDATE))
+REPORT_ETAG = Depends(conditional.conditional_get(conditional.CATALOG, conditional.ORDERS))
+NOTIFICATIONS_ETAG = Depends(conditional.conditional_get(conditional.NOTIFICATIONS, principal=auth.current_student_id))
+
+# Pick up background jobs that were still queued when the API last stopped
+@app.on_event("startup")
+def resume_background_jobs():
+    jobs.resume_queued_jobs()
 
-# Initialize password context for hashing if not already present
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Merge bursts of product notifications (see notification_coalescing.py)
+@app.on_event("startup")
+def start_notification_flush():
+    notification_coalescing.start_flusher()
 
 # Auth endpoints
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
@@ -59,7 +102,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         )
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=auth.student_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -106,7 +149,7 @@ def login_student(form_data: schemas.StudentLogin, db: Session = Depends(get_db)
     
     # Generate JWT token
     access_token = auth.create_access_token(
-        data={"sub": user.email}
+        data=auth.student_claims(user)
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
@@ -130,7 +173,7 @@ def read_users_me(student_id: Optional[str] = None, email: Optional[str] = None,
     return student
 
 @app.put("/students/profile", response_model=schemas.StudentResponse)
-async def update_profile(
+def update_profile(
     name: str = Form(...),
     profile_picture: Optional[UploadFile] = File(None),
     student_id: int = Form(...),
@@ -154,36 +197,26 @@ async def update_profile(
     
     # Handle profile picture upload
     if profile_picture:
-        # Validate file type
-        if not profile_picture.content_type.startswith("image/"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File must be an image"
-            )
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(profile_picture.filename)[1]
-        new_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, new_filename)
-        
-        print(f"Saving profile picture to {file_path}")
+        # Store under its content hash; rejects files that are not images
+        filename = blob_store.store_image(db, profile_picture)
+        print(f"Saved profile picture as {filename}")
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(profile_picture.file, buffer)
-        
-        # Update user's profile picture in database
-        student.profile_picture = new_filename
+        # Update user's profile picture in database; the old one is
+        # deleted by the upload GC once nothing uses it
+        blob_store.release(db, student.profile_picture)
+        student.profile_picture = filename
     
     # Save changes
     db.commit()
     db.refresh(student)
+    if profile_picture:
+        image_variants.schedule(student.profile_picture)
     
     print(f"Profile updated successfully for {student.name}")
     return student
 
 @app.put("/students/change-password", response_model=dict)
-async def change_student_password(
+def change_student_password(
     password_data: dict,
     db: Session = Depends(get_db)
 ):
@@ -210,13 +243,31 @@ async def change_student_password(
     return {"message": "Password changed successfully"}
 
 # Product management endpoints
-@app.get("/products", response_model=schemas.ProductList)
+def serialize_products(db: Session, products: List[models.Product]) -> List[dict]:
+    """ProductResponse dicts with sharded products' stock consolidated"""
+    levels = inventory.levels(db, products)
+    serialized = []
+    for product in products:
+        data = schemas.ProductResponse.model_validate(product).model_dump(mode="json")
+        data["stock"] = levels[product.id]
+        serialized.append(data)
+    return serialized
+
+@app.get("/products", response_model=schemas.ProductList, dependencies=[CATALOG_ETAG])
 def get_products(
     skip: int = 0, 
     limit: int = 100,
     category: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; replaces skip"),
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ):
+    # Serve from the catalog cache when possible
+    cache_key = catalog_cache.page_key(category, skip, limit, cursor, include_total)
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     query = db.query(models.Product)
     
     # Filter by category if provided
@@ -224,24 +275,63 @@ def get_products(
         query = query.filter(models.Product.category == category)
     
     # Get total count for pagination
-    total = query.count()
+    total = query.count() if include_total else None
     
-    # Apply pagination
-    products = query.offset(skip).limit(limit).all()
+    # Apply pagination: keyset on id when a cursor is given, offset otherwise
+    query = query.order_by(models.Product.id)
+    if cursor:
+        (last_id,) = pagination.decode_cursor(cursor, (int,))
+        query = query.filter(models.Product.id > last_id)
+    else:
+        query = query.offset(skip)
+    products = query.limit(limit).all()
+    
+    page = {
+        "products": serialize_products(db, products),
+        "total": total,
+        "next_cursor": pagination.next_cursor(products, limit, lambda p: (p.id,))
+    }
+    catalog_cache.put(cache_key, page)
     
-    return {"products": products, "total": total}
+    return page
 
-@app.get("/products/{product_id}", response_model=schemas.ProductResponse)
+@app.get("/products/search", response_model=schemas.ProductSearchResponse, dependencies=[CATALOG_ETAG])
+def search_products(
+    q: str = Query(..., min_length=1, description="Search words; the last one also matches as a prefix"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Ranked product search over name, category, size and description"""
+    product_ids, total = product_search.search(db, q, limit)
+    
+    # Load the matches and keep them in rank order
+    products = {
+        product.id: product
+        for product in db.query(models.Product).filter(models.Product.id.in_(product_ids))
+    } if product_ids else {}
+    ranked = [products[product_id] for product_id in product_ids if product_id in products]
+    
+    return {"products": serialize_products(db, ranked), "total": total}
+
+@app.get("/products/{product_id}", response_model=schemas.ProductResponse, dependencies=[CATALOG_ETAG])
 def get_product(product_id: int, db: Session = Depends(get_db)):
+    cache_key = catalog_cache.product_key(product_id)
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     product = db.query(models.Product).filter(models.Product.id == product_id).first()
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    return product
+    response = serialize_products(db, [product])[0]
+    catalog_cache.put(cache_key, response)
+    
+    return response
 
 @app.post("/admin/products", response_model=schemas.ProductResponse)
-async def create_product(
+def create_product(
     name: str = Form(...),
     category: str = Form(...),
     price: float = Form(...),
@@ -267,34 +357,23 @@ async def create_product(
     
     # Handle image upload
     if image:
-        # Validate file type
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File must be an image"
-            )
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(image.filename)[1]
-        new_filename = f"product_{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, new_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        
-        # Set image URL
-        product.image_url = new_filename
+        # Store under its content hash; rejects files that are not images
+        product.image_url = blob_store.store_image(db, image)
     
     # Add to database
     db.add(product)
     db.commit()
     db.refresh(product)
+    catalog_cache.invalidate()
+    product_search.index.put(product)
+    if product.image_url:
+        # The catalog lists the variants once they are written
+        image_variants.schedule(product.image_url, on_done=catalog_cache.invalidate)
     
     return product
 
 @app.put("/admin/products/{product_id}", response_model=schemas.ProductResponse)
-async def update_product(
+def update_product(
     product_id: int,
     name: Optional[str] = Form(None),
     category: Optional[str] = Form(None),
@@ -313,85 +392,66 @@ async def update_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Track changes for notifications
+    # Track (field, old value, new value) changes for notifications
     changes = []
     
     # Update fields if provided
     if name is not None and name != product.name:
-        changes.append(f"Name updated from '{product.name}' to '{name}'")
+        changes.append(("name", product.name, name))
         product.name = name
     if category is not None and category != product.category:
-        changes.append(f"Category updated from '{product.category}' to '{category}'")
+        changes.append(("category", product.category, category))
         product.category = category
     if price is not None and float(price) != float(product.price):
-        changes.append(f"Price updated from ₱{product.price} to ₱{price}")
+        changes.append(("price", product.price, price))
         product.price = price
     if cost_price is not None and float(cost_price) != float(product.cost_price):
-        changes.append(f"Cost price updated from ₱{product.cost_price} to ₱{cost_price}")
+        changes.append(("cost_price", product.cost_price, cost_price))
         product.cost_price = cost_price
-    if stock is not None and stock != product.stock:
-        changes.append(f"Stock updated from {product.stock} to {stock}")
-        product.stock = stock
+    current_stock = inventory.levels(db, [product])[product.id]
+    if stock is not None and stock != current_stock:
+        changes.append(("stock", current_stock, stock))
+        inventory.set_level(db, product, stock)
     if min_stock is not None and min_stock != product.min_stock:
-        changes.append(f"Minimum stock level updated from {product.min_stock or 'none'} to {min_stock}")
+        changes.append(("min_stock", product.min_stock, min_stock))
         product.min_stock = min_stock
     if description is not None and description != product.description:
-        changes.append("Description updated")
+        changes.append(("description", None, None))
         product.description = description
     if size is not None and size != product.size:
-        changes.append(f"Size updated from '{product.size or 'none'}' to '{size}'")
+        changes.append(("size", product.size, size))
         product.size = size
     
     # Handle image upload
     if image:
-        # Validate file type
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File must be an image"
-            )
+        # Store the new image first so a rejected upload leaves the old one in place
+        new_filename = blob_store.store_image(db, image)
         
-        # Delete old image if exists
-        if product.image_url:
-            old_image_path = os.path.join(UPLOAD_DIR, product.image_url)
-            if os.path.exists(old_image_path):
-                os.remove(old_image_path)
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(image.filename)[1]
-        new_filename = f"product_{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, new_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+        # The old image and its variants are deleted by the upload GC once
+        # nothing uses them
+        blob_store.release(db, product.image_url)
         
         # Set image URL
-        changes.append("Product image updated")
+        changes.append(("image", None, None))
         product.image_url = new_filename
     
-    # Create notifications for subscribers if there are changes
-    if changes:
-        # Get all students who subscribed to this product
-        subscribers = db.query(models.ProductSubscription).filter(
-            models.ProductSubscription.product_id == product_id
-        ).all()
-        
-        # Create a notification for each subscriber
-        for subscription in subscribers:
-            notification = models.Notification(
-                student_id=subscription.student_id,
-                product_id=product_id,
-                message=f"Product '{product.name}' has been updated: {', '.join(changes)}",
-                type="product_update"
-            )
-            db.add(notification)
+    # Notify subscribers if there are changes, now or merged with other
+    # changes to this product when notifications are coalesced
+    messages = notification_coalescing.notify_product_update(db, product, changes) if changes else {}
     
     # Save changes
     db.commit()
     db.refresh(product)
+    catalog_cache.invalidate()
+    product_search.index.put(product)
+    if image:
+        image_variants.schedule(product.image_url, on_done=catalog_cache.invalidate)
+    if messages:
+        conditional.bump(conditional.NOTIFICATIONS)
+    for message in messages.values():
+        notification_stream.publish_product(product_id, message, "product_update")
     
-    return product
+    return serialize_products(db, [product])[0]
 
 @app.delete("/admin/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_product(product_id: int, db: Session = Depends(get_db)):
@@ -401,15 +461,17 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Delete image if exists
-    if product.image_url:
-        image_path = os.path.join(UPLOAD_DIR, product.image_url)
-        if os.path.exists(image_path):
-            os.remove(image_path)
+    # The image and its variants are deleted by the upload GC once nothing uses them
+    blob_store.release(db, product.image_url)
     
     # Delete from database
+    notifications.forget_product(db, product_id)
     db.delete(product)
     db.commit()
+    catalog_cache.invalidate()
+    product_search.index.delete(product_id)
+    # The product's notifications are removed by the cascade
+    conditional.bump(conditional.NOTIFICATIONS)
     
     return None
 
@@ -417,48 +479,31 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
 @app.post("/admin/stock/adjust", response_model=schemas.StockAdjustmentResponse)
 def adjust_stock(adjustment: schemas.StockAdjustmentCreate, db: Session = Depends(get_db)):
     try:
-        # Verify product exists
-        product = db.query(models.Product).filter(models.Product.id == adjustment.product_id).first()
+        # Verify product exists, locking its row until the adjustment commits
+        product = (
+            db.query(models.Product)
+            .filter(models.Product.id == adjustment.product_id)
+            .with_for_update()
+            .first()
+        )
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        # Validate adjustment type
-        valid_types = ["add", "remove", "set"]
-        if adjustment.type not in valid_types:
-            raise HTTPException(status_code=400, detail=f"Invalid adjustment type. Must be one of: {', '.join(valid_types)}")
-        
-        # Validate quantity
-        if adjustment.quantity <= 0:
-            raise HTTPException(status_code=400, detail="Quantity must be greater than zero")
-        
-        # Validate reason
-        valid_reasons = ["purchase", "return", "damage", "inventory", "sale", "other"]
-        if adjustment.reason not in valid_reasons:
-            raise HTTPException(status_code=400, detail=f"Invalid reason. Must be one of: {', '.join(valid_reasons)}")
+        # Validate type, quantity and reason
+        error = stock_adjustments.validate(adjustment)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
         
-        # Save previous stock for history
-        previous_stock = product.stock
+        # Save previous stock for history (includes any stock shards, locked)
+        previous_stock = inventory.lock_level(db, product)
         
         # Apply adjustment based on type
-        if adjustment.type == "add":
-            new_stock = previous_stock + adjustment.quantity
-            stock_message = f"Stock increased from {previous_stock} to {new_stock}"
-        elif adjustment.type == "remove":
-            if previous_stock < adjustment.quantity:
-                raise HTTPException(status_code=400, detail=f"Not enough stock to remove. Current stock: {previous_stock}")
-            new_stock = previous_stock - adjustment.quantity
-            stock_message = f"Stock decreased from {previous_stock} to {new_stock}"
-        elif adjustment.type == "set":
-            new_stock = adjustment.quantity
-            if new_stock > previous_stock:
-                stock_message = f"Stock level set from {previous_stock} to {new_stock} (increased)"
-            elif new_stock < previous_stock:
-                stock_message = f"Stock level set from {previous_stock} to {new_stock} (decreased)"
-            else:
-                stock_message = f"Stock level remains at {new_stock}"
+        if adjustment.type == "remove" and previous_stock < adjustment.quantity:
+            raise HTTPException(status_code=400, detail=f"Not enough stock to remove. Current stock: {previous_stock}")
+        new_stock = stock_adjustments.new_level(adjustment.type, previous_stock, adjustment.quantity)
         
         # Update product stock
-        product.stock = new_stock
+        inventory.set_level(db, product, new_stock)
         
         # Create stock adjustment record
         stock_adjustment = models.StockAdjustment(
@@ -473,35 +518,17 @@ def adjust_stock(adjustment: schemas.StockAdjustmentCreate, db: Session = Depend
         
         db.add(stock_adjustment)
         
-        # Create notifications for subscribers if stock has changed
-        if previous_stock != new_stock:
-            # Get all students who subscribed to this product
-            subscribers = db.query(models.ProductSubscription).filter(
-                models.ProductSubscription.product_id == adjustment.product_id
-            ).all()
-            
-            # Get reason text
-            reason_text = {
-                "purchase": "New inventory received",
-                "return": "Customer return",
-                "damage": "Damaged inventory removed",
-                "inventory": "Inventory adjustment",
-                "sale": "Sale made",
-                "other": adjustment.reason
-            }.get(adjustment.reason, adjustment.reason)
-            
-            # Create a notification for each subscriber
-            for subscription in subscribers:
-                notification = models.Notification(
-                    student_id=subscription.student_id,
-                    product_id=adjustment.product_id,
-                    message=f"Product '{product.name}': {stock_message} ({reason_text})",
-                    type="stock_update"
-                )
-                db.add(notification)
+        # Notify subscribers if stock has changed, now or coalesced
+        _, messages = notification_coalescing.notify_stock_changes(db, [
+            (product, previous_stock, new_stock, [adjustment.type], [adjustment.reason])
+        ] if previous_stock != new_stock else [])
         
         db.commit()
         db.refresh(stock_adjustment)
+        catalog_cache.invalidate()
+        conditional.bump(conditional.NOTIFICATIONS)
+        for product_id, message in messages.items():
+            notification_stream.publish_product(product_id, message, "stock_update")
         
         return stock_adjustment
     except HTTPException:
@@ -513,6 +540,54 @@ def adjust_stock(adjustment: schemas.StockAdjustmentCreate, db: Session = Depend
         # Return a generic error message
         raise HTTPException(status_code=500, detail=f"Error adjusting stock: {str(e)}")
 
+def apply_bulk_adjustments(db: Session, lines: list, partial: bool) -> dict:
+    """Run a bulk adjustment with deadlock retry; 400 with per-line results if it is rejected"""
+    def apply():
+        outcome = stock_adjustments.apply_bulk(db, lines, partial)
+        if outcome["applied"]:
+            db.commit()
+        else:
+            db.rollback()
+        return outcome
+    
+    outcome = inventory.run_transaction(db, apply)
+    messages = outcome.pop("messages", {})
+    if outcome["failed"] and not partial:
+        raise HTTPException(status_code=400, detail=outcome)
+    
+    if outcome["applied"]:
+        catalog_cache.invalidate()
+        conditional.bump(conditional.NOTIFICATIONS)
+        for product_id, message in messages.items():
+            notification_stream.publish_product(product_id, message, "stock_update")
+    
+    return outcome
+
+@app.post("/admin/stock/adjust/bulk", response_model=schemas.BulkStockAdjustmentResponse)
+def adjust_stock_bulk(request: schemas.BulkStockAdjustmentRequest, db: Session = Depends(get_db)):
+    """Apply many stock adjustments (e.g. a whole delivery) in one transaction"""
+    lines = [(line, adjustment, None) for line, adjustment in enumerate(request.adjustments, start=1)]
+    return apply_bulk_adjustments(db, lines, request.partial)
+
+@app.post("/admin/stock/adjust/bulk/csv", response_model=schemas.BulkStockAdjustmentResponse)
+def adjust_stock_bulk_csv(
+    file: UploadFile = File(...),
+    partial: bool = Query(False, description="Apply valid lines and report invalid ones instead of rejecting the file"),
+    db: Session = Depends(get_db)
+):
+    """Bulk stock adjustment from a CSV with product_id, type, quantity, reason and optional notes columns"""
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="Only CSV files are allowed")
+    
+    try:
+        lines = stock_adjustments.parse_csv(file.file)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        file.file.close()
+    
+    return apply_bulk_adjustments(db, lines, partial)
+
 @app.get("/admin/stock/history/{product_id}", response_model=schemas.StockAdjustmentList)
 def get_stock_history(product_id: int, db: Session = Depends(get_db)):
     # Verify product exists
@@ -527,39 +602,112 @@ def get_stock_history(product_id: int, db: Session = Depends(get_db)):
     
     return {"history": adjustments}
 
+@app.put("/admin/products/{product_id}/stock-shards", response_model=schemas.ProductResponse)
+def configure_stock_shards(product_id: int, config: schemas.StockShardUpdate, db: Session = Depends(get_db)):
+    """Split a hot product's stock across counter rows (shards=0 merges it back)"""
+    if config.shards < 0 or config.shards > inventory.MAX_SHARDS:
+        raise HTTPException(status_code=400, detail=f"shards must be between 0 and {inventory.MAX_SHARDS}")
+    
+    product = (
+        db.query(models.Product)
+        .filter(models.Product.id == product_id)
+        .with_for_update()
+        .first()
+    )
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    inventory.configure_shards(db, product, config.shards)
+    db.commit()
+    db.refresh(product)
+    catalog_cache.invalidate()
+    
+    return serialize_products(db, [product])[0]
+
 # Notification Endpoints
-@app.get("/students/notifications", response_model=schemas.NotificationList)
+@app.get("/students/notifications", response_model=schemas.NotificationList, dependencies=[NOTIFICATIONS_ETAG])
 def get_student_notifications(
     skip: int = 0, 
     limit: int = 20,
-    student_id: int = Query(..., description="Student ID to get notifications for"),
+    student_id: int = Depends(auth.current_student_id),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; replaces skip"),
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ):
     """Get notifications for a student"""
-    # Check if student exists
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-        
-    # Get notifications for this student
-    notifications = db.query(models.Notification).filter(
+    query = db.query(models.Notification).filter(
         models.Notification.student_id == student_id
-    ).order_by(models.Notification.created_at.desc()).offset(skip).limit(limit).all()
+    )
     
     # Get total count
-    total = db.query(models.Notification).filter(
-        models.Notification.student_id == student_id
-    ).count()
+    total = None
+    if include_total:
+        total = pagination.cached_count(query, conditional.NOTIFICATIONS, "student", student_id)
+    
+    # Get notifications for this student, newest first
+    sort_key = (models.Notification.created_at, models.Notification.id)
+    query = query.order_by(*[column.desc() for column in sort_key])
+    if cursor:
+        values = pagination.decode_cursor(cursor, (datetime, int))
+        query = query.filter(pagination.seek(sort_key, values, descending=True))
+    else:
+        query = query.offset(skip)
+    notifications = query.limit(limit).all()
     
-    return {"notifications": notifications, "total": total}
+    return {
+        "notifications": notifications,
+        "total": total,
+        "next_cursor": pagination.next_cursor(notifications, limit, lambda n: (n.created_at, n.id))
+    }
+
+@app.get("/students/notifications/unread-count", response_model=schemas.UnreadNotificationCount, dependencies=[NOTIFICATIONS_ETAG])
+def get_unread_notification_count(
+    student_id: int = Depends(auth.current_student_id),
+    db: Session = Depends(get_db)
+):
+    """Number of unread notifications, for the notification badge"""
+    unread = notifications.unread_count(db, student_id)
+    if unread is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    return {"unread_count": unread}
+
+@app.get("/students/notifications/stream")
+async def stream_student_notifications(
+    student_id: int = Depends(auth.current_student_id)
+):
+    """Push new notifications to a student as server-sent events.
+    
+    Unlike the other endpoints this one is async, so an idle connection holds
+    no thread; its database lookups still run in the threadpool.
+    """
+    def subscribed_product_ids():
+        db = SessionLocal()
+        try:
+            return [
+                product_id for (product_id,) in db.query(models.ProductSubscription.product_id)
+                .filter(models.ProductSubscription.student_id == student_id)
+            ]
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        notification_stream.stream(student_id, lambda: run_in_threadpool(subscribed_product_ids)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.put("/students/notifications/{notification_id}/read", response_model=schemas.NotificationResponse)
 def mark_notification_as_read(
     notification_id: int,
-    student_id: int = Query(..., description="Student ID"),
+    student_id: int = Depends(auth.current_student_id),
     db: Session = Depends(get_db)
 ):
     """Mark a notification as read"""
+    # Mark as read, if it is still unread, and update the unread counter
+    notifications.mark_read(db, student_id, notification_id)
+    db.commit()
+    
     # Get notification for this student
     notification = db.query(models.Notification).filter(
         models.Notification.id == notification_id,
@@ -569,31 +717,21 @@ def mark_notification_as_read(
     if not notification:
         raise HTTPException(status_code=404, detail="Notification not found")
     
-    # Mark as read
-    notification.is_read = True
-    db.commit()
-    db.refresh(notification)
+    conditional.bump(conditional.NOTIFICATIONS)
     
     return notification
 
 @app.put("/students/notifications/read-all", status_code=204)
 def mark_all_notifications_as_read(
-    student_id: int = Query(..., description="Student ID"),
+    student_id: int = Depends(auth.current_student_id),
     db: Session = Depends(get_db)
 ):
     """Mark all notifications for a student as read"""
-    # Check if student exists
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-        
-    # Update all unread notifications
-    db.query(models.Notification).filter(
-        models.Notification.student_id == student_id,
-        models.Notification.is_read == False
-    ).update({"is_read": True})
+    # Update all unread notifications and the unread counter
+    notifications.mark_read(db, student_id)
     
     db.commit()
+    conditional.bump(conditional.NOTIFICATIONS)
     return None
 
 @app.post("/students/notifications/add", response_model=schemas.NotificationResponse)
@@ -613,8 +751,14 @@ def add_notification(notification: schemas.NotificationCreate, db: Session = Dep
     )
     
     db.add(db_notification)
+    notifications.count_new(db, notification.student_id)
     db.commit()
     db.refresh(db_notification)
+    conditional.bump(conditional.NOTIFICATIONS)
+    notification_stream.publish_student(
+        db_notification.student_id,
+        schemas.NotificationResponse.model_validate(db_notification).model_dump(mode="json")
+    )
     
     return db_notification
 
@@ -622,7 +766,7 @@ def add_notification(notification: schemas.NotificationCreate, db: Session = Dep
 @app.post("/students/subscribe/{product_id}", response_model=schemas.ProductSubscriptionResponse)
 def subscribe_to_product(
     product_id: int,
-    student_id: int = Query(..., description="Student ID"),
+    student_id: int = Depends(auth.current_student_id),
     db: Session = Depends(get_db)
 ):
     """Subscribe to product updates"""
@@ -631,11 +775,6 @@ def subscribe_to_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Check if student exists
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
     # Check if subscription already exists
     existing_subscription = db.query(models.ProductSubscription).filter(
         models.ProductSubscription.student_id == student_id,
@@ -654,21 +793,17 @@ def subscribe_to_product(
     db.add(subscription)
     db.commit()
     db.refresh(subscription)
+    notification_stream.subscriptions_changed(student_id)
     
     return subscription
 
 @app.delete("/students/unsubscribe/{product_id}", status_code=204)
 def unsubscribe_from_product(
     product_id: int,
-    student_id: int = Query(..., description="Student ID"),
+    student_id: int = Depends(auth.current_student_id),
     db: Session = Depends(get_db)
 ):
     """Unsubscribe from product updates"""
-    # Check if student exists
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-        
     # Find subscription
     subscription = db.query(models.ProductSubscription).filter(
         models.ProductSubscription.student_id == student_id,
@@ -678,21 +813,17 @@ def unsubscribe_from_product(
     if subscription:
         db.delete(subscription)
         db.commit()
+        notification_stream.subscriptions_changed(student_id)
     
     # Return success even if subscription wasn't found (idempotent operation)
     return None
 
 @app.get("/students/subscriptions", response_model=List[int])
 def get_student_subscriptions(
-    student_id: int = Query(..., description="Student ID"),
+    student_id: int = Depends(auth.current_student_id),
     db: Session = Depends(get_db)
 ):
     """Get list of product IDs that student is subscribed to"""
-    # Check if student exists
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-        
     subscriptions = db.query(models.ProductSubscription.product_id).filter(
         models.ProductSubscription.student_id == student_id
     ).all()
@@ -703,48 +834,72 @@ def get_student_subscriptions(
     return product_ids
 
 # Order Management Endpoints
+
+# Load an order's items and their products alongside the order itself,
+# so rendering an order costs a fixed number of queries
+ORDER_ITEMS_WITH_PRODUCTS = selectinload(models.Order.items).joinedload(models.OrderItem.product)
+
 @app.get("/admin/orders", response_model=schemas.OrderList)
 def get_orders(
     skip: int = 0,
     limit: int = 100,
     status: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; replaces skip"),
+    include_total: bool = True,
     db: Session = Depends(get_db)
 ):
     """Get all orders with optional filtering by status"""
-    # Base query with join to calculate total
-    query = db.query(
-        models.Order,
-        func.sum(models.OrderItem.quantity * models.OrderItem.price).label("total")
-    ).join(models.OrderItem).group_by(models.Order.id)
+    # Totals are stored on each order, so the page is an index scan of
+    # orders alone via (status, created_at) or (created_at)
+    query = db.query(models.Order)
     
     # Apply status filter if provided
     if status and status.lower() != "all":
         query = query.filter(models.Order.status == status)
+    else:
+        status = None
     
-    # Get total count
-    total_count = query.count()
+    # Get total count from the per-status counters
+    total_count = order_stats.count_orders(db, status) if include_total else None
     
-    # Apply pagination
-    results = query.order_by(models.Order.created_at.desc()).offset(skip).limit(limit).all()
+    # Apply pagination, newest first
+    sort_key = (models.Order.created_at, models.Order.id)
+    query = query.order_by(*[column.desc() for column in sort_key])
+    if cursor:
+        values = pagination.decode_cursor(cursor, (datetime, int))
+        query = query.filter(pagination.seek(sort_key, values, descending=True))
+    else:
+        query = query.offset(skip)
+    page = query.limit(limit).all()
     
     # Format results
     orders = []
-    for order, total in results:
+    for order in page:
         orders.append({
             "id": order.id,
             "customer_name": order.customer_name,
             "status": order.status,
             "created_at": order.created_at,
-            "total": total or Decimal('0.00')
+            "total": order.order_total or Decimal('0.00'),
+            "item_count": order.item_count
         })
     
-    return {"orders": orders, "total": total_count}
+    return {
+        "orders": orders,
+        "total": total_count,
+        "next_cursor": pagination.next_cursor(page, limit, lambda o: (o.created_at, o.id))
+    }
 
 @app.get("/admin/orders/{order_id}", response_model=schemas.OrderResponse)
 def get_order(order_id: int, db: Session = Depends(get_db)):
     """Get a specific order by ID with its items"""
-    # Get order with items
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    # Get order with items and products in one round of eager loads
+    order = (
+        db.query(models.Order)
+        .options(ORDER_ITEMS_WITH_PRODUCTS)
+        .filter(models.Order.id == order_id)
+        .first()
+    )
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -778,57 +933,89 @@ def get_order(order_id: int, db: Session = Depends(get_db)):
 @app.post("/admin/orders", response_model=schemas.OrderResponse)
 def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
     """Create a new order with items"""
-    # Create order first
-    new_order = models.Order(
-        customer_name=order.customer_name,
-        status=order.status
-    )
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
-    
-    # Then create order items
-    for item_data in order.items:
-        # Get product to check stock and update it
-        product = db.query(models.Product).filter(models.Product.id == item_data.product_id).first()
-        
-        if not product:
-            # Rollback and raise error
-            db.rollback()
-            raise HTTPException(status_code=404, detail=f"Product with ID {item_data.product_id} not found")
+    def place_order():
+        # Load every product on the order in one query
+        product_ids = {item_data.product_id for item_data in order.items}
+        products = {
+            product.id: product
+            for product in db.query(models.Product).filter(models.Product.id.in_(product_ids))
+        }
+        for item_data in order.items:
+            if item_data.product_id not in products:
+                db.rollback()
+                raise HTTPException(status_code=404, detail=f"Product with ID {item_data.product_id} not found")
         
-        # Check if there's enough stock
-        if product.stock < item_data.quantity:
+        # Take the stock with conditional updates, so concurrent orders for
+        # the last units cannot both pass the check
+        try:
+            inventory.reserve(
+                db,
+                inventory.collapse((item_data.product_id, item_data.quantity) for item_data in order.items),
+                {product.id: product.stock_shards for product in products.values()}
+            )
+        except inventory.OutOfStock as e:
             # Rollback and raise error
             db.rollback()
             raise HTTPException(
                 status_code=400, 
-                detail=f"Not enough stock for product '{product.name}'. Available: {product.stock}, Requested: {item_data.quantity}"
+                detail=f"Not enough stock for product '{products[e.product_id].name}'. Available: {e.available}, Requested: {e.requested}"
             )
         
-        # Create order item
-        order_item = models.OrderItem(
-            order_id=new_order.id,
-            product_id=item_data.product_id,
-            quantity=item_data.quantity,
-            price=item_data.price
+        new_order = models.Order(
+            customer_name=order.customer_name,
+            status=order.status
         )
-        db.add(order_item)
+        db.add(new_order)
+        db.flush()
+        
+        # Then create order items
+        sale_lines = []
+        for item_data in order.items:
+            product = products[item_data.product_id]
+            order_item = models.OrderItem(
+                order_id=new_order.id,
+                product_id=item_data.product_id,
+                quantity=item_data.quantity,
+                price=item_data.price,
+                category=product.category,
+                unit_cost=product.cost_price
+            )
+            db.add(order_item)
+            sale_lines.append((product.id, product.category, item_data.quantity, item_data.price, product.cost_price))
         
-        # Update product stock
-        product.stock -= item_data.quantity
+        new_order.order_total, new_order.item_count = order_stats.item_totals(
+            (item_data.quantity, item_data.price) for item_data in order.items
+        )
+        order_stats.adjust_status_count(db, new_order.status, 1)
+        
+        # Completed orders count towards the sales rollup straight away
+        if new_order.status == sales_rollup.COMPLETED:
+            sales_rollup.apply_sale_lines(db, new_order.created_at, sale_lines)
+        
+        # Commit changes
+        db.commit()
+        return new_order.id
     
-    # Commit changes
-    db.commit()
+    # One transaction per order, retried on deadlock
+    order_id = inventory.run_transaction(db, place_order)
+    
+    # Stock levels changed
+    catalog_cache.invalidate()
+    conditional.bump(conditional.ORDERS)
     
     # Return the created order with items
-    return get_order(new_order.id, db)
+    return get_order(order_id, db)
 
 @app.put("/admin/orders/{order_id}", response_model=schemas.OrderResponse)
 def update_order(order_id: int, order_update: schemas.OrderUpdate, db: Session = Depends(get_db)):
     """Update an order's customer name or status"""
-    # Get the order
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    # Get the order (items are needed if the status change touches the sales rollup)
+    order = (
+        db.query(models.Order)
+        .options(ORDER_ITEMS_WITH_PRODUCTS)
+        .filter(models.Order.id == order_id)
+        .first()
+    )
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -838,11 +1025,15 @@ def update_order(order_id: int, order_update: schemas.OrderUpdate, db: Session =
         order.customer_name = order_update.customer_name
     
     if order_update.status is not None:
+        previous_status = order.status
         order.status = order_update.status
+        sales_rollup.apply_status_change(db, order, previous_status)
+        order_stats.change_status(db, previous_status, order.status)
     
     # Save changes
     db.commit()
     db.refresh(order)
+    conditional.bump(conditional.ORDERS)
     
     # Return updated order
     return get_order(order.id, db)
@@ -850,167 +1041,124 @@ def update_order(order_id: int, order_update: schemas.OrderUpdate, db: Session =
 @app.delete("/admin/orders/{order_id}", status_code=204)
 def delete_order(order_id: int, db: Session = Depends(get_db)):
     """Delete an order and restore product stock"""
-    # Get order with items
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    # Get order with items and their products
+    order = (
+        db.query(models.Order)
+        .options(ORDER_ITEMS_WITH_PRODUCTS)
+        .filter(models.Order.id == order_id)
+        .first()
+    )
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Restore product stock for all items
-    for item in order.items:
-        # Get product
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        
-        if product:
-            # Restore stock
-            product.stock += item.quantity
+    inventory.release(
+        db,
+        inventory.collapse((item.product_id, item.quantity) for item in order.items),
+        {item.product_id: item.product.stock_shards for item in order.items if item.product}
+    )
+    
+    # Take completed sales back out of the rollup
+    if order.status == sales_rollup.COMPLETED:
+        sales_rollup.apply_order(db, order, -1)
+    
+    order_stats.adjust_status_count(db, order.status, -1)
     
     # Delete order (cascade will delete items)
     db.delete(order)
     db.commit()
     
+    # Stock levels changed
+    catalog_cache.invalidate()
+    conditional.bump(conditional.ORDERS)
+    
     return None
 
-@app.post("/admin/orders/import")
-async def import_orders(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Import orders from a CSV file"""
+@app.post("/admin/orders/import", response_model=schemas.JobCreatedResponse, status_code=status.HTTP_202_ACCEPTED)
+def import_orders(
+    file: UploadFile = File(...),
+    partial: bool = Query(False, description="Import valid rows and report invalid ones instead of rejecting the file"),
+    db: Session = Depends(get_db)
+):
+    """Queue a CSV order import; poll /admin/jobs/{job_id} for the outcome"""
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only CSV files are allowed")
     
-    try:
-        # Read the CSV file
-        contents = await file.read()
-        csv_text = contents.decode('utf-8')
-        csv_reader = csv.DictReader(StringIO(csv_text))
-        
-        # Validate CSV headers
-        required_headers = {'customer_name', 'product_id', 'quantity', 'order_date'}
-        headers = set(csv_reader.fieldnames)
-        if not required_headers.issubset(headers):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"CSV file must contain the following columns: {', '.join(required_headers)}"
-            )
-        
-        # Process each row
-        orders_by_customer = {}
-        for row in csv_reader:
-            customer_name = row['customer_name'].strip()
-            try:
-                product_id = int(row['product_id'])
-                quantity = int(row['quantity'])
-                order_date = datetime.strptime(row['order_date'], '%Y-%m-%d')
-            except ValueError as e:
-                if 'order_date' in str(e):
-                    raise HTTPException(
-                        status_code=400,
-                        detail="order_date must be in YYYY-MM-DD format"
-                    )
-                raise HTTPException(
-                    status_code=400,
-                    detail="product_id and quantity must be valid numbers"
-                )
-                
-            if quantity <= 0:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Quantity must be greater than 0"
-                )
-                
-            # Get product to check stock and price
-            product = db.query(models.Product).filter(models.Product.id == product_id).first()
-            if not product:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Product with ID {product_id} not found"
-                )
-                
-            if product.stock < quantity:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Not enough stock for product '{product.name}'. Available: {product.stock}, Requested: {quantity}"
-                )
-                
-            # Group items by customer
-            if customer_name not in orders_by_customer:
-                orders_by_customer[customer_name] = []
-            
-            orders_by_customer[customer_name].append({
-                'product_id': product_id,
-                'quantity': quantity,
-                'price': float(product.price),
-                'order_date': order_date
-            })
-        
-        # Create orders for each customer
-        created_orders = []
-        for customer_name, items in orders_by_customer.items():
-            # Create order
-            new_order = models.Order(
-                customer_name=customer_name,
-                status='Completed',  # Set as Completed by default
-                created_at=items[0]['order_date']
-            )
-            db.add(new_order)
-            db.flush()  # Get the order ID
-            
-            # Create order items without updating stock
-            for item in items:
-                order_item = models.OrderItem(
-                    order_id=new_order.id,
-                    product_id=item['product_id'],
-                    quantity=item['quantity'],
-                    price=item['price']
-                )
-                db.add(order_item)
-                # No stock update for imported orders
-            
-            created_orders.append(new_order.id)
-        
-        # Commit all changes
-        db.commit()
-        
-        return {"message": f"Successfully imported {len(created_orders)} orders", "order_ids": created_orders}
-        
-    except HTTPException:
-        db.rollback()
-        raise
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error importing orders: {str(e)}")
-    finally:
-        await file.close()
+    # Keep the upload on disk for the worker, outside the public uploads directory
+    file_path = jobs.job_file_path(f"import_{uuid.uuid4()}.csv")
+    uploads.save_file(file, file_path)
+    
+    job = jobs.enqueue(db, "order_import", {"path": file_path, "partial": partial})
+    
+    return {"job_id": job.id, "status": job.status}
+
+@app.post("/admin/notifications/retention", response_model=schemas.JobCreatedResponse, status_code=status.HTTP_202_ACCEPTED)
+def purge_old_notifications(request: schemas.NotificationRetentionRequest, db: Session = Depends(get_db)):
+    """Queue deletion of old read notifications; poll /admin/jobs/{job_id} for the outcome"""
+    payload = {"days": request.days} if request.days else {}
+    job = jobs.enqueue(db, "notification_retention", payload)
+    
+    return {"job_id": job.id, "status": job.status}
+
+@app.post("/admin/uploads/gc", response_model=schemas.JobCreatedResponse, status_code=status.HTTP_202_ACCEPTED)
+def collect_upload_garbage(include_legacy: bool = False, db: Session = Depends(get_db)):
+    """Queue deletion of uploaded images nothing refers to; poll /admin/jobs/{job_id} for the outcome.
+
+    Images saved before the blob store (not named after their hash) are
+    only deleted with include_legacy=true.
+    """
+    payload = {"include_legacy": True} if include_legacy else {}
+    job = jobs.enqueue(db, "upload_gc", payload)
+    
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/admin/jobs/{job_id}", response_model=schemas.JobResponse)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    """Get the status, progress and result of a background job"""
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "id": job.id,
+        "type": job.type,
+        "status": job.status,
+        "processed_count": job.processed_count,
+        "rejected_count": job.rejected_count,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
 
 # Report endpoints
-@app.get("/admin/reports/sales", response_model=schemas.SalesReportResponse)
+@app.get("/admin/reports/sales", response_model=schemas.SalesReportResponse, dependencies=[REPORT_ETAG])
 def get_sales_report(
     start_date: date = Query(..., description="Start date in YYYY-MM-DD format"),
     end_date: date = Query(..., description="End date in YYYY-MM-DD format"),
     db: Session = Depends(get_db)
 ):
     try:
-        # Query actual orders between dates instead of using sales_daily
+        # Read the pre-aggregated sales_daily rollup instead of raw order lines
         orders_query = """
             SELECT 
-                DATE(o.created_at) as order_date,
-                p.category,
-                COUNT(oi.id) as total_sales,
-                SUM(oi.price * oi.quantity) as revenue,
-                SUM(oi.price * oi.quantity * 0.8) as cost, -- Assuming 20% profit margin
-                SUM(oi.price * oi.quantity * 0.2) as profit -- Assuming 20% profit margin
+                s.date as order_date,
+                s.category,
+                SUM(s.total_sales) as total_sales,
+                SUM(s.revenue) as revenue,
+                SUM(s.revenue * 0.8) as cost, -- Assuming 20% profit margin
+                SUM(s.revenue * 0.2) as profit -- Assuming 20% profit margin
             FROM 
-                orders o
-            JOIN 
-                order_items oi ON o.id = oi.order_id
-            JOIN 
-                products p ON oi.product_id = p.id
+                sales_daily s
             WHERE 
-                DATE(o.created_at) BETWEEN :start_date AND :end_date
-                AND o.status = 'Completed'
+                s.date BETWEEN :start_date AND :end_date
             GROUP BY 
-                DATE(o.created_at), p.category
+                s.date, s.category
             ORDER BY 
-                DATE(o.created_at), p.category
+                s.date, s.category
         """
         
         result = db.execute(text(orders_query), {"start_date": start_date, "end_date": end_date})
@@ -1118,30 +1266,27 @@ def get_sales_report(
             "raw_data": []
         }
 
-@app.get("/admin/reports/top-products", response_model=List[schemas.TopProductResponse])
+@app.get("/admin/reports/top-products", response_model=List[schemas.TopProductResponse], dependencies=[REPORT_ETAG])
 def get_top_products(
     start_date: date = Query(..., description="Start date in YYYY-MM-DD format"),
     end_date: date = Query(..., description="End date in YYYY-MM-DD format"),
     db: Session = Depends(get_db)
 ):
     try:
-        # Query top products from actual orders between dates
+        # Query top products from the sales rollup between dates
         query = """
             SELECT 
                 p.id,
                 p.name,
                 p.category,
-                SUM(oi.quantity) as units_sold,
-                SUM(oi.price * oi.quantity) as revenue
+                SUM(s.units_sold) as units_sold,
+                SUM(s.revenue) as revenue
             FROM 
-                orders o
+                sales_daily s
             JOIN 
-                order_items oi ON o.id = oi.order_id
-            JOIN 
-                products p ON oi.product_id = p.id
+                products p ON s.product_id = p.id
             WHERE 
-                DATE(o.created_at) BETWEEN :start_date AND :end_date
-                AND o.status = 'Completed'
+                s.date BETWEEN :start_date AND :end_date
             GROUP BY 
                 p.id, p.name, p.category
             ORDER BY 
@@ -1195,24 +1340,25 @@ def get_top_products(
             {"id": 5, "product": "Chemistry Book", "category": "Books", "sold": 0, "revenue": 0.0}
         ]
 
-@app.get("/admin/reports/low-stock", response_model=List[schemas.LowStockProduct])
+@app.get("/admin/reports/low-stock", response_model=List[schemas.LowStockProduct], dependencies=[REPORT_ETAG])
 def get_low_stock_items(db: Session = Depends(get_db)):
     try:
         # Query products where stock is below min_stock
-        query = """
+        stock_level = inventory.stock_level_sql("products")
+        query = f"""
             SELECT 
                 id, 
                 name, 
                 category,
-                stock, 
+                {stock_level} AS stock, 
                 min_stock,
                 price
             FROM 
                 products
             WHERE 
-                stock <= min_stock
+                {stock_level} <= min_stock
             ORDER BY 
-                (min_stock - stock) DESC, 
+                (min_stock - {stock_level}) DESC, 
                 name ASC
             LIMIT 10
         """
@@ -1242,32 +1388,27 @@ def get_low_stock_items(db: Session = Depends(get_db)):
         # Return empty list
         return []
 
-@app.get("/admin/reports/category-performance", response_model=schemas.CategoryPerformanceResponse)
+@app.get("/admin/reports/category-performance", response_model=schemas.CategoryPerformanceResponse, dependencies=[REPORT_ETAG])
 def get_category_performance(
     start_date: date = Query(..., description="Start date in YYYY-MM-DD format"),
     end_date: date = Query(..., description="End date in YYYY-MM-DD format"),
     db: Session = Depends(get_db)
 ):
     try:
-        # Query category performance from actual orders between dates
+        # Query category performance from the sales rollup between dates
         query = """
             SELECT 
-                p.category,
-                COUNT(oi.id) as total_sales,
-                SUM(oi.price * oi.quantity) as total_revenue,
-                SUM(oi.price * oi.quantity * 0.8) as total_cost,
-                SUM(oi.price * oi.quantity * 0.2) as total_profit
+                s.category,
+                SUM(s.total_sales) as total_sales,
+                SUM(s.revenue) as total_revenue,
+                SUM(s.revenue * 0.8) as total_cost,
+                SUM(s.revenue * 0.2) as total_profit
             FROM 
-                orders o
-            JOIN 
-                order_items oi ON o.id = oi.order_id
-            JOIN 
-                products p ON oi.product_id = p.id
+                sales_daily s
             WHERE 
-                DATE(o.created_at) BETWEEN :start_date AND :end_date
-                AND o.status = 'Completed'
+                s.date BETWEEN :start_date AND :end_date
             GROUP BY 
-                p.category
+                s.category
         """
         
         result = db.execute(text(query), {"start_date": start_date, "end_date": end_date})
@@ -1312,18 +1453,12 @@ def get_category_performance(
             # This ensures we show accurate data even if the date range is wrong
             orders_query = """
                 SELECT 
-                    p.category,
-                    COUNT(*) as count
+                    s.category,
+                    SUM(s.total_sales) as count
                 FROM 
-                    orders o
-                JOIN 
-                    order_items oi ON o.id = oi.order_id
-                JOIN 
-                    products p ON oi.product_id = p.id
-                WHERE
-                    o.status = 'Completed'
+                    sales_daily s
                 GROUP BY 
-                    p.category
+                    s.category
             """
             
             orders_result = db.execute(text(orders_query))
@@ -1443,18 +1578,20 @@ def get_category_performance(
                 }
             }
 
-@app.get("/orders/daily")
-async def get_daily_orders(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
+@app.get("/orders/daily", dependencies=[REPORT_ETAG])
+def get_daily_orders(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
     try:
         # Parse the date string
         order_date = datetime.strptime(date, "%Y-%m-%d").date()
         
-        # Get all COMPLETED orders for the specified date
+        # Get all COMPLETED orders for the specified date, with items and
+        # products eager-loaded so the loop below issues no further queries
         orders = (
             db.query(models.Order)
+            .options(ORDER_ITEMS_WITH_PRODUCTS)
             .filter(
-                func.date(models.Order.created_at) == order_date,
-                models.Order.status == "Completed"  # Only get completed orders
+                models.Order.status == "Completed",  # Only get completed orders
+                within_days(models.Order.created_at, order_date)
             )
             .all()
         )
@@ -1464,8 +1601,7 @@ async def get_daily_orders(date: str = Query(..., description="Date in YYYY-MM-D
         for order in orders:
             order_items = []
             for item in order.items:
-                # Get the product's cost from the database
-                product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
+                product = item.product
                 if product:
                     # Calculate item cost (assuming cost is 70% of price for this example)
                     # In a real system, you would have a proper cost field in your database
@@ -1496,16 +1632,17 @@ async def get_daily_orders(date: str = Query(..., description="Date in YYYY-MM-D
             detail=f"An error occurred while fetching daily orders: {str(e)}"
         )
 
-@app.get("/admin/dashboard/inventory-summary")
-async def get_inventory_summary(db: Session = Depends(get_db)):
+@app.get("/admin/dashboard/inventory-summary", dependencies=[REPORT_ETAG])
+def get_inventory_summary(db: Session = Depends(get_db)):
     """Get inventory summary including current stock, low stock items, and items to be received"""
     try:
         # Get total items in stock
-        total_items = db.query(func.sum(models.Product.stock)).scalar() or 0
+        stock_level = inventory.stock_level_column()
+        total_items = db.query(func.sum(stock_level)).scalar() or 0
         
         # Get low stock items (where stock <= min_stock)
         low_stock_count = db.query(models.Product).filter(
-            models.Product.stock <= models.Product.min_stock
+            stock_level <= models.Product.min_stock
         ).count()
         
         # Get items with pending orders (to be received)
@@ -1529,8 +1666,8 @@ async def get_inventory_summary(db: Session = Depends(get_db)):
             detail=f"Error fetching inventory summary: {str(e)}"
         )
 
-@app.get("/admin/dashboard/purchase-overview")
-async def get_purchase_overview(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
+@app.get("/admin/dashboard/purchase-overview", dependencies=[REPORT_ETAG])
+def get_purchase_overview(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
     """Get purchase overview including number of orders, total cost, and pending deliveries for the day"""
     try:
         order_date = datetime.strptime(date, "%Y-%m-%d").date()
@@ -1542,14 +1679,14 @@ async def get_purchase_overview(date: str = Query(..., description="Date in YYYY
         ).join(
             models.OrderItem
         ).filter(
-            func.date(models.Order.created_at) == order_date,
-            models.Order.status == "Completed"
+            models.Order.status == "Completed",
+            within_days(models.Order.created_at, order_date)
         ).first()
         
         # Get pending deliveries count
         pending_deliveries = db.query(models.Order).filter(
-            func.date(models.Order.created_at) == order_date,
-            models.Order.status == "Pending"
+            models.Order.status == "Pending",
+            within_days(models.Order.created_at, order_date)
         ).count()
         
         return {
@@ -1568,8 +1705,8 @@ async def get_purchase_overview(date: str = Query(..., description="Date in YYYY
             detail=f"Error fetching purchase overview: {str(e)}"
         )
 
-@app.get("/admin/dashboard/weekly-sales")
-async def get_weekly_sales(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
+@app.get("/admin/dashboard/weekly-sales", dependencies=[REPORT_ETAG])
+def get_weekly_sales(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
     """Get weekly sales breakdown by category"""
     try:
         # Parse the date and get the start of the week (Monday)
@@ -1580,24 +1717,19 @@ async def get_weekly_sales(date: str = Query(..., description="Date in YYYY-MM-D
         # Query sales data grouped by category for the week
         query = """
             SELECT 
-                p.category,
-                DATE(o.created_at) as sale_date,
-                COUNT(oi.id) as items_sold,
-                SUM(oi.quantity) as total_quantity,
-                SUM(oi.price * oi.quantity) as total_revenue
+                s.category,
+                s.date as sale_date,
+                SUM(s.total_sales) as items_sold,
+                SUM(s.units_sold) as total_quantity,
+                SUM(s.revenue) as total_revenue
             FROM 
-                orders o
-            JOIN 
-                order_items oi ON o.id = oi.order_id
-            JOIN 
-                products p ON oi.product_id = p.id
+                sales_daily s
             WHERE 
-                DATE(o.created_at) BETWEEN :start_date AND :end_date
-                AND o.status = 'Completed'
+                s.date BETWEEN :start_date AND :end_date
             GROUP BY 
-                p.category, DATE(o.created_at)
+                s.category, s.date
             ORDER BY 
-                p.category, DATE(o.created_at)
+                s.category, s.date
         """
         
         result = db.execute(
@@ -1651,32 +1783,27 @@ async def get_weekly_sales(date: str = Query(..., description="Date in YYYY-MM-D
             detail=f"Error fetching weekly sales: {str(e)}"
         )
 
-@app.get("/admin/dashboard/daily-stats")
-async def get_daily_stats(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
+@app.get("/admin/dashboard/daily-stats", dependencies=[REPORT_ETAG])
+def get_daily_stats(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
     """Get daily statistics from completed orders for the specified date"""
     try:
         # Parse the date string
         order_date = datetime.strptime(date, "%Y-%m-%d").date()
         
-        # Query for completed orders on the specified date
+        # Query the sales rollup for completed orders on the specified date
         query = """
             SELECT 
-                p.category,
-                COUNT(DISTINCT o.id) as total_orders,
-                SUM(oi.quantity) as total_quantity,
-                SUM(oi.price * oi.quantity) as total_revenue,
-                SUM(p.cost_price * oi.quantity) as total_cost
+                s.category,
+                SUM(s.total_sales) as total_lines,
+                SUM(s.units_sold) as total_quantity,
+                SUM(s.revenue) as total_revenue,
+                SUM(s.cost) as total_cost
             FROM 
-                orders o
-            JOIN 
-                order_items oi ON o.id = oi.order_id
-            JOIN 
-                products p ON oi.product_id = p.id
+                sales_daily s
             WHERE 
-                DATE(o.created_at) = :order_date
-                AND o.status = 'Completed'
+                s.date = :order_date
             GROUP BY 
-                p.category
+                s.category
         """
         
         result = db.execute(
@@ -1684,16 +1811,37 @@ async def get_daily_stats(date: str = Query(..., description="Date in YYYY-MM-DD
             {"order_date": order_date}
         )
         
+        # The rollup counts order lines, not orders: count the day's
+        # completed orders through the (status, created_at) index
+        completed = (
+            models.Order.status == "Completed",
+            within_days(models.Order.created_at, order_date)
+        )
+        total_orders = db.query(func.count(models.Order.id)).filter(*completed).scalar()
+        category_orders = dict(
+            db.query(
+                models.OrderItem.category,
+                func.count(func.distinct(models.Order.id))
+            ).join(
+                models.OrderItem
+            ).filter(
+                *completed
+            ).group_by(
+                models.OrderItem.category
+            ).all()
+        )
+        
         # Initialize statistics
         stats = {
             "totalSales": 0,
+            "totalOrders": total_orders or 0,
             "revenue": 0,
             "profit": 0,
             "cost": 0,
             "breakdown": {
-                "uniform": {"sales": 0, "revenue": 0, "profit": 0, "cost": 0},
-                "books": {"sales": 0, "revenue": 0, "profit": 0, "cost": 0},
-                "other": {"sales": 0, "revenue": 0, "profit": 0, "cost": 0}
+                "uniform": {"sales": 0, "orders": 0, "revenue": 0, "profit": 0, "cost": 0},
+                "books": {"sales": 0, "orders": 0, "revenue": 0, "profit": 0, "cost": 0},
+                "other": {"sales": 0, "orders": 0, "revenue": 0, "profit": 0, "cost": 0}
             }
         }
         
@@ -1708,6 +1856,7 @@ async def get_daily_stats(date: str = Query(..., description="Date in YYYY-MM-DD
             # Update category breakdown
             if category in stats["breakdown"]:
                 stats["breakdown"][category]["sales"] = int(quantity)
+                stats["breakdown"][category]["orders"] = category_orders.get(row[0], 0)
                 stats["breakdown"][category]["revenue"] = revenue
                 stats["breakdown"][category]["cost"] = cost
                 stats["breakdown"][category]["profit"] = profit
@@ -1731,30 +1880,27 @@ async def get_daily_stats(date: str = Query(..., description="Date in YYYY-MM-DD
             detail=f"An error occurred while fetching daily statistics: {str(e)}"
         )
 
-@app.get("/admin/dashboard/top-selling")
-async def get_top_selling(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
+@app.get("/admin/dashboard/top-selling", dependencies=[REPORT_ETAG])
+def get_top_selling(date: str = Query(..., description="Date in YYYY-MM-DD format"), db: Session = Depends(get_db)):
     """Get top selling products for the day"""
     try:
         order_date = datetime.strptime(date, "%Y-%m-%d").date()
         
-        # Query top selling products for the day
-        query = """
+        # Query top selling products for the day from the sales rollup
+        query = f"""
             SELECT 
                 p.id,
                 p.name,
                 p.category,
-                SUM(oi.quantity) as total_sold,
-                SUM(oi.price * oi.quantity) as total_revenue,
-                p.stock as current_stock
+                SUM(s.units_sold) as total_sold,
+                SUM(s.revenue) as total_revenue,
+                {inventory.stock_level_sql("p")} as current_stock
             FROM 
-                orders o
-            JOIN 
-                order_items oi ON o.id = oi.order_id
+                sales_daily s
             JOIN 
-                products p ON oi.product_id = p.id
+                products p ON s.product_id = p.id
             WHERE 
-                DATE(o.created_at) = :order_date
-                AND o.status = 'Completed'
+                s.date = :order_date
             GROUP BY 
                 p.id, p.name, p.category, p.stock
             ORDER BY 
@@ -1787,9 +1933,50 @@ async def get_top_selling(date: str = Query(..., description="Date in YYYY-MM-DD
             detail=f"Error fetching top selling products: {str(e)}"
         )
 
+# Metrics endpoints
+@app.get("/admin/metrics/pool")
+def get_pool_metrics():
+    """Database connection pool usage: checked-out connections, checkout waits, overflow and timeouts"""
+    return pool_status(engine.pool)
+
+@app.get("/admin/metrics/cache")
+def get_cache_metrics():
+    """Product catalog cache hit/miss/eviction counters"""
+    return catalog_cache.stats()
+
+@app.get("/admin/metrics/notification-stream")
+def get_notification_stream_metrics():
+    """Open notification streams and events published"""
+    return notification_stream.broker.stats()
+
+@app.get("/admin/metrics/search")
+def get_search_metrics():
+    """Size of the product search index and how often it was rebuilt"""
+    return product_search.index.stats()
+
+@app.get("/admin/metrics/images")
+def get_image_metrics():
+    """Image variant pipeline: images processed, failures, time per image and bytes saved"""
+    return image_variants.stats()
+
+@app.get("/admin/metrics/uploads")
+def get_upload_metrics():
+    """Uploads stored, bytes written, time per upload and rejected uploads, and the serving cache"""
+    return {**uploads.stats(), "serving_cache": upload_serving.files.stats()}
+
+@app.get("/admin/metrics/auth")
+def get_auth_metrics():
+    """Hit ratio and size of the decoded access token cache"""
+    return auth.principal_cache_stats()
+
+@app.get("/admin/metrics/passwords")
+def get_password_metrics():
+    """Password hashing pool: queue depth, rejections and hash/verify latency"""
+    return passwords.metrics.snapshot()
+
 # Student Feedback Endpoints
 @app.post("/students/feedback", response_model=dict)
-async def submit_feedback(feedback: FeedbackCreate, db: Session = Depends(get_db)):
+def submit_feedback(feedback: FeedbackCreate, db: Session = Depends(get_db)):
     """Submit feedback from a student"""
     try:
         # Check if student exists
@@ -1817,7 +2004,7 @@ async def submit_feedback(feedback: FeedbackCreate, db: Session = Depends(get_db
 
 # Admin Feedback Endpoints
 @app.get("/admin/feedback", response_model=List[FeedbackResponse])
-async def get_all_feedback(db: Session = Depends(get_db)):
+def get_all_feedback(db: Session = Depends(get_db)):
     """Get all feedback for admin view"""
     try:
         # Query feedback with join to get student information
@@ -1852,7 +2039,7 @@ async def get_all_feedback(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to fetch feedback: {str(e)}")
 
 @app.patch("/admin/feedback/{feedback_id}/status", response_model=dict)
-async def update_feedback_status(
+def update_feedback_status(
     feedback_id: int, 
     status_update: FeedbackUpdate, 
     db: Session = Depends(get_db)
@@ -1873,7 +2060,7 @@ async def update_feedback_status(
         raise HTTPException(status_code=500, detail=f"Failed to update feedback status: {str(e)}")
 
 @app.patch("/admin/feedback/{feedback_id}/notes", response_model=dict)
-async def update_feedback_notes(
+def update_feedback_notes(
     feedback_id: int, 
     notes_update: Dict[str, str], 
     db: Session = Depends(get_db)
@@ -1894,7 +2081,7 @@ async def update_feedback_notes(
 
 # Admin signup endpoint
 @app.post("/admin/signup", response_model=AdminUserResponse)
-async def create_admin_user(admin_data: AdminUserCreate, db: Session = Depends(get_db)):
+def create_admin_user(admin_data: AdminUserCreate, db: Session = Depends(get_db)):
     """Create a new admin user"""
     try:
         # Check if username already exists
@@ -1908,7 +2095,7 @@ async def create_admin_user(admin_data: AdminUserCreate, db: Session = Depends(g
             raise HTTPException(status_code=400, detail="Email already registered")
         
         # Hash the password
-        hashed_password = pwd_context.hash(admin_data.password)
+        hashed_password = passwords.hash_password(admin_data.password)
         
         # Create admin user
         db_admin = models.AdminUser(
@@ -1929,13 +2116,16 @@ async def create_admin_user(admin_data: AdminUserCreate, db: Session = Depends(g
         db.commit()
         db.refresh(db_admin)
         return db_admin
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create admin user: {str(e)}")
 
 # Admin login endpoint
 @app.post("/admin/login")
-async def login_admin(admin_credentials: AdminUserLogin, db: Session = Depends(get_db)):
+def login_admin(admin_credentials: AdminUserLogin, db: Session = Depends(get_db)):
     """Authenticate an admin user"""
     try:
         # Find the admin by username
@@ -1944,8 +2134,14 @@ async def login_admin(admin_credentials: AdminUserLogin, db: Session = Depends(g
             raise HTTPException(status_code=400, detail="Invalid username or password")
         
         # Verify password
-        if not pwd_context.verify(admin_credentials.password, admin.password_hash):
+        password_matches, new_hash = passwords.verify_and_rehash(admin_credentials.password, admin.password_hash)
+        if not password_matches:
             raise HTTPException(status_code=400, detail="Invalid username or password")
+        
+        # Upgrade hashes made with an old bcrypt cost
+        if new_hash:
+            admin.password_hash = new_hash
+            db.commit()
             
         # Return admin details
         return {
@@ -1963,7 +2159,7 @@ async def login_admin(admin_credentials: AdminUserLogin, db: Session = Depends(g
 # Add these admin user endpoints after the login/signup endpoints
 
 @app.get("/admin/users/{admin_id}", response_model=AdminUserResponse)
-async def get_admin_user(admin_id: int, db: Session = Depends(get_db)):
+def get_admin_user(admin_id: int, db: Session = Depends(get_db)):
     """Get admin user details by ID"""
     admin = db.query(models.AdminUser).filter(models.AdminUser.id == admin_id).first()
     if not admin:
@@ -1971,7 +2167,7 @@ async def get_admin_user(admin_id: int, db: Session = Depends(get_db)):
     return admin
 
 @app.put("/admin/users/{admin_id}", response_model=AdminUserResponse)
-async def update_admin_user(admin_id: int, admin_data: AdminUserUpdate, db: Session = Depends(get_db)):
+def update_admin_user(admin_id: int, admin_data: AdminUserUpdate, db: Session = Depends(get_db)):
     """Update admin user personal information"""
     admin = db.query(models.AdminUser).filter(models.AdminUser.id == admin_id).first()
     if not admin:
@@ -1997,7 +2193,7 @@ async def update_admin_user(admin_id: int, admin_data: AdminUserUpdate, db: Sess
     return admin
 
 @app.put("/admin/users/{admin_id}/address", response_model=AdminUserResponse)
-async def update_admin_address(admin_id: int, address_data: AdminAddressUpdate, db: Session = Depends(get_db)):
+def update_admin_address(admin_id: int, address_data: AdminAddressUpdate, db: Session = Depends(get_db)):
     """Update admin user address information"""
     admin = db.query(models.AdminUser).filter(models.AdminUser.id == admin_id).first()
     if not admin:
@@ -2012,24 +2208,24 @@ async def update_admin_address(admin_id: int, address_data: AdminAddressUpdate,
     return admin
 
 @app.put("/admin/users/{admin_id}/password")
-async def change_admin_password(admin_id: int, password_data: AdminPasswordUpdate, db: Session = Depends(get_db)):
+def change_admin_password(admin_id: int, password_data: AdminPasswordUpdate, db: Session = Depends(get_db)):
     """Change admin user password"""
     admin = db.query(models.AdminUser).filter(models.AdminUser.id == admin_id).first()
     if not admin:
         raise HTTPException(status_code=404, detail="Admin user not found")
     
     # Verify current password
-    if not pwd_context.verify(password_data.current_password, admin.password_hash):
+    if not passwords.verify_password(password_data.current_password, admin.password_hash):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Update password
-    admin.password_hash = pwd_context.hash(password_data.new_password)
+    admin.password_hash = passwords.hash_password(password_data.new_password)
     
     db.commit()
     return {"success": True, "message": "Password updated successfully"}
 
 @app.post("/admin/users/profile-picture")
-async def upload_profile_picture(
+def upload_profile_picture(
     profile_picture: UploadFile = File(...),
     admin_id: int = Form(...),
     db: Session = Depends(get_db)
@@ -2039,22 +2235,15 @@ async def upload_profile_picture(
     if not admin:
         raise HTTPException(status_code=404, detail="Admin user not found")
     
-    # Validate file type
-    if not profile_picture.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    # Save file
-    filename = f"admin_{admin_id}_{int(time.time())}{os.path.splitext(profile_picture.filename)[1]}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    # Store under its content hash; rejects files that are not images
+    filename = blob_store.store_image(db, profile_picture)
     
     try:
-        with open(file_path, "wb") as f:
-            content = await profile_picture.read()
-            f.write(content)
-        
         # Update admin profile picture
+        blob_store.release(db, admin.profile_picture)
         admin.profile_picture = filename
         db.commit()
+        image_variants.schedule(filename)
         
         return {"success": True, "profile_picture": filename}
     except Exception as e:
@@ -0,0 +1,25 @@
+-- Turn sales_daily into a per-day, per-category, per-product rollup.
+-- The table only holds derived data, so it is recreated rather than altered.
+-- After applying, backfill it from order history with:
+--     python sales_rollup.py
+
+DROP TABLE IF EXISTS sales_daily;
+
+CREATE TABLE sales_daily (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    date DATE NOT NULL,
+    category VARCHAR(50) NOT NULL,
+    product_id INTEGER NOT NULL,
+    total_sales INTEGER NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    cost DECIMAL(12,2) NOT NULL DEFAULT 0,
+    profit DECIMAL(12,2) NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_sales_daily_date_category_product (date, category, product_id),
+    CONSTRAINT fk_sales_daily_product FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_sales_daily_date ON sales_daily (date);
+CREATE INDEX idx_sales_daily_category ON sales_daily (category);
@@ -0,0 +1,12 @@
+-- Secondary indexes for order listings and date-range queries.
+-- Order dates are filtered with half-open created_at ranges, so these
+-- indexes are usable by /orders/daily and the dashboard endpoints.
+
+-- TEXT columns cannot be indexed without a prefix; statuses are short.
+ALTER TABLE orders MODIFY status VARCHAR(20) NOT NULL DEFAULT 'Pending';
+
+CREATE INDEX ix_orders_status_created_at ON orders (status, created_at);
+CREATE INDEX ix_orders_created_at ON orders (created_at);
+
+CREATE INDEX ix_order_items_order_product ON order_items (order_id, product_id);
+CREATE INDEX ix_order_items_product_id ON order_items (product_id);
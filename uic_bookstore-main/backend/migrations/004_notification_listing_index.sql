@@ -0,0 +1,5 @@
+-- Composite index for a student's notifications, newest first.
+-- Keyset pages filter on (student_id, created_at) and read in index order
+-- instead of sorting every notification the student has.
+
+CREATE INDEX ix_notifications_student_created ON notifications (student_id, created_at);
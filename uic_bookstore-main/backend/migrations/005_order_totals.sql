@@ -0,0 +1,24 @@
+-- Store each order's total and line count on the order, and keep a count of
+-- orders per status, so the order list needs no join, GROUP BY or COUNT(*).
+-- The statements below backfill both; `python order_stats.py` does the same.
+
+ALTER TABLE orders
+    ADD COLUMN order_total DECIMAL(12,2) NOT NULL DEFAULT 0 AFTER status,
+    ADD COLUMN item_count INTEGER NOT NULL DEFAULT 0 AFTER order_total;
+
+UPDATE orders o
+LEFT JOIN (
+    SELECT order_id, SUM(quantity * price) AS order_total, COUNT(*) AS item_count
+    FROM order_items
+    GROUP BY order_id
+) t ON t.order_id = o.id
+SET o.order_total = COALESCE(t.order_total, 0),
+    o.item_count = COALESCE(t.item_count, 0);
+
+CREATE TABLE order_status_counts (
+    status VARCHAR(20) PRIMARY KEY,
+    order_count INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO order_status_counts (status, order_count)
+SELECT status, COUNT(*) FROM orders GROUP BY status;
@@ -0,0 +1,14 @@
+-- Optional sharded stock counters for hot products.
+-- Sharding is switched on per product with PUT /admin/products/{id}/stock-shards;
+-- until then products.stock is used exactly as before.
+
+ALTER TABLE products ADD COLUMN stock_shards INTEGER NOT NULL DEFAULT 0 AFTER stock;
+
+CREATE TABLE product_stock_shards (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    product_id INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    stock INTEGER NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_product_stock_shards_product_shard (product_id, shard),
+    CONSTRAINT fk_product_stock_shards_product FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+);
@@ -0,0 +1,17 @@
+-- Keep each student's unread notification count on the student row so the
+-- unread badge needs no COUNT(*), and index unread lookups per student.
+-- The backfill below matches `python notifications.py`.
+
+ALTER TABLE students ADD COLUMN unread_notifications INTEGER NOT NULL DEFAULT 0 AFTER profile_picture;
+
+UPDATE students s
+LEFT JOIN (
+    SELECT student_id, COUNT(*) AS unread
+    FROM notifications
+    WHERE is_read = FALSE
+    GROUP BY student_id
+) t ON t.student_id = s.id
+SET s.unread_notifications = COALESCE(t.unread, 0),
+    s.updated_at = s.updated_at;
+
+CREATE INDEX ix_notifications_student_read_created ON notifications (student_id, is_read, created_at);
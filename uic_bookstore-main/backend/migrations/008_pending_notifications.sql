@@ -0,0 +1,18 @@
+-- Staging table for coalesced product notifications: each product edit or
+-- stock adjustment adds one row here, and the API's flusher merges a
+-- product's rows into one notification per subscriber.
+
+CREATE TABLE pending_notifications (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    product_id INTEGER NOT NULL,
+    type VARCHAR(50) NOT NULL,
+    field VARCHAR(50) NOT NULL,
+    old_value TEXT NULL,
+    new_value TEXT NULL,
+    adjustment_type VARCHAR(20) NULL,
+    reason VARCHAR(50) NULL,
+    created_at DATETIME NOT NULL,
+    INDEX ix_pending_notifications_product (product_id, id),
+    INDEX ix_pending_notifications_created (created_at),
+    CONSTRAINT fk_pending_notifications_product FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+);
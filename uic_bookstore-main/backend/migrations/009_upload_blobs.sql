@@ -0,0 +1,15 @@
+-- Content-addressed uploads: one row per stored image file, named after the
+-- SHA-256 of its content, with the number of products, students and admins
+-- using it. Images uploaded before this keep their names and are not listed;
+-- the upload GC deletes them once nothing refers to them.
+
+CREATE TABLE upload_blobs (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    filename VARCHAR(80) NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL,
+    unreferenced_at DATETIME NULL,
+    UNIQUE KEY uq_upload_blobs_filename (filename),
+    INDEX ix_upload_blobs_unreferenced (refcount, unreferenced_at)
+);
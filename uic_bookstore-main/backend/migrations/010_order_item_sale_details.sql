@@ -0,0 +1,18 @@
+-- Record the category and cost price each order line was sold at, so the
+-- sales rollup removes a reopened or deleted order under the same key it
+-- was added with even after the product has been edited.
+-- Existing lines are backfilled from the products' current values, which
+-- is what the rollup has used for them so far.
+
+ALTER TABLE order_items
+    ADD COLUMN category VARCHAR(50) NULL AFTER price,
+    ADD COLUMN unit_cost DECIMAL(10,2) NULL AFTER category;
+
+UPDATE order_items oi
+JOIN products p ON p.id = oi.product_id
+SET oi.category = p.category,
+    oi.unit_cost = p.cost_price;
+
+ALTER TABLE order_items
+    MODIFY category VARCHAR(50) NOT NULL,
+    MODIFY unit_cost DECIMAL(10,2) NOT NULL;
@@ -0,0 +1,7 @@
+-- Heartbeat and resume position of running background jobs. A job whose
+-- heartbeat is older than JOB_STALE_AFTER seconds is queued again and
+-- continues from its checkpoint.
+
+ALTER TABLE jobs
+    ADD COLUMN heartbeat_at DATETIME NULL AFTER finished_at,
+    ADD COLUMN checkpoint TEXT NULL AFTER heartbeat_at;
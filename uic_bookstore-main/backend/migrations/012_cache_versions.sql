@@ -0,0 +1,8 @@
+-- Version counters of cached data (catalog, orders, notifications, ...).
+-- With the in-process cache each worker used to keep its own, so a write
+-- handled by one worker left the others answering 304 with stale data.
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
@@ -0,0 +1,7 @@
+-- Whether an upload's resized variants have been written. The API lists
+-- variants only once they exist; until then clients use the original.
+-- Mark images whose variants were written before this column with
+-- `python image_variants.py`.
+
+ALTER TABLE upload_blobs
+    ADD COLUMN variants_ready BOOLEAN NOT NULL DEFAULT FALSE;
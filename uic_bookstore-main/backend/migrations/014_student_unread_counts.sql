@@ -0,0 +1,15 @@
+-- Move each student's unread notification counter off the students row.
+-- A notification fan-out bumps the counter of every subscriber in the
+-- admin's transaction, which locked all of their students rows until it
+-- committed and held up their logins and profile edits.
+
+CREATE TABLE IF NOT EXISTS student_unread_counts (
+    student_id INTEGER PRIMARY KEY,
+    unread INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (student_id) REFERENCES students (id) ON DELETE CASCADE
+);
+
+INSERT INTO student_unread_counts (student_id, unread)
+SELECT id, unread_notifications FROM students WHERE unread_notifications <> 0;
+
+ALTER TABLE students DROP COLUMN unread_notifications;
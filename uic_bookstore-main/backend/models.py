@@ -1,9 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Float, Text, DECIMAL
+from sqlalchemy import Column, Integer, String, DateTime, Date, ForeignKey, Boolean, Float, Text, DECIMAL, UniqueConstraint, Index, exists
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, column_property
 from database import Base
 import datetime
 
+import image_names
+
 class Student(Base):
     __tablename__ = "students"
     
@@ -20,6 +22,11 @@ class Student(Base):
     notifications = relationship("Notification", back_populates="student", cascade="all, delete-orphan")
     subscriptions = relationship("ProductSubscription", back_populates="student", cascade="all, delete-orphan")
 
+    @property
+    def profile_picture_variants(self):
+        # profile_picture_ready is defined with UploadBlob below
+        return image_names.variant_names(self.profile_picture) if self.profile_picture_ready else None
+
 class StudentSession(Base):
     __tablename__ = "student_sessions"
     
@@ -38,6 +45,9 @@ class Product(Base):
     price = Column(DECIMAL(10, 2), nullable=False)
     cost_price = Column(DECIMAL(10, 2), nullable=False)
     stock = Column(Integer, nullable=False, default=0)
+    # Number of product_stock_shards rows holding this product's stock; 0 when
+    # stock lives in the `stock` column alone
+    stock_shards = Column(Integer, nullable=False, default=0, server_default="0")
     min_stock = Column(Integer, nullable=True)
     description = Column(Text, nullable=True)
     image_url = Column(String(255), nullable=True)
@@ -51,6 +61,23 @@ class Product(Base):
     subscribers = relationship("ProductSubscription", back_populates="product", cascade="all, delete-orphan")
     order_items = relationship("OrderItem", back_populates="product")
 
+    @property
+    def image_variants(self):
+        # Listed once written, so clients never request a copy that is missing
+        return image_names.variant_names(self.image_url) if self.image_ready else None
+
+class StockShard(Base):
+    """Part of a hot product's stock; orders decrement shards independently"""
+    __tablename__ = "product_stock_shards"
+    __table_args__ = (
+        UniqueConstraint("product_id", "shard", name="uq_product_stock_shards_product_shard"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    shard = Column(Integer, nullable=False)
+    stock = Column(Integer, nullable=False, default=0)
+
 class StockAdjustment(Base):
     __tablename__ = "stock_adjustments"
 
@@ -82,6 +109,44 @@ class Notification(Base):
     student = relationship("Student", back_populates="notifications")
     product = relationship("Product", back_populates="notifications")
 
+    __table_args__ = (
+        # Serves a student's newest-first listing and its keyset pages
+        Index("ix_notifications_student_created", "student_id", "created_at"),
+        # Serves a student's unread notifications and marking them all read
+        Index("ix_notifications_student_read_created", "student_id", "is_read", "created_at"),
+    )
+
+class UnreadNotificationCount(Base):
+    """Denormalised count of a student's unread notifications, kept by notifications.py.
+
+    Kept off the students row so a fan-out to many subscribers does not
+    lock their student rows for the rest of the admin's transaction.
+    """
+    __tablename__ = "student_unread_counts"
+
+    student_id = Column(Integer, ForeignKey("students.id", ondelete="CASCADE"), primary_key=True)
+    unread = Column(Integer, nullable=False, default=0)
+
+
+
+class PendingNotification(Base):
+    """A product change waiting to be merged into one notification per subscriber"""
+    __tablename__ = "pending_notifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    type = Column(String(50), nullable=False)  # 'product_update', 'stock_update'
+    field = Column(String(50), nullable=False)
+    old_value = Column(Text, nullable=True)
+    new_value = Column(Text, nullable=True)
+    adjustment_type = Column(String(20), nullable=True)  # stock updates only
+    reason = Column(String(50), nullable=True)  # stock updates only
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_pending_notifications_product", "product_id", "id"),
+        Index("ix_pending_notifications_created", "created_at"),
+    )
 
 class ProductSubscription(Base):
     __tablename__ = "product_subscriptions"
@@ -97,29 +162,71 @@ class ProductSubscription(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Status-filtered listings and date-range reports
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     customer_name = Column(String, nullable=False)
-    status = Column(String, default="Pending")
+    status = Column(String(20), default="Pending")
+    # Denormalised from order_items when the items are written, so listings
+    # need no join or GROUP BY
+    order_total = Column(DECIMAL(12, 2), nullable=False, default=0, server_default="0")
+    item_count = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     
     # Relationships
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
+class OrderStatusCount(Base):
+    """Number of orders in each status, maintained alongside order writes"""
+    __tablename__ = "order_status_counts"
+
+    status = Column(String(20), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
 class OrderItem(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        Index("ix_order_items_order_product", "order_id", "product_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"))
     product_id = Column(Integer, ForeignKey("products.id", ondelete="RESTRICT"))
     quantity = Column(Integer, nullable=False)
     price = Column(DECIMAL(10, 2), nullable=False)
+    # The product's category and cost price when the line was sold, so the
+    # sales rollup adds and removes it under the same key after product edits
+    category = Column(String(50), nullable=False)
+    unit_cost = Column(DECIMAL(10, 2), nullable=False)
     
     # Relationships
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
 
+class SalesDaily(Base):
+    """Per-day, per-category, per-product rollup of completed order lines"""
+    __tablename__ = "sales_daily"
+    __table_args__ = (
+        UniqueConstraint("date", "category", "product_id", name="uq_sales_daily_date_category_product"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(Date, nullable=False)
+    category = Column(String(50), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    total_sales = Column(Integer, nullable=False, default=0)  # number of order lines
+    units_sold = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(12, 2), nullable=False, default=0)
+    cost = Column(DECIMAL(12, 2), nullable=False, default=0)
+    profit = Column(DECIMAL(12, 2), nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 # Add the Feedback model at the end of the file
 class Feedback(Base):
     __tablename__ = "feedback"
@@ -156,4 +263,66 @@ class AdminUser(Base):
     postal_code = Column(String(20), nullable=True)
     address_line = Column(String(255), nullable=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False) 
\ No newline at end of file
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False) 
+
+    @property
+    def profile_picture_variants(self):
+        return image_names.variant_names(self.profile_picture) if self.profile_picture_ready else None
+
+class Job(Base):
+    """Background job queued by the API and run by the jobs worker pool"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    type = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    payload = Column(Text, nullable=True)  # JSON arguments for the handler
+    processed_count = Column(Integer, nullable=False, default=0)
+    rejected_count = Column(Integer, nullable=False, default=0)
+    result = Column(Text(16777215), nullable=True)  # JSON result once completed (MEDIUMTEXT on MySQL)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # last progress report while running
+    checkpoint = Column(Text, nullable=True)  # JSON position to resume from after a crash
+
+class CacheVersion(Base):
+    """Version counter of cached data; bumped after every write to it (see catalog_cache.py)"""
+    __tablename__ = "cache_versions"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class UploadBlob(Base):
+    """An uploaded image stored once under its content hash, with the number of rows using it"""
+    __tablename__ = "upload_blobs"
+    __table_args__ = (
+        Index("ix_upload_blobs_unreferenced", "refcount", "unreferenced_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String(80), unique=True, nullable=False)  # <sha256><extension>
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # When refcount last dropped to 0; the garbage collector deletes the blob
+    # once this is older than UPLOAD_GC_GRACE
+    unreferenced_at = Column(DateTime, nullable=True)
+    # Set by image_variants.py once every resized copy has been written
+    variants_ready = Column(Boolean, nullable=False, default=False, server_default="0")
+
+
+def _variants_ready(column):
+    # Loaded with the row: one lookup on the unique filename per image
+    return column_property(
+        exists().where(UploadBlob.filename == column, UploadBlob.variants_ready.is_(True))
+    )
+
+
+Product.image_ready = _variants_ready(Product.image_url)
+Student.profile_picture_ready = _variants_ready(Student.profile_picture)
+AdminUser.profile_picture_ready = _variants_ready(AdminUser.profile_picture)
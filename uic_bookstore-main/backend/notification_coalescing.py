@@ -0,0 +1,238 @@
+"""Coalescing of product notifications.
+
+With NOTIFICATION_COALESCE_WINDOW above zero, product edits and stock
+adjustments are not fanned out to subscribers straight away. Each change is
+written as one pending_notifications row instead, and a flusher thread
+merges a product's pending changes into a single notification per
+subscriber once the oldest of them is NOTIFICATION_COALESCE_WINDOW seconds
+old: five price edits in a minute reach each subscriber as one "Price
+updated from ₱10 to ₱14". A burst therefore costs one staged row per change
+plus one fan-out, instead of one fan-out per change.
+
+Pending rows live in the database, so a restart delays them but does not
+lose them. Several API processes can run the flush: each locks every
+pending row of the products it flushes, in product order, so a second
+flush waits for the first to commit instead of sending part of a
+product's changes again. A window of 0 notifies immediately.
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+import conditional
+import models
+import notification_stream
+import notifications
+import stock_adjustments
+from config import NOTIFICATION_COALESCE_WINDOW, NOTIFICATION_FLUSH_INTERVAL
+from database import SessionLocal
+
+PRODUCT_UPDATE = "product_update"
+STOCK_UPDATE = "stock_update"
+
+# Fields whose old and new values are not shown, only that they changed
+UNDESCRIBED_FIELDS = {"description", "image"}
+
+
+def describe_change(field: str, old_value, new_value) -> str:
+    if field == "name":
+        return f"Name updated from '{old_value}' to '{new_value}'"
+    if field == "category":
+        return f"Category updated from '{old_value}' to '{new_value}'"
+    if field == "price":
+        return f"Price updated from ₱{old_value} to ₱{new_value}"
+    if field == "cost_price":
+        return f"Cost price updated from ₱{old_value} to ₱{new_value}"
+    if field == "stock":
+        return f"Stock updated from {old_value} to {new_value}"
+    if field == "min_stock":
+        return f"Minimum stock level updated from {old_value or 'none'} to {new_value}"
+    if field == "description":
+        return "Description updated"
+    if field == "size":
+        return f"Size updated from '{old_value or 'none'}' to '{new_value}'"
+    if field == "image":
+        return "Product image updated"
+    return f"{field} updated"
+
+
+def product_update_message(product_name: str, changes: List[Tuple[str, object, object]]) -> str:
+    return f"Product '{product_name}' has been updated: {', '.join(describe_change(*change) for change in changes)}"
+
+
+def _text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _stage(db: Session, rows: List[dict]):
+    now = datetime.datetime.utcnow()
+    for row in rows:
+        row["created_at"] = now
+    db.execute(insert(models.PendingNotification), rows)
+
+
+def notify_product_update(db: Session, product: models.Product, changes: List[Tuple[str, object, object]]) -> Dict[int, str]:
+    """Notify a product's subscribers of (field, old value, new value) changes.
+
+    Runs in the caller's transaction. Returns {product_id: message} to
+    publish once it commits, which is empty when the changes were staged.
+    """
+    if NOTIFICATION_COALESCE_WINDOW > 0:
+        _stage(db, [
+            {"product_id": product.id, "type": PRODUCT_UPDATE, "field": field,
+             "old_value": _text(old_value), "new_value": _text(new_value)}
+            for field, old_value, new_value in changes
+        ])
+        return {}
+
+    message = product_update_message(product.name, changes)
+    notifications.notify_subscribers(db, product.id, message, PRODUCT_UPDATE)
+    return {product.id: message}
+
+
+def notify_stock_changes(db: Session, changes: List[tuple]) -> Tuple[int, Dict[int, str]]:
+    """Notify subscribers of (product, previous stock, new stock, types, reasons) changes.
+
+    Returns (notifications written, {product_id: message} to publish after
+    commit); both are empty when the changes were staged.
+    """
+    if not changes:
+        return 0, {}
+    if NOTIFICATION_COALESCE_WINDOW > 0:
+        _stage(db, [
+            {"product_id": product.id, "type": STOCK_UPDATE, "field": "stock",
+             "old_value": str(previous_stock), "new_value": str(new_stock),
+             # Already a net change if the product had several lines
+             "adjustment_type": types[0] if len(types) == 1 else ("add" if new_stock > previous_stock else "remove"),
+             "reason": reasons[0] if len(set(reasons)) == 1 else "inventory"}
+            for product, previous_stock, new_stock, types, reasons in changes
+        ])
+        return 0, {}
+
+    messages = {
+        product.id: stock_adjustments.net_stock_message(product.name, previous_stock, new_stock, types, reasons)
+        for product, previous_stock, new_stock, types, reasons in changes
+    }
+    return notifications.notify_subscribers_many(db, messages, STOCK_UPDATE), messages
+
+
+def _merge_product_update(product_name: str, rows: List[models.PendingNotification]) -> Optional[str]:
+    # Each field goes from its first old value to its last new value; fields
+    # that ended where they started are left out
+    fields = OrderedDict()
+    for row in rows:
+        old_value = fields[row.field][0] if row.field in fields else row.old_value
+        fields[row.field] = (old_value, row.new_value)
+    changes = [
+        (field, old_value, new_value) for field, (old_value, new_value) in fields.items()
+        if field in UNDESCRIBED_FIELDS or old_value != new_value
+    ]
+    return product_update_message(product_name, changes) if changes else None
+
+
+def _merge_stock_update(product_name: str, rows: List[models.PendingNotification]) -> Optional[str]:
+    previous_stock, new_stock = int(rows[0].old_value), int(rows[-1].new_value)
+    if previous_stock == new_stock:
+        return None
+    return stock_adjustments.net_stock_message(
+        product_name, previous_stock, new_stock,
+        [row.adjustment_type for row in rows], [row.reason for row in rows]
+    )
+
+
+def flush(db: Session, force: bool = False) -> int:
+    """Notify subscribers of every product whose oldest pending change has waited out the window.
+
+    All of a due product's pending changes are merged, including recent
+    ones. With force=True every pending change is flushed. Returns the
+    number of notifications written.
+    """
+    pending = models.PendingNotification
+    due = db.query(pending.product_id).distinct()
+    if not force:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=NOTIFICATION_COALESCE_WINDOW)
+        due = due.filter(pending.created_at <= cutoff)
+    product_ids = [product_id for (product_id,) in due]
+    if not product_ids:
+        return 0
+
+    # Not skip_locked: that would let two flushes split one product's rows
+    # and notify its subscribers twice. Locking in product order keeps
+    # concurrent flushes from deadlocking; the one that waited reads only
+    # rows staged after the other's commit.
+    rows = (
+        db.query(pending)
+        .filter(pending.product_id.in_(product_ids))
+        .order_by(pending.product_id, pending.id)
+        .with_for_update()
+        .all()
+    )
+    if not rows:
+        db.rollback()
+        return 0
+
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault((row.type, row.product_id), []).append(row)
+    names = dict(
+        db.query(models.Product.id, models.Product.name)
+        .filter(models.Product.id.in_({row.product_id for row in rows}))
+    )
+
+    messages = {PRODUCT_UPDATE: {}, STOCK_UPDATE: {}}
+    for (notification_type, product_id), group in groups.items():
+        if product_id not in names:
+            continue  # deleted while pending
+        merge = _merge_stock_update if notification_type == STOCK_UPDATE else _merge_product_update
+        message = merge(names[product_id], group)
+        if message:
+            messages[notification_type][product_id] = message
+
+    notified = sum(
+        notifications.notify_subscribers_many(db, type_messages, notification_type)
+        for notification_type, type_messages in messages.items()
+    )
+    db.execute(delete(pending).where(pending.id.in_([row.id for row in rows])))
+    db.commit()
+
+    if notified:
+        conditional.bump(conditional.NOTIFICATIONS)
+    for notification_type, type_messages in messages.items():
+        for product_id, message in type_messages.items():
+            notification_stream.publish_product(product_id, message, notification_type)
+    return notified
+
+
+def _flush_in_session(force: bool = False):
+    db = SessionLocal()
+    try:
+        flush(db, force)
+    except Exception as e:
+        db.rollback()
+        print(f"Error flushing pending notifications: {str(e)}")
+    finally:
+        db.close()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(NOTIFICATION_FLUSH_INTERVAL)
+        _flush_in_session()
+
+
+def start_flusher():
+    """Start the background flush.
+
+    With coalescing off, only changes left pending by an earlier run are
+    flushed, once.
+    """
+    if NOTIFICATION_COALESCE_WINDOW > 0:
+        target, args = _flush_forever, ()
+    else:
+        target, args = _flush_in_session, (True,)
+    threading.Thread(target=target, args=args, name="notification-flush", daemon=True).start()
@@ -0,0 +1,91 @@
+"""Retention for read notifications.
+
+Read notifications older than NOTIFICATION_RETENTION_DAYS are deleted in
+primary-key batches of NOTIFICATION_RETENTION_BATCH rows, each in its own
+short transaction, so the purge never holds locks on more than one batch
+and the API keeps writing notifications while it runs. Unread notifications
+are kept whatever their age, so the unread counters are not touched.
+
+Queue a run with POST /admin/notifications/retention, or run this module
+from cron:
+
+    python notification_retention.py [--days 90]
+"""
+import argparse
+import datetime
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+import conditional
+import jobs
+import models
+from config import NOTIFICATION_RETENTION_DAYS, NOTIFICATION_RETENTION_BATCH, NOTIFICATION_RETENTION_PAUSE
+
+
+def purge_read_notifications(
+    db: Session,
+    days: int = NOTIFICATION_RETENTION_DAYS,
+    batch_size: int = NOTIFICATION_RETENTION_BATCH,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """Delete read notifications created more than `days` days ago.
+
+    Returns the number of rows deleted.
+    """
+    notifications = models.Notification
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    deleted = 0
+    last_id = 0
+    while True:
+        # Walk the primary key so each batch starts where the last one ended
+        # instead of rescanning rows that were kept
+        ids = db.execute(
+            select(notifications.id)
+            .where(notifications.id > last_id, notifications.is_read == True, notifications.created_at < cutoff)
+            .order_by(notifications.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        db.execute(delete(notifications).where(notifications.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(deleted, 0)
+        if len(ids) < batch_size:
+            break
+        # Give waiting writers a turn between batches
+        time.sleep(NOTIFICATION_RETENTION_PAUSE)
+
+    if deleted:
+        conditional.bump(conditional.NOTIFICATIONS)
+    return deleted
+
+
+@jobs.register("notification_retention")
+def run_retention_job(db: Session, payload: dict, progress) -> dict:
+    """Background job: purge old read notifications"""
+    days = payload.get("days", NOTIFICATION_RETENTION_DAYS)
+    deleted = purge_read_notifications(db, days, progress=progress)
+    return {"message": f"Deleted {deleted} read notifications older than {days} days", "deleted": deleted}
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Delete old read notifications in small batches")
+    parser.add_argument("--days", type=int, default=NOTIFICATION_RETENTION_DAYS, help="Keep read notifications this many days")
+    parser.add_argument("--batch-size", type=int, default=NOTIFICATION_RETENTION_BATCH, help="Rows deleted per transaction")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        rows = purge_read_notifications(session, args.days, args.batch_size)
+        print(f"Deleted {rows} read notifications older than {args.days} days")
+    finally:
+        session.close()
@@ -0,0 +1,230 @@
+"""Live notification stream.
+
+Students keep one server-sent events connection open on
+GET /students/notifications/stream instead of polling. Writers publish once
+their transaction has committed:
+
+- "product:{id}" channels carry product and stock updates; a stream listens
+  on the channel of every product its student follows
+- "student:{id}" channels carry notifications addressed to one student and
+  tell the stream when the student's subscriptions change
+
+Within a process, LocalBroker hands each event to the asyncio queue of every
+listening stream with call_soon_threadsafe, since publishers run in the
+threadpool. Set NOTIFICATION_BROKER_URL to a redis:// URL to relay events
+between API workers with Redis pub/sub.
+"""
+import asyncio
+import datetime
+import json
+import threading
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from config import NOTIFICATION_BROKER_URL, NOTIFICATION_STREAM_HEARTBEAT, NOTIFICATION_STREAM_QUEUE
+
+try:
+    import redis
+except ImportError:  # optional dependency, only needed to relay between workers
+    redis = None
+
+
+class Subscription:
+    """One open stream: the channels it listens on and its event queue"""
+    __slots__ = ("channels", "queue", "loop", "dropped")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, channels: Set[str]):
+        self.loop = loop
+        self.channels = channels
+        self.queue = asyncio.Queue(maxsize=NOTIFICATION_STREAM_QUEUE)
+        self.dropped = 0
+
+    def deliver(self, event: dict):
+        # Runs on the event loop. A client that stopped reading loses its
+        # oldest events rather than growing the queue without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class Broker:
+    """Interface for notification pub/sub"""
+
+    def publish(self, channel: str, event: dict):
+        raise NotImplementedError
+
+    def subscribe(self, channels: Set[str]) -> Subscription:
+        raise NotImplementedError
+
+    def resubscribe(self, subscription: Subscription, channels: Set[str]):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    """Delivers events to the streams open in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self._connections = 0
+        self.published = 0
+
+    def publish(self, channel, event):
+        self.dispatch(channel, event)
+
+    def dispatch(self, channel: str, event: dict):
+        with self._lock:
+            subscriptions = list(self._channels.get(channel, ()))
+            self.published += 1
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Event loop already closed (server shutting down)
+                pass
+
+    def subscribe(self, channels):
+        subscription = Subscription(asyncio.get_running_loop(), set())
+        with self._lock:
+            self._connections += 1
+        self.resubscribe(subscription, channels)
+        return subscription
+
+    def resubscribe(self, subscription, channels):
+        with self._lock:
+            for channel in subscription.channels - channels:
+                self._remove(channel, subscription)
+            for channel in channels - subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+            subscription.channels = set(channels)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._remove(channel, subscription)
+            subscription.channels = set()
+            self._connections -= 1
+
+    def _remove(self, channel: str, subscription: Subscription):
+        listeners = self._channels.get(channel)
+        if listeners is not None:
+            listeners.discard(subscription)
+            if not listeners:
+                del self._channels[channel]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "broker": "local",
+                "connections": self._connections,
+                "channels": len(self._channels),
+                "published": self.published,
+            }
+
+
+class RedisBroker(LocalBroker):
+    """Publishes through Redis so streams on every worker receive the event"""
+
+    PREFIX = "notifications:"
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("NOTIFICATION_BROKER_URL is set but the 'redis' package is not installed")
+        super().__init__()
+        self._client = redis.Redis.from_url(url)
+        self._listener: Optional[threading.Thread] = None
+
+    def publish(self, channel, event):
+        self._client.publish(self.PREFIX + channel, json.dumps(event, default=str))
+
+    def subscribe(self, channels):
+        if self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name="notification-broker", daemon=True)
+            self._listener.start()
+        return super().subscribe(channels)
+
+    def _listen(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.PREFIX + "*")
+        for message in pubsub.listen():
+            channel = message["channel"].decode()[len(self.PREFIX):]
+            self.dispatch(channel, json.loads(message["data"]))
+
+    def stats(self):
+        stats = super().stats()
+        stats["broker"] = "redis"
+        return stats
+
+
+def build_broker() -> Broker:
+    if NOTIFICATION_BROKER_URL:
+        return RedisBroker(NOTIFICATION_BROKER_URL)
+    return LocalBroker()
+
+
+broker = build_broker()
+
+
+def product_channel(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def student_channel(student_id: int) -> str:
+    return f"student:{student_id}"
+
+
+def publish_product(product_id: int, message: str, notification_type: str):
+    """Tell every student following a product about a change. Call after committing."""
+    broker.publish(product_channel(product_id), {
+        "event": "notification",
+        "data": {
+            "product_id": product_id,
+            "message": message,
+            "type": notification_type,
+            "created_at": datetime.datetime.utcnow().isoformat(),
+        },
+    })
+
+
+def publish_student(student_id: int, notification: dict):
+    """Deliver a notification addressed to one student. Call after committing."""
+    broker.publish(student_channel(student_id), {"event": "notification", "data": notification})
+
+
+def subscriptions_changed(student_id: int):
+    """Make the student's open streams reload the products they follow"""
+    broker.publish(student_channel(student_id), {"event": "subscriptions"})
+
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream(student_id: int, load_product_ids: Callable[[], Awaitable[Iterable[int]]]):
+    """Server-sent events for one student until the client disconnects"""
+    def channels(product_ids):
+        return {student_channel(student_id)} | {product_channel(product_id) for product_id in product_ids}
+
+    subscription = broker.subscribe(channels(await load_product_ids()))
+    try:
+        # Ask EventSource to reconnect after 5s if the connection drops
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), NOTIFICATION_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            if event["event"] == "subscriptions":
+                broker.resubscribe(subscription, channels(await load_product_ids()))
+                continue
+            yield format_event(event["event"], event["data"])
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,179 @@
+"""Product notification fan-out.
+
+Subscriber notifications are written with a single INSERT ... SELECT from
+product_subscriptions, so an admin edit costs one statement however many
+students follow the product, and no subscription rows are loaded into the
+session.
+
+Each student's unread count is kept in student_unread_counts in the same
+transaction as the notifications it counts, so the unread badge is a
+primary-key read. The counters have a table of their own so that a
+fan-out, which bumps every subscriber's counter, locks no students rows:
+logins and profile edits do not wait for an admin's product update. Run
+this module directly to recompute the counters from the notifications
+table:
+
+    python notifications.py
+"""
+import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import case, delete, func, insert, select, literal, update
+from sqlalchemy.orm import Session
+
+import models
+from query_helpers import upsert_add, upsert_add_from_select
+
+
+def notify_subscribers(db: Session, product_id: int, message: str, notification_type: str) -> int:
+    """Create one notification per subscriber of a product.
+
+    Runs in the caller's transaction and returns the number of rows inserted.
+    """
+    subscribers = select(
+        models.ProductSubscription.student_id,
+        literal(product_id),
+        literal(message),
+        literal(notification_type),
+        literal(False),
+        literal(datetime.datetime.utcnow()),
+    ).where(models.ProductSubscription.product_id == product_id)
+
+    result = db.execute(
+        insert(models.Notification).from_select(
+            ["student_id", "product_id", "message", "type", "is_read", "created_at"],
+            subscribers,
+        )
+    )
+    _count_new_for_subscribers(db, models.ProductSubscription.product_id == product_id)
+    return result.rowcount
+
+
+def notify_subscribers_many(db: Session, messages: Dict[int, str], notification_type: str) -> int:
+    """Notify the subscribers of several products, each product with its own message.
+
+    Still a single INSERT ... SELECT: the message is picked per row with a
+    CASE on product_id.
+    """
+    if not messages:
+        return 0
+    subscriptions = models.ProductSubscription
+    subscribers = select(
+        subscriptions.student_id,
+        subscriptions.product_id,
+        case(messages, value=subscriptions.product_id),
+        literal(notification_type),
+        literal(False),
+        literal(datetime.datetime.utcnow()),
+    ).where(subscriptions.product_id.in_(list(messages)))
+
+    result = db.execute(
+        insert(models.Notification).from_select(
+            ["student_id", "product_id", "message", "type", "is_read", "created_at"],
+            subscribers,
+        )
+    )
+    _count_new_for_subscribers(db, subscriptions.product_id.in_(list(messages)))
+    return result.rowcount
+
+
+def _uncount(db: Session, student_filter, count):
+    # Only lowers counters, so every student concerned already has a row
+    counts = models.UnreadNotificationCount
+    db.execute(
+        update(counts)
+        .where(student_filter)
+        .values(unread=counts.unread - count)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _count_new_for_subscribers(db: Session, subscription_filter):
+    # One notification was written per matching subscription
+    subscriptions = models.ProductSubscription
+    upsert_add_from_select(
+        db,
+        models.UnreadNotificationCount.__table__,
+        ["student_id"],
+        ["unread"],
+        select(subscriptions.student_id, func.count(subscriptions.id))
+        .where(subscription_filter)
+        .group_by(subscriptions.student_id),
+    )
+
+
+def count_new(db: Session, student_id: int, count: int = 1):
+    """Count notifications added to one student outside the fan-out helpers"""
+    upsert_add(db, models.UnreadNotificationCount.__table__, {"student_id": student_id}, {"unread": count})
+
+
+def mark_read(db: Session, student_id: int, notification_id: Optional[int] = None) -> int:
+    """Mark one or all of a student's notifications read and lower the counter to match.
+
+    Only rows that were still unread are updated, so a notification marked
+    read twice is only uncounted once. Returns the number of rows changed.
+    """
+    notifications = models.Notification
+    query = update(notifications).where(notifications.student_id == student_id, notifications.is_read == False)
+    if notification_id is not None:
+        query = query.where(notifications.id == notification_id)
+    changed = db.execute(query.values(is_read=True).execution_options(synchronize_session=False)).rowcount
+    if changed:
+        _uncount(db, models.UnreadNotificationCount.student_id == student_id, changed)
+    return changed
+
+
+def forget_product(db: Session, product_id: int):
+    """Uncount a product's unread notifications before the product is deleted"""
+    notifications = models.Notification
+    unread = (notifications.product_id == product_id, notifications.is_read == False)
+    counts = models.UnreadNotificationCount
+    per_student = (
+        select(func.count(notifications.id))
+        .where(notifications.student_id == counts.student_id, *unread)
+        .scalar_subquery()
+    )
+    _uncount(db, counts.student_id.in_(select(notifications.student_id).where(*unread)), per_student)
+
+
+def unread_count(db: Session, student_id: int) -> Optional[int]:
+    """A student's unread notification count, or None if there is no such student"""
+    counts = models.UnreadNotificationCount
+    # Students who were never notified have no counter row
+    return (
+        db.query(func.coalesce(counts.unread, 0))
+        .select_from(models.Student)
+        .outerjoin(counts, counts.student_id == models.Student.id)
+        .filter(models.Student.id == student_id)
+        .scalar()
+    )
+
+
+def rebuild_unread_counts(db: Session) -> int:
+    """Recompute every student's unread counter from the notifications table.
+
+    Returns the number of students with unread notifications.
+    """
+    notifications = models.Notification
+    db.execute(delete(models.UnreadNotificationCount))
+    result = db.execute(
+        insert(models.UnreadNotificationCount).from_select(
+            ["student_id", "unread"],
+            select(notifications.student_id, func.count(notifications.id))
+            .where(notifications.is_read == False)
+            .group_by(notifications.student_id),
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        rows = rebuild_unread_counts(session)
+        print(f"Rebuilt unread notification counts: {rows} students have unread notifications")
+    finally:
+        session.close()
@@ -0,0 +1,310 @@
+"""Set-based CSV order import.
+
+The upload is parsed row by row straight from the spooled upload file and
+handled IMPORT_CHUNK_SIZE rows at a time: the chunk's products are resolved
+with batched IN lookups, and its orders and order items are written with a
+few bulk statements instead of one statement per row.
+"""
+import codecs
+import csv
+from collections import defaultdict
+from datetime import datetime
+from typing import BinaryIO, Dict, List
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session
+
+import conditional
+import inventory
+import jobs
+import models
+import order_stats
+import sales_rollup
+from config import IMPORT_CHUNK_SIZE
+
+REQUIRED_HEADERS = {'customer_name', 'product_id', 'quantity', 'order_date'}
+
+
+class OrderImportError(Exception):
+    """Raised when a CSV file cannot be imported at all"""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def _row_error(row_number: int, message: str, status_code: int = 400) -> dict:
+    return {"row": row_number, "error": message, "status_code": status_code}
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_rows(fileobj: BinaryIO, errors: list, start_row: int = 0):
+    """Yield (row_number, customer_name, product_id, quantity, order_date) from a CSV upload.
+
+    Rows that fail validation are appended to `errors` and skipped, and so
+    are rows up to start_row, without being checked.
+    """
+    reader = csv.DictReader(codecs.iterdecode(fileobj, 'utf-8-sig'))
+
+    headers = set(reader.fieldnames or [])
+    if not REQUIRED_HEADERS.issubset(headers):
+        raise OrderImportError(
+            f"CSV file must contain the following columns: {', '.join(REQUIRED_HEADERS)}"
+        )
+
+    # Row 1 is the header
+    for row_number, row in enumerate(reader, start=2):
+        if row_number <= start_row:
+            continue
+        customer_name = (row['customer_name'] or '').strip()
+        if not customer_name:
+            errors.append(_row_error(row_number, "customer_name is required"))
+            continue
+
+        try:
+            order_date = datetime.strptime(row['order_date'] or '', '%Y-%m-%d')
+        except ValueError:
+            errors.append(_row_error(row_number, "order_date must be in YYYY-MM-DD format"))
+            continue
+
+        try:
+            product_id = int(row['product_id'])
+            quantity = int(row['quantity'])
+        except (TypeError, ValueError):
+            errors.append(_row_error(row_number, "product_id and quantity must be valid numbers"))
+            continue
+
+        if quantity <= 0:
+            errors.append(_row_error(row_number, "Quantity must be greater than 0"))
+            continue
+
+        yield row_number, customer_name, product_id, quantity, order_date
+
+
+def load_products(db: Session, product_ids, chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict[int, tuple]:
+    """Fetch (name, category, price, cost_price, stock) for many products in batched queries"""
+    products = {}
+    for chunk in _chunks(sorted(product_ids), chunk_size):
+        rows = db.query(
+            models.Product.id,
+            models.Product.name,
+            models.Product.category,
+            models.Product.price,
+            models.Product.cost_price,
+            inventory.stock_level_column()
+        ).filter(models.Product.id.in_(chunk))
+        for product_id, *details in rows:
+            products[product_id] = tuple(details)
+    return products
+
+
+def _line_error(row_number: int, product_id: int, quantity: int, products: dict):
+    product = products.get(product_id)
+    if product is None:
+        return _row_error(row_number, f"Product with ID {product_id} not found", 404)
+    if product[4] < quantity:
+        return _row_error(
+            row_number,
+            f"Not enough stock for product '{product[0]}'. Available: {product[4]}, Requested: {quantity}"
+        )
+    return None
+
+
+def _batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_chunk(db: Session, lines_by_customer: dict, products: dict, orders: dict, created_orders: list,
+                 chunk_size: int):
+    """Write one chunk of valid lines, grouped by customer.
+
+    Customers seen in an earlier chunk get the lines added to the order
+    created for them then; `orders` maps them to (order_id, created_at).
+    """
+    new_orders = []
+    for customer_name, items in lines_by_customer.items():
+        if customer_name not in orders:
+            new_orders.append((customer_name, models.Order(
+                customer_name=customer_name,
+                status=sales_rollup.COMPLETED,  # Set as Completed by default
+                created_at=items[0][2],
+                order_total=0,
+                item_count=0
+            )))
+    # Orders need their generated ids for the item rows, so they are
+    # flushed together per chunk; items are then inserted with executemany
+    db.add_all([new_order for _, new_order in new_orders])
+    db.flush()
+    for customer_name, new_order in new_orders:
+        orders[customer_name] = (new_order.id, new_order.created_at)
+        created_orders.append(new_order.id)
+        # Keep the identity map small on very large imports
+        db.expunge(new_order)
+
+    item_rows = []
+    order_totals = []
+    sale_lines_by_day = defaultdict(list)
+    for customer_name, items in lines_by_customer.items():
+        order_id, created_at = orders[customer_name]
+        order_total, item_count = order_stats.item_totals(
+            (quantity, products[product_id][2]) for product_id, quantity, _ in items
+        )
+        order_totals.append({"order": order_id, "added_total": order_total, "added_items": item_count})
+        for product_id, quantity, _ in items:
+            _, category, price, cost_price, _ = products[product_id]
+            # No stock update for imported orders
+            item_rows.append({
+                "order_id": order_id,
+                "product_id": product_id,
+                "quantity": quantity,
+                "price": price,
+                "category": category,
+                "unit_cost": cost_price
+            })
+            sale_lines_by_day[created_at.date()].append((product_id, category, quantity, price, cost_price))
+
+    orders_table = models.Order.__table__
+    db.execute(
+        update(orders_table)
+        .where(orders_table.c.id == bindparam("order"))
+        .values(
+            order_total=orders_table.c.order_total + bindparam("added_total"),
+            item_count=orders_table.c.item_count + bindparam("added_items")
+        ),
+        order_totals
+    )
+    for item_chunk in _chunks(item_rows, chunk_size):
+        db.execute(insert(models.OrderItem), item_chunk)
+
+    if new_orders:
+        order_stats.adjust_status_count(db, sales_rollup.COMPLETED, len(new_orders))
+
+    # Imported orders are Completed, so they feed the sales rollup
+    for sale_date, lines in sale_lines_by_day.items():
+        sales_rollup.apply_sale_lines(db, sale_date, lines)
+
+
+def _check_rows(db: Session, fileobj: BinaryIO, products: dict, chunk_size: int):
+    """Raise OrderImportError for the first invalid row without writing anything"""
+    errors: List[dict] = []
+    for batch in _batches(parse_rows(fileobj, errors), chunk_size):
+        if errors:
+            break
+        products.update(load_products(db, {row[2] for row in batch} - products.keys(), chunk_size))
+        for row_number, _, product_id, quantity, _ in batch:
+            error = _line_error(row_number, product_id, quantity, products)
+            if error:
+                raise OrderImportError(error["error"], error["status_code"])
+    if errors:
+        raise OrderImportError(errors[0]["error"], errors[0]["status_code"])
+
+
+def import_orders_csv(db: Session, fileobj: BinaryIO, partial: bool = False,
+                      chunk_size: int = IMPORT_CHUNK_SIZE, progress=None, resume: dict = None) -> dict:
+    """Import orders from a CSV file object, one Completed order per customer.
+
+    Rows are read and written chunk_size at a time, so only one chunk of
+    the file is held in memory. With partial=False the import is
+    all-or-nothing: the whole file is checked before the first chunk is
+    written and the first invalid row raises OrderImportError. With
+    partial=True invalid rows are skipped and reported in the result.
+
+    `progress(orders_created, rows_rejected, checkpoint)` is called after
+    each chunk when given, and may commit it. Passing the last checkpoint
+    back as `resume` continues after the chunk it describes; customers with
+    rows on both sides of that point get a second order.
+    """
+    resume = resume or {}
+    start_row = resume.get("row", 0)
+    orders_before = resume.get("orders", 0)
+    rejected_before = resume.get("rejected", 0)
+
+    errors: List[dict] = []
+    products = {}  # product details loaded so far, by id
+    orders = {}  # customer -> (order_id, created_at) of the orders created so far
+    created_orders = []
+
+    if not partial and not start_row:
+        # Chunks may be committed as they are written, so nothing is written
+        # until every row is known to be valid
+        _check_rows(db, fileobj, products, chunk_size)
+        fileobj.seek(0)
+
+    for batch in _batches(parse_rows(fileobj, errors, start_row), chunk_size):
+        if errors and not partial:
+            raise OrderImportError(errors[0]["error"], errors[0]["status_code"])
+
+        products.update(load_products(db, {row[2] for row in batch} - products.keys(), chunk_size))
+
+        # Group valid lines by customer, keeping the file order of customers
+        lines_by_customer = defaultdict(list)
+        for row_number, customer_name, product_id, quantity, order_date in batch:
+            error = _line_error(row_number, product_id, quantity, products)
+            if error is None:
+                lines_by_customer[customer_name].append((product_id, quantity, order_date))
+                continue
+
+            if not partial:
+                raise OrderImportError(error["error"], error["status_code"])
+            errors.append(error)
+
+        _write_chunk(db, lines_by_customer, products, orders, created_orders, chunk_size)
+        if progress:
+            orders_created = orders_before + len(created_orders)
+            rows_rejected = rejected_before + len(errors)
+            progress(orders_created, rows_rejected,
+                     {"row": batch[-1][0], "orders": orders_created, "rejected": rows_rejected})
+
+    # Invalid rows after the last valid one
+    if errors and not partial:
+        raise OrderImportError(errors[0]["error"], errors[0]["status_code"])
+
+    result = {
+        "message": f"Successfully imported {orders_before + len(created_orders)} orders",
+        "order_ids": created_orders,
+        "errors": [{"row": e["row"], "error": e["error"]} for e in sorted(errors, key=lambda e: e["row"])]
+    }
+    if start_row:
+        # Orders and errors from before the interruption are only counted
+        result["resumed_after_row"] = start_row
+    return result
+
+
+@jobs.register("order_import")
+def run_import_job(db: Session, payload: dict, progress) -> dict:
+    """Background job: import a CSV previously saved by the upload endpoint.
+
+    Each chunk is committed with the job's progress, so the orders appear
+    as the import runs and an import interrupted by a crash continues from
+    its last chunk when the job is picked up again. The file is removed by
+    the job runner once the job has finished.
+    """
+    path = payload["path"]
+
+    def chunk_written(orders_created: int, rows_rejected: int, checkpoint: dict):
+        progress(orders_created, rows_rejected, checkpoint)
+        conditional.bump(conditional.ORDERS)
+
+    try:
+        with open(path, "rb") as fileobj:
+            result = import_orders_csv(
+                db, fileobj, partial=payload.get("partial", False), progress=chunk_written,
+                resume=payload.get("checkpoint")
+            )
+        db.commit()
+        conditional.bump(conditional.ORDERS)
+        return result
+    except OrderImportError as e:
+        raise jobs.JobError(e.detail)
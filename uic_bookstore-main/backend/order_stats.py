@@ -0,0 +1,105 @@
+"""Denormalised order totals and per-status order counts.
+
+Each order stores its own `order_total` and `item_count`, set when its items
+are written, and order_status_counts keeps the number of orders per status.
+Together they let the order list page through `orders` alone and read its
+total without counting. Run this module directly to backfill both from the
+raw order items:
+
+    python order_stats.py
+"""
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+from query_helpers import upsert_add
+
+
+def item_totals(lines: Iterable[Tuple[int, Decimal]]) -> Tuple[Decimal, int]:
+    """(order_total, item_count) for (quantity, price) lines"""
+    total = Decimal("0")
+    count = 0
+    for quantity, price in lines:
+        total += Decimal(str(price)) * quantity
+        count += 1
+    return total, count
+
+
+def adjust_status_count(db: Session, status: str, delta: int):
+    """Add delta orders to a status counter in the caller's transaction"""
+    table = models.OrderStatusCount
+    if delta > 0:
+        upsert_add(db, table.__table__, {"status": status}, {"order_count": delta})
+    else:
+        db.execute(
+            update(table)
+            .where(table.status == status)
+            .values(order_count=table.order_count + delta)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def change_status(db: Session, previous_status: str, new_status: str):
+    if previous_status != new_status:
+        adjust_status_count(db, previous_status, -1)
+        adjust_status_count(db, new_status, 1)
+
+
+def count_orders(db: Session, status: Optional[str] = None) -> int:
+    """Number of orders, optionally in one status, read from the counters"""
+    query = db.query(func.coalesce(func.sum(models.OrderStatusCount.order_count), 0))
+    if status:
+        query = query.filter(models.OrderStatusCount.status == status)
+    return int(query.scalar())
+
+
+def status_counts(db: Session) -> Dict[str, int]:
+    return {
+        status: count
+        for status, count in db.query(models.OrderStatusCount.status, models.OrderStatusCount.order_count)
+        if count
+    }
+
+
+def rebuild_order_stats(db: Session) -> int:
+    """Recompute every order's totals and the status counters from order_items.
+
+    Returns the number of orders updated.
+    """
+    items = models.OrderItem
+    order_total = (
+        select(func.coalesce(func.sum(items.quantity * items.price), 0))
+        .where(items.order_id == models.Order.id)
+        .scalar_subquery()
+    )
+    item_count = select(func.count(items.id)).where(items.order_id == models.Order.id).scalar_subquery()
+    result = db.execute(
+        update(models.Order)
+        .values(order_total=order_total, item_count=item_count)
+        .execution_options(synchronize_session=False)
+    )
+
+    db.execute(delete(models.OrderStatusCount))
+    db.execute(
+        insert(models.OrderStatusCount).from_select(
+            ["status", "order_count"],
+            select(models.Order.status, func.count(models.Order.id)).group_by(models.Order.status),
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+
+    models.OrderStatusCount.__table__.create(bind=engine, checkfirst=True)
+    session = SessionLocal()
+    try:
+        rows = rebuild_order_stats(session)
+        print(f"Rebuilt order totals for {rows} orders and the per-status counters")
+    finally:
+        session.close()
@@ -0,0 +1,70 @@
+"""Keyset (cursor) pagination.
+
+List endpoints return a `next_cursor` alongside each page. Passing it back
+as `cursor` continues after the last row seen with a range predicate on the
+sort key instead of OFFSET, so page 500 costs the same as page 1. Cursors
+are opaque to clients: base64 of the last row's sort key values.
+
+Totals are counted once per version of the underlying table (see
+conditional.bump) and reused from the cache backend until it changes.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+import catalog_cache
+from config import CATALOG_CACHE_TTL
+
+
+def encode_cursor(values: Sequence) -> str:
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> list:
+    """Decode a cursor into values of the given types, or raise 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(payload) != len(types):
+            raise ValueError
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for t, v in zip(types, payload)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def seek(columns: Sequence, values: Sequence, descending: bool = False):
+    """Rows strictly after `values` in (columns...) order.
+
+    Expanded into `a >= x AND (a > x OR (a = x AND b > y))` rather than a
+    row-value comparison; the redundant leading bound lets the database
+    range-scan an index on the first column.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], step))
+    leading = columns[0] <= values[0] if descending else columns[0] >= values[0]
+    return and_(leading, or_(*clauses))
+
+
+def next_cursor(rows: list, limit: int, key) -> Optional[str]:
+    """Cursor for the page after `rows`, or None when this was the last page"""
+    if not rows or len(rows) < limit:
+        return None
+    return encode_cursor(key(rows[-1]))
+
+
+def cached_count(query, table: str, *key_parts) -> int:
+    """query.count(), cached until `table`'s version counter is bumped"""
+    version = catalog_cache.backend.get_version(table)
+    key = f"count:{table}:v{version}:" + ":".join(str(part) for part in key_parts)
+    total = catalog_cache.backend.get(key)
+    if total is None:
+        total = query.count()
+        catalog_cache.backend.set(key, total, CATALOG_CACHE_TTL)
+    return total
@@ -0,0 +1,153 @@
+"""Password hashing service.
+
+bcrypt is deliberately CPU-heavy, so hashing and verification run on a
+small dedicated thread pool rather than on the request threads. The number
+of calls waiting for that pool is capped: once PASSWORD_HASH_MAX_PENDING
+calls are queued, new ones are rejected with 503 instead of piling up
+behind a login burst. Hashes made with a different bcrypt cost than
+BCRYPT_ROUNDS are replaced on the next successful login.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=BCRYPT_ROUNDS)
+
+
+class PasswordServiceBusy(HTTPException):
+    """Raised when the hashing pool is saturated or a call waits too long"""
+
+    def __init__(self, detail: str = "Too many sign-in requests, please try again shortly"):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": "1"},
+        )
+
+
+class HashingMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.max_pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+        self.operations = {}
+
+    def enter(self):
+        with self._lock:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+    def leave(self):
+        with self._lock:
+            self.pending -= 1
+
+    def record(self, operation: str, queue_wait: float, duration: float):
+        with self._lock:
+            stats = self.operations.setdefault(
+                operation, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "total_queue_ms": 0.0, "max_queue_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["total_ms"] += duration * 1000
+            stats["max_ms"] = max(stats["max_ms"], duration * 1000)
+            stats["total_queue_ms"] += queue_wait * 1000
+            stats["max_queue_ms"] = max(stats["max_queue_ms"], queue_wait * 1000)
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            operations = {
+                name: {
+                    "count": stats["count"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "avg_queue_ms": round(stats["total_queue_ms"] / stats["count"], 3),
+                    "max_queue_ms": round(stats["max_queue_ms"], 3),
+                }
+                for name, stats in self.operations.items()
+            }
+            return {
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "workers": PASSWORD_HASH_WORKERS,
+                "queue_limit": PASSWORD_HASH_MAX_PENDING,
+                "queue_depth": self.pending,
+                "max_queue_depth": self.max_pending,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "rehashed": self.rehashed,
+                "operations": operations,
+            }
+
+
+metrics = HashingMetrics()
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+def _release(_future):
+    metrics.leave()
+    _slots.release()
+
+
+def _run(operation: str, func, *args):
+    if not _slots.acquire(blocking=False):
+        metrics.increment("rejected")
+        raise PasswordServiceBusy()
+
+    metrics.enter()
+    submitted = time.perf_counter()
+
+    def task():
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            metrics.record(operation, started - submitted, time.perf_counter() - started)
+
+    future = _executor.submit(task)
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()
+        metrics.increment("timeouts")
+        raise PasswordServiceBusy()
+
+
+def hash_password(password: str) -> str:
+    return _run("hash", pwd_context.hash, password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _run("verify", pwd_context.verify, plain_password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a hash uses a deprecated scheme or a bcrypt cost other than BCRYPT_ROUNDS"""
+    if pwd_context.needs_update(hashed_password):
+        return True
+    # bcrypt hashes look like $2b$12$<salt+checksum>
+    parts = hashed_password.split("$")
+    return len(parts) > 2 and parts[2].isdigit() and int(parts[2]) != BCRYPT_ROUNDS
+
+
+def verify_and_rehash(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and, if it matches an outdated hash, return a fresh hash to store"""
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if needs_rehash(hashed_password):
+        metrics.increment("rehashed")
+        return True, hash_password(plain_password)
+    return True, None
@@ -0,0 +1,216 @@
+"""In-process product search.
+
+An inverted index over product name, category, size and description,
+ranked with BM25 (name and category weighted above the rest). Every query
+word must match a product, either exactly or, when it is not a known word,
+through trigram similarity, so "hodie" still finds hoodies. The last word
+also matches as a prefix, which makes the same endpoint usable for
+search-as-you-type.
+
+The index is built from the products table on the first search and then
+kept current by create_product, update_product and delete_product. Those
+edits also bump a "search" version in the catalog cache backend; a worker
+that finds a version it did not produce itself (another API process edited
+a product) rebuilds its index on the next search.
+"""
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import catalog_cache
+import models
+
+# Field weights: a word in the name counts three times one in the description
+FIELD_WEIGHTS = (("name", 3.0), ("category", 2.0), ("size", 1.0), ("description", 1.0))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+PREFIX_WEIGHT = 0.7  # a prefix match scores below the whole word
+FUZZY_WEIGHT = 0.6  # and a misspelling below both, scaled by similarity
+MIN_SIMILARITY = 0.3
+MAX_EXPANSIONS = 50  # words a prefix or misspelling may expand to
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _WORD.findall(text.lower()) if text else []
+
+
+def trigrams(term: str) -> set:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+        self.version = None  # search version the index reflects; None until built
+        self.builds = 0
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._lengths: Dict[int, float] = {}
+        self._terms_by_doc: Dict[int, List[str]] = {}
+        self._vocabulary: List[str] = []  # sorted, for prefix lookups
+        self._trigrams: Dict[str, set] = {}
+        self._total_length = 0.0
+
+    # -- maintenance -------------------------------------------------------
+
+    def build(self, db: Session):
+        """Index every product from scratch"""
+        version = catalog_cache.backend.get_version("search")
+        rows = db.query(
+            models.Product.id, models.Product.name, models.Product.category,
+            models.Product.size, models.Product.description
+        ).yield_per(1000)
+        with self._lock:
+            self._reset()
+            for product_id, name, category, size, description in rows:
+                self._add(product_id, {"name": name, "category": category, "size": size, "description": description})
+            self.version = version
+            self.builds += 1
+
+    def _add(self, product_id: int, fields: dict):
+        frequencies = Counter()
+        for field, weight in FIELD_WEIGHTS:
+            for term in tokenize(fields.get(field)):
+                frequencies[term] += weight
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._vocabulary, term)
+                for gram in trigrams(term):
+                    self._trigrams.setdefault(gram, set()).add(term)
+            postings[product_id] = frequency
+        length = sum(frequencies.values())
+        self._lengths[product_id] = length
+        self._terms_by_doc[product_id] = list(frequencies)
+        self._total_length += length
+
+    def _remove(self, product_id: int):
+        for term in self._terms_by_doc.pop(product_id, ()):
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect_left(self._vocabulary, term)]
+                for gram in trigrams(term):
+                    self._trigrams[gram].discard(term)
+        self._total_length -= self._lengths.pop(product_id, 0.0)
+
+    def _record_edit(self):
+        # In step with the shared version only if nobody else edited since
+        version = catalog_cache.backend.bump_version("search")
+        if self.version is not None and version != self.version + 1:
+            self.version = None
+        elif self.version is not None:
+            self.version = version
+
+    def put(self, product: models.Product):
+        """Index a created or updated product; call after the commit"""
+        with self._lock:
+            if self.version is not None:
+                self._remove(product.id)
+                self._add(product.id, {field: getattr(product, field) for field, _ in FIELD_WEIGHTS})
+            self._record_edit()
+
+    def delete(self, product_id: int):
+        """Drop a deleted product; call after the commit"""
+        with self._lock:
+            if self.version is not None:
+                self._remove(product_id)
+            self._record_edit()
+
+    def ensure_current(self, db: Session):
+        with self._lock:
+            if self.version is None or self.version != catalog_cache.backend.get_version("search"):
+                self.build(db)
+
+    # -- queries -----------------------------------------------------------
+
+    def _expand(self, term: str, prefix: bool) -> List[Tuple[str, float]]:
+        """Indexed words a query word stands for, with a weight for each"""
+        expansions = []
+        if term in self._postings:
+            expansions.append((term, 1.0))
+        if prefix:
+            start = bisect_left(self._vocabulary, term)
+            for candidate in self._vocabulary[start:start + MAX_EXPANSIONS + 1]:
+                if not candidate.startswith(term):
+                    break
+                if candidate != term:
+                    expansions.append((candidate, PREFIX_WEIGHT))
+        if not expansions and len(term) >= 3:
+            grams = trigrams(term)
+            shared = Counter()
+            for gram in grams:
+                shared.update(self._trigrams.get(gram, ()))
+            for candidate, count in shared.most_common(MAX_EXPANSIONS):
+                similarity = count / (len(grams) + len(trigrams(candidate)) - count)
+                if similarity >= MIN_SIMILARITY:
+                    expansions.append((candidate, FUZZY_WEIGHT * similarity))
+        return expansions
+
+    def search(self, query: str, limit: int = 20) -> Tuple[List[Tuple[int, float]], int]:
+        """([(product_id, score)] best first, number of matching products)"""
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        with self._lock:
+            documents = len(self._lengths)
+            if not documents:
+                return [], 0
+            average_length = self._total_length / documents
+            scores = None
+            for position, term in enumerate(terms):
+                # Best score per product for this query word
+                term_scores: Dict[int, float] = {}
+                for candidate, weight in self._expand(term, prefix=position == len(terms) - 1):
+                    postings = self._postings[candidate]
+                    idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, frequency in postings.items():
+                        if scores is not None and product_id not in scores:
+                            continue
+                        norm = K1 * (1 - B + B * self._lengths[product_id] / average_length)
+                        score = weight * idf * frequency * (K1 + 1) / (frequency + norm)
+                        if score > term_scores.get(product_id, 0.0):
+                            term_scores[product_id] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {product_id: scores[product_id] + score for product_id, score in term_scores.items()}
+                if not scores:
+                    return [], 0
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return best, len(scores)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "built": self.version is not None,
+                "products": len(self._lengths),
+                "terms": len(self._postings),
+                "builds": self.builds,
+            }
+
+
+index = SearchIndex()
+
+
+def search(db: Session, query: str, limit: int = 20) -> Tuple[List[int], int]:
+    """(product ids best first, number of matches), building the index if needed"""
+    index.ensure_current(db)
+    best, total = index.search(query, limit)
+    return [product_id for product_id, _ in best], total
@@ -0,0 +1,63 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+
+def day_range(start_date: date, end_date: Optional[date] = None):
+    """Return the half-open [start, end + 1 day) datetime bounds covering whole days"""
+    if end_date is None:
+        end_date = start_date
+    start = datetime.combine(start_date, time.min)
+    end = datetime.combine(end_date + timedelta(days=1), time.min)
+    return start, end
+
+
+def within_days(column, start_date: date, end_date: Optional[date] = None):
+    """Filter a datetime column to whole days without wrapping it in DATE().
+
+    `column >= start AND column < end + 1 day` keeps the predicate sargable,
+    so MySQL can use an index range scan on the column instead of evaluating
+    DATE() for every row.
+    """
+    start, end = day_range(start_date, end_date)
+    return and_(column >= start, column < end)
+
+
+def upsert_add(db: Session, table, key: Dict[str, object], amounts: Dict[str, object]):
+    """Insert a counter row, or add `amounts` to the row already holding `key`.
+
+    One INSERT ... ON DUPLICATE KEY UPDATE (MySQL) or ON CONFLICT DO UPDATE
+    (SQLite) statement, so two transactions creating the same row at once
+    both count instead of one failing on the unique key. `key` must cover a
+    unique constraint of the table.
+    """
+    _execute_upsert_add(db, table, list(key), list(amounts), lambda statement: statement.values(**key, **amounts))
+
+
+def upsert_add_from_select(db: Session, table, key_names: List[str], amount_names: List[str], source):
+    """upsert_add() for every row of `source`, a SELECT of the key columns then the amounts"""
+    _execute_upsert_add(
+        db, table, key_names, amount_names,
+        lambda statement: statement.from_select(key_names + amount_names, source),
+    )
+
+
+def _execute_upsert_add(db: Session, table, key_names, amount_names, add_rows):
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        statement = add_rows(mysql.insert(table))
+        statement = statement.on_duplicate_key_update(
+            {name: table.c[name] + statement.inserted[name] for name in amount_names}
+        )
+    elif dialect == "sqlite":
+        statement = add_rows(sqlite.insert(table))
+        statement = statement.on_conflict_do_update(
+            index_elements=key_names,
+            set_={name: table.c[name] + statement.excluded[name] for name in amount_names},
+        )
+    else:
+        raise NotImplementedError(f"No upsert for the {dialect} dialect")
+    db.execute(statement)
@@ -0,0 +1,185 @@
+"""Maintenance of the sales_daily rollup table.
+
+Completed orders are folded into sales_daily as they are created, completed,
+reopened or deleted so the report endpoints never have to re-aggregate the
+raw order history. Run this module directly to backfill the table:
+
+    python sales_rollup.py                      # rebuild everything
+    python sales_rollup.py --start 2025-01-01   # rebuild from a date onwards
+"""
+import argparse
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import func, select, update, delete, insert
+from sqlalchemy.orm import Session
+
+import models
+from query_helpers import day_range, upsert_add
+
+COMPLETED = "Completed"
+
+# (product_id, category, quantity, price, cost_price)
+SaleLine = Tuple[int, str, int, Decimal, Decimal]
+
+
+def order_lines(order: models.Order) -> list:
+    """Build rollup lines from an order's items, with the category and cost they were sold at"""
+    return [
+        (item.product_id, item.category, item.quantity, item.price, item.unit_cost)
+        for item in order.items
+    ]
+
+
+def record_sale_details(order: models.Order):
+    """Copy each product's current category and cost price onto the order's items"""
+    for item in order.items:
+        if item.product is not None:
+            item.category = item.product.category
+            item.unit_cost = item.product.cost_price
+
+
+def apply_sale_lines(db: Session, sale_date: date, lines: Iterable[SaleLine], sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) order lines from the rollup for one day.
+
+    Runs in the caller's transaction; the caller is responsible for committing.
+    """
+    if isinstance(sale_date, datetime):
+        sale_date = sale_date.date()
+
+    # Collapse lines first so each rollup row is touched once
+    totals = {}
+    for product_id, category, quantity, price, cost_price in lines:
+        key = (product_id, category)
+        revenue = Decimal(str(price)) * quantity
+        cost = Decimal(str(cost_price or 0)) * quantity
+        entry = totals.setdefault(key, [0, 0, Decimal("0"), Decimal("0")])
+        entry[0] += 1
+        entry[1] += quantity
+        entry[2] += revenue
+        entry[3] += cost
+
+    table = models.SalesDaily
+    for (product_id, category), (line_count, units, revenue, cost) in totals.items():
+        if sign > 0:
+            # The first sale of a product on a day creates its row; a
+            # concurrent first sale adds to it rather than failing
+            upsert_add(
+                db,
+                table.__table__,
+                {"date": sale_date, "category": category, "product_id": product_id},
+                {
+                    "total_sales": line_count,
+                    "units_sold": units,
+                    "revenue": revenue,
+                    "cost": cost,
+                    "profit": revenue - cost,
+                },
+            )
+            continue
+
+        match = (
+            table.date == sale_date,
+            table.category == category,
+            table.product_id == product_id,
+        )
+        db.execute(
+            update(table)
+            .where(*match)
+            .values(
+                total_sales=table.total_sales - line_count,
+                units_sold=table.units_sold - units,
+                revenue=table.revenue - revenue,
+                cost=table.cost - cost,
+                profit=table.profit - (revenue - cost),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        # Drop rows that no longer represent any sales
+        db.execute(
+            delete(table)
+            .where(*match, table.total_sales <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+    db.flush()
+
+
+def apply_order(db: Session, order: models.Order, sign: int = 1):
+    """Add or remove a completed order's lines from the rollup"""
+    apply_sale_lines(db, order.created_at, order_lines(order), sign)
+
+
+def apply_status_change(db: Session, order: models.Order, previous_status: Optional[str]):
+    """Keep the rollup in step with an order moving to or from Completed"""
+    if previous_status != COMPLETED and order.status == COMPLETED:
+        # The sale happens now, at the products' current category and cost
+        record_sale_details(order)
+        apply_order(db, order, 1)
+    elif previous_status == COMPLETED and order.status != COMPLETED:
+        apply_order(db, order, -1)
+
+
+def rebuild_sales_daily(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+    """Recompute the rollup from raw order lines, optionally for a date range.
+
+    Returns the number of rollup rows written.
+    """
+    order_day = func.date(models.Order.created_at)
+
+    clear = delete(models.SalesDaily)
+    if start_date:
+        clear = clear.where(models.SalesDaily.date >= start_date)
+    if end_date:
+        clear = clear.where(models.SalesDaily.date <= end_date)
+    db.execute(clear)
+
+    revenue = func.sum(models.OrderItem.price * models.OrderItem.quantity)
+    cost = func.sum(models.OrderItem.unit_cost * models.OrderItem.quantity)
+    source = (
+        select(
+            order_day,
+            models.OrderItem.category,
+            models.OrderItem.product_id,
+            func.count(models.OrderItem.id),
+            func.sum(models.OrderItem.quantity),
+            revenue,
+            cost,
+            revenue - cost,
+        )
+        .select_from(models.Order)
+        .join(models.OrderItem, models.OrderItem.order_id == models.Order.id)
+        .where(models.Order.status == COMPLETED)
+        .group_by(order_day, models.OrderItem.category, models.OrderItem.product_id)
+    )
+    if start_date:
+        source = source.where(models.Order.created_at >= day_range(start_date)[0])
+    if end_date:
+        source = source.where(models.Order.created_at < day_range(end_date)[1])
+
+    result = db.execute(
+        insert(models.SalesDaily).from_select(
+            ["date", "category", "product_id", "total_sales", "units_sold", "revenue", "cost", "profit"],
+            source,
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Rebuild the sales_daily rollup from order history")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    models.SalesDaily.__table__.create(bind=engine, checkfirst=True)
+    session = SessionLocal()
+    try:
+        rows = rebuild_sales_daily(session, args.start, args.end)
+        print(f"Rebuilt sales_daily: {rows} rows written")
+    finally:
+        session.close()
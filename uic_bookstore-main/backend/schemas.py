@@ -20,6 +20,8 @@ class StudentResponse(StudentBase):
     id: int
     created_at: datetime
     profile_picture: Optional[str] = None
+    # Resized copies under /uploads ("thumb", "card", "full"), once written
+    profile_picture_variants: Optional[Dict[str, str]] = None
     
     class Config:
         from_attributes = True
@@ -32,6 +34,7 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     email: Optional[str] = None
     student_id: Optional[str] = None
+    id: Optional[int] = None
 
 # Product Schemas
 class ProductBase(BaseModel):
@@ -60,6 +63,10 @@ class ProductUpdate(BaseModel):
 
 class ProductResponse(ProductBase):
     id: int
+    stock_shards: int = 0
+    # Resized copies of image_url under /uploads ("thumb", "card", "full"),
+    # once written; None until then
+    image_variants: Optional[Dict[str, str]] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
     
@@ -68,8 +75,20 @@ class ProductResponse(ProductBase):
 
 class ProductList(BaseModel):
     products: List[ProductResponse]
+    # None when the caller passed include_total=false
+    total: Optional[int] = None
+    # Pass back as `cursor` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+class ProductSearchResponse(BaseModel):
+    # Best match first
+    products: List[ProductResponse]
+    # Number of matching products, of which the first `limit` are returned
     total: int
 
+class StockShardUpdate(BaseModel):
+    shards: int
+
 # Stock Adjustment Schemas
 class StockAdjustmentBase(BaseModel):
     product_id: int
@@ -90,6 +109,24 @@ class StockAdjustmentResponse(StockAdjustmentBase):
     class Config:
         from_attributes = True
 
+class BulkStockAdjustmentRequest(BaseModel):
+    adjustments: List[StockAdjustmentCreate]
+    # Apply the valid lines even if others fail
+    partial: bool = False
+
+class BulkStockAdjustmentLine(BaseModel):
+    line: int
+    product_id: Optional[int] = None
+    previous_stock: Optional[int] = None
+    new_stock: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkStockAdjustmentResponse(BaseModel):
+    applied: int
+    failed: int
+    notified: int = 0
+    results: List[BulkStockAdjustmentLine]
+
 class StockAdjustmentList(BaseModel):
     history: List[StockAdjustmentResponse]
     
@@ -116,7 +153,14 @@ class NotificationResponse(NotificationBase):
 
 class NotificationList(BaseModel):
     notifications: List[NotificationResponse]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+class UnreadNotificationCount(BaseModel):
+    unread_count: int
+
+class NotificationRetentionRequest(BaseModel):
+    days: Optional[int] = Field(None, ge=1, description="Keep read notifications this many days; defaults to NOTIFICATION_RETENTION_DAYS")
 
 # Product Subscription Schemas
 class ProductSubscriptionBase(BaseModel):
@@ -184,13 +228,35 @@ class OrderListItem(BaseModel):
     status: str
     created_at: datetime
     total: Decimal
+    item_count: int = 0
     
     class Config:
         from_attributes = True
 
 class OrderList(BaseModel):
     orders: List[OrderListItem]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+# Background job schemas
+class JobCreatedResponse(BaseModel):
+    job_id: int
+    status: str
+
+class JobResponse(BaseModel):
+    id: int
+    type: str
+    status: str
+    processed_count: int
+    rejected_count: int
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
 
 # Report schemas
 class SalesReportResponse(BaseModel):
@@ -299,6 +365,7 @@ class AdminPasswordUpdate(BaseModel):
 class AdminUserResponse(AdminUserBase):
     id: int
     profile_picture: Optional[str] = None
+    profile_picture_variants: Optional[Dict[str, str]] = None
     created_at: datetime
     updated_at: datetime
     
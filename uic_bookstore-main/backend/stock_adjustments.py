@@ -0,0 +1,206 @@
+"""Stock adjustments, single and bulk.
+
+A bulk delivery is validated as a whole, the affected product rows are
+locked once in id order, new levels are written with one CASE update,
+history rows with one executemany insert and subscriber notifications with
+one INSERT ... SELECT (or staged, see notification_coalescing.py), instead
+of a transaction and fan-out per product.
+"""
+import codecs
+import csv
+import datetime
+from typing import BinaryIO, Dict, List, Optional
+
+from sqlalchemy import case, insert, update
+from sqlalchemy.orm import Session
+
+import inventory
+import models
+import notification_coalescing
+import schemas
+
+VALID_TYPES = ["add", "remove", "set"]
+VALID_REASONS = ["purchase", "return", "damage", "inventory", "sale", "other"]
+
+REASON_TEXT = {
+    "purchase": "New inventory received",
+    "return": "Customer return",
+    "damage": "Damaged inventory removed",
+    "inventory": "Inventory adjustment",
+    "sale": "Sale made",
+}
+
+CSV_HEADERS = {"product_id", "type", "quantity", "reason"}
+
+
+def validate(adjustment) -> Optional[str]:
+    """Error message for an adjustment's type, quantity or reason, if any"""
+    if adjustment.type not in VALID_TYPES:
+        return f"Invalid adjustment type. Must be one of: {', '.join(VALID_TYPES)}"
+    if adjustment.quantity <= 0:
+        return "Quantity must be greater than zero"
+    if adjustment.reason not in VALID_REASONS:
+        return f"Invalid reason. Must be one of: {', '.join(VALID_REASONS)}"
+    return None
+
+
+def new_level(adjustment_type: str, previous_stock: int, quantity: int) -> int:
+    if adjustment_type == "add":
+        return previous_stock + quantity
+    if adjustment_type == "remove":
+        return previous_stock - quantity
+    return quantity
+
+
+def stock_message(adjustment_type: str, previous_stock: int, new_stock: int) -> str:
+    if adjustment_type == "add":
+        return f"Stock increased from {previous_stock} to {new_stock}"
+    if adjustment_type == "remove":
+        return f"Stock decreased from {previous_stock} to {new_stock}"
+    if new_stock > previous_stock:
+        return f"Stock level set from {previous_stock} to {new_stock} (increased)"
+    if new_stock < previous_stock:
+        return f"Stock level set from {previous_stock} to {new_stock} (decreased)"
+    return f"Stock level remains at {new_stock}"
+
+
+def reason_text(reason: str) -> str:
+    return REASON_TEXT.get(reason, reason)
+
+
+def net_stock_message(product_name: str, previous_stock: int, new_stock: int, types: List[str], reasons: List[str]) -> str:
+    """Notification text for one or more adjustments taking a product from previous_stock to new_stock.
+
+    Several adjustments are described by their net change, and mixed
+    reasons as an inventory adjustment.
+    """
+    adjustment_type = types[0] if len(types) == 1 else ("add" if new_stock > previous_stock else "remove")
+    reason = reasons[0] if len(set(reasons)) == 1 else "inventory"
+    return f"Product '{product_name}': {stock_message(adjustment_type, previous_stock, new_stock)} ({reason_text(reason)})"
+
+
+def parse_csv(fileobj: BinaryIO) -> List[tuple]:
+    """Read (line, adjustment or None, error or None) from a CSV upload.
+
+    Columns: product_id, type, quantity, reason and optionally notes.
+    Line numbers count the header as line 1.
+    """
+    reader = csv.DictReader(codecs.iterdecode(fileobj, "utf-8-sig"))
+    if not CSV_HEADERS.issubset(set(reader.fieldnames or [])):
+        raise ValueError(f"CSV file must contain the following columns: {', '.join(sorted(CSV_HEADERS))}")
+
+    rows = []
+    for line, row in enumerate(reader, start=2):
+        try:
+            adjustment = schemas.StockAdjustmentCreate(
+                product_id=int(row["product_id"]),
+                type=(row["type"] or "").strip(),
+                quantity=int(row["quantity"]),
+                reason=(row["reason"] or "").strip(),
+                notes=(row.get("notes") or "").strip() or None,
+            )
+        except (TypeError, ValueError):
+            rows.append((line, None, "product_id and quantity must be valid numbers"))
+            continue
+        rows.append((line, adjustment, None))
+    return rows
+
+
+def apply_bulk(db: Session, lines: List[tuple], partial: bool = False) -> dict:
+    """Apply (line, adjustment or None, error or None) entries in one transaction.
+
+    Lines for the same product apply in order. With partial=False nothing is
+    written if any line fails; with partial=True failed lines are skipped.
+    Returns per-line results; the caller commits when "applied" is non-zero.
+    """
+    results = []
+    valid = []
+    for line, adjustment, error in lines:
+        error = error or validate(adjustment)
+        if error:
+            results.append({"line": line, "product_id": getattr(adjustment, "product_id", None), "error": error})
+        else:
+            valid.append((line, adjustment))
+
+    # Lock every product involved, in id order like order reservations
+    product_ids = sorted({adjustment.product_id for _, adjustment in valid})
+    products = {
+        product.id: product
+        for product in db.query(models.Product)
+        .filter(models.Product.id.in_(product_ids))
+        .order_by(models.Product.id)
+        .with_for_update()
+    } if product_ids else {}
+    levels = {product_id: inventory.lock_level(db, product) for product_id, product in products.items()}
+    starting_levels = dict(levels)
+
+    history = []
+    now = datetime.datetime.utcnow()
+    types = {}
+    reasons = {}
+    for line, adjustment in valid:
+        result = {"line": line, "product_id": adjustment.product_id}
+        results.append(result)
+        if adjustment.product_id not in products:
+            result["error"] = "Product not found"
+            continue
+
+        previous_stock = levels[adjustment.product_id]
+        if adjustment.type == "remove" and previous_stock < adjustment.quantity:
+            result["error"] = f"Not enough stock to remove. Current stock: {previous_stock}"
+            continue
+
+        new_stock = new_level(adjustment.type, previous_stock, adjustment.quantity)
+        levels[adjustment.product_id] = new_stock
+        types.setdefault(adjustment.product_id, []).append(adjustment.type)
+        reasons.setdefault(adjustment.product_id, []).append(adjustment.reason)
+        result.update(previous_stock=previous_stock, new_stock=new_stock)
+        history.append({
+            "product_id": adjustment.product_id,
+            "type": adjustment.type,
+            "quantity": adjustment.quantity,
+            "reason": adjustment.reason,
+            "notes": adjustment.notes,
+            "previous_stock": previous_stock,
+            "new_stock": new_stock,
+            "created_at": now,
+        })
+
+    results.sort(key=lambda result: result["line"])
+    failed = sum(1 for result in results if "error" in result)
+    if (failed and not partial) or not history:
+        return {"applied": 0, "failed": failed, "results": results}
+
+    changed = {
+        product_id: level for product_id, level in levels.items()
+        if product_id in types
+    }
+    _write_levels(db, products, changed)
+    db.execute(insert(models.StockAdjustment), history)
+
+    # One notification per product whose level actually moved, describing
+    # the net change when a product had several lines
+    notified, messages = notification_coalescing.notify_stock_changes(db, [
+        (products[product_id], starting_levels[product_id], level, types[product_id], reasons[product_id])
+        for product_id, level in changed.items()
+        if level != starting_levels[product_id]
+    ])
+
+    # "messages" is for publishing after commit and is not part of the response
+    return {"applied": len(history), "failed": failed, "notified": notified, "results": results, "messages": messages}
+
+
+def _write_levels(db: Session, products: Dict[int, models.Product], levels: Dict[int, int]):
+    plain = {product_id: level for product_id, level in levels.items() if not products[product_id].stock_shards}
+    if plain:
+        # Rows are locked above, so absolute values are safe
+        db.execute(
+            update(models.Product)
+            .where(models.Product.id.in_(plain))
+            .values(stock=case(plain, value=models.Product.id))
+            .execution_options(synchronize_session=False)
+        )
+    for product_id, level in levels.items():
+        if product_id not in plain:
+            inventory.set_level(db, products[product_id], level)
+
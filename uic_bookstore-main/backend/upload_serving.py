@@ -0,0 +1,210 @@
+"""Serving uploaded images at /uploads.
+
+UploadFiles is StaticFiles with caching suited to the blob store:
+
+- Content-addressed names (<sha256><extension> and their variants, see
+  blob_store.py) never change content, so they are sent with
+  `Cache-Control: public, max-age=31536000, immutable` and browsers and
+  proxies keep them for a year without revalidating. Other names get
+  UPLOAD_CACHE_MAX_AGE.
+- Content-addressed files up to UPLOAD_MEMORY_CACHE_FILE_MAX bytes are
+  kept in memory with their headers (UPLOAD_MEMORY_CACHE_BYTES in total),
+  so repeat requests skip the threadpool round trip, open and read that
+  StaticFiles runs for every request. The upload GC, possibly running in
+  another process, bumps the shared "uploads" version after deleting
+  files; every UPLOAD_DELETION_POLL seconds a request reads it off the
+  event loop and the cache is emptied when it changed, so deleted files
+  stop being served without a stat per hit.
+- Everything else is a FileResponse: Range, If-None-Match and
+  If-Modified-Since are handled by Starlette, and on servers that offer
+  the ASGI pathsend extension the server sends the file itself
+  (sendfile) instead of Python reading it.
+
+The API mounts it at /uploads unless SERVE_UPLOADS is off. To keep image
+traffic off the API workers, run `app` as its own process:
+
+    uvicorn upload_serving:app --port 8001
+
+or let a front proxy serve UPLOAD_DIR with the nginx configuration
+printed by:
+
+    python upload_serving.py
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+import anyio
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.routing import Mount
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+import catalog_cache
+from config import (
+    UPLOAD_DIR, UPLOAD_CACHE_MAX_AGE, UPLOAD_MEMORY_CACHE_BYTES, UPLOAD_MEMORY_CACHE_FILE_MAX, UPLOAD_DELETION_POLL
+)
+from image_names import CONTENT_ADDRESSED, CONTENT_ADDRESSED_PATTERN
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+FILE_CHUNK_SIZE = 512 * 1024
+
+
+def cache_control(filename: str) -> str:
+    if CONTENT_ADDRESSED.fullmatch(filename):
+        return IMMUTABLE
+    return f"public, max-age={UPLOAD_CACHE_MAX_AGE}"
+
+
+class MemoryFileResponse(Response):
+    """A cached file sent from memory with the headers of its FileResponse"""
+
+    def __init__(self, raw_headers: list, body: bytes):
+        self.status_code = 200
+        self.background = None
+        self.body = body
+        self.raw_headers = raw_headers
+
+
+class MemoryCache:
+    """Least recently used cache of small immutable files, bounded in bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Only touched from the event loop, so no lock is needed
+        self._entries: "OrderedDict[str, Tuple[Headers, bytes]]" = OrderedDict()
+
+    def get(self, name: str):
+        entry = self._entries.get(name)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(name)
+        self.hits += 1
+        return entry
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def put(self, name: str, headers: Headers, body: bytes):
+        if name in self._entries or len(body) > self.max_bytes:
+            return
+        self._entries[name] = (headers, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class UploadFiles(StaticFiles):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memory = MemoryCache(UPLOAD_MEMORY_CACHE_BYTES)
+        self._deletions_version = None
+        self._deletions_checked = float("-inf")
+
+    async def _forget_deleted(self):
+        # Set before awaiting so concurrent requests do not all poll
+        now = time.monotonic()
+        if now - self._deletions_checked < UPLOAD_DELETION_POLL:
+            return
+        self._deletions_checked = now
+        try:
+            version = await anyio.to_thread.run_sync(catalog_cache.backend.get_version, "uploads")
+        except Exception as e:
+            print(f"Could not check for deleted uploads: {str(e)}")
+            return
+        if version != self._deletions_version:
+            # Cached files were read before these deletions, so all may be gone
+            self.memory.clear()
+            self._deletions_version = version
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result,
+            headers={"Cache-Control": cache_control(os.path.basename(full_path))}
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        # Fewer threadpool round trips per file than the default 64 KB
+        response.chunk_size = FILE_CHUNK_SIZE
+        return response
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD") or not CONTENT_ADDRESSED.fullmatch(path):
+            return await super().get_response(path, scope)
+
+        await self._forget_deleted()
+        request_headers = Headers(scope=scope)
+        # Ranges are cut from the file by FileResponse
+        entry = None if "range" in request_headers else self.memory.get(path)
+        if entry is not None:
+            headers, body = entry
+            if self.is_not_modified(headers, request_headers):
+                return NotModifiedResponse(headers)
+            return MemoryFileResponse(headers.raw, b"" if scope["method"] == "HEAD" else body)
+
+        response = await super().get_response(path, scope)
+        if (
+            isinstance(response, FileResponse)
+            and path not in self.memory
+            and response.stat_result.st_size <= UPLOAD_MEMORY_CACHE_FILE_MAX
+        ):
+            body = await anyio.to_thread.run_sync(_read, response.path)
+            self.memory.put(path, response.headers, body)
+        return response
+
+    def stats(self) -> dict:
+        return self.memory.stats()
+
+
+# Standalone app for serving /uploads from its own process
+files = UploadFiles(directory=UPLOAD_DIR, check_dir=False)
+app = Starlette(routes=[Mount("/uploads", app=files, name="uploads")])
+
+
+def nginx_config() -> str:
+    """nginx location blocks serving /uploads straight from UPLOAD_DIR"""
+    root = os.path.dirname(os.path.abspath(UPLOAD_DIR))
+    return f"""# Serve uploaded images from disk (sendfile, Range, ETag and
+# If-Modified-Since are handled by nginx); generated by upload_serving.py
+location /uploads/ {{
+    root {root};
+    sendfile on;
+    tcp_nopush on;
+    open_file_cache max=10000 inactive=60s;
+    add_header Cache-Control "public, max-age={UPLOAD_CACHE_MAX_AGE}";
+
+    location ~ "^/uploads/{CONTENT_ADDRESSED_PATTERN}$" {{
+        add_header Cache-Control "{IMMUTABLE}";
+    }}
+}}
+"""
+
+
+if __name__ == "__main__":
+    print(nginx_config(), end="")
@@ -0,0 +1,234 @@
+"""Saving uploaded files.
+
+Uploads reach the endpoints as UploadFile objects that Starlette has
+already spooled while parsing the form. receive_image() and save_file()
+copy one to a temporary file in its destination directory in
+UPLOAD_CHUNK_SIZE pieces, never holding the whole file in memory, and on
+the way:
+
+- check the first bytes: images must be JPEG, PNG, GIF or WebP whatever
+  the client's Content-Type says, and get the matching extension;
+- stop with 413 once the file passes its size cap;
+- compute the SHA-256 of the content.
+
+The complete file is then renamed into place, so /uploads never serves a
+half-written file. Images are named after their hash by blob_store.py.
+
+The endpoints that call these are plain `def` functions, so the copy runs
+in the threadpool and not on the event loop.
+
+The spool itself is written while the form is parsed, before any endpoint
+runs. UploadLimitMiddleware caps multipart request bodies at that stage:
+a declared Content-Length over the cap is refused before the body is
+read, and a body that turns out larger is cut off as soon as it passes it.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, NamedTuple, Optional
+
+from fastapi import HTTPException, status
+from starlette.responses import JSONResponse
+
+from config import UPLOAD_DIR, UPLOAD_MAX_BYTES, IMPORT_MAX_BYTES, UPLOAD_CHUNK_SIZE
+
+# Multipart bodies posted to these paths carry CSV imports rather than images
+IMPORT_PATHS = ("/admin/orders/import", "/admin/stock/adjust/bulk/csv")
+
+# Room for the form fields and multipart headers around the file
+FORM_OVERHEAD = 64 * 1024
+
+# Leading bytes of each accepted image type -> extension
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+
+class ReceivedUpload(NamedTuple):
+    path: str  # temporary file; the caller renames or removes it
+    size: int
+    sha256: str
+    extension: Optional[str]  # of the image type, for images
+
+
+class UploadMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.bytes = 0
+        self.total_ms = 0.0
+        self.too_large = 0
+        self.wrong_type = 0
+
+    def record(self, duration: float, size: int):
+        with self._lock:
+            self.stored += 1
+            self.bytes += size
+            self.total_ms += duration * 1000
+
+    def reject(self, status_code: int):
+        with self._lock:
+            if status_code == 413:
+                self.too_large += 1
+            else:
+                self.wrong_type += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_bytes": UPLOAD_MAX_BYTES,
+                "stored": self.stored,
+                "bytes": self.bytes,
+                "avg_ms": round(self.total_ms / self.stored, 3) if self.stored else None,
+                "rejected_too_large": self.too_large,
+                "rejected_not_image": self.wrong_type,
+            }
+
+
+metrics = UploadMetrics()
+
+
+def image_extension(head: bytes) -> Optional[str]:
+    """Extension for an image's first bytes, or None if it is not an accepted type"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File is larger than {max_bytes // (1024 * 1024)} MB"
+    )
+
+
+def _receive(source: BinaryIO, directory: str, max_bytes: int, images_only: bool) -> ReceivedUpload:
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as target:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and images_only:
+                    extension = image_extension(chunk)
+                    if extension is None:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File must be an image")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                digest.update(chunk)
+                target.write(chunk)
+        if images_only and extension is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File must be an image")
+        # mkstemp creates the file readable by its owner only
+        os.chmod(temporary, 0o644)
+    except HTTPException as e:
+        os.remove(temporary)
+        metrics.reject(e.status_code)
+        raise
+    except BaseException:
+        os.remove(temporary)
+        raise
+    metrics.record(time.perf_counter() - started, size)
+    return ReceivedUpload(temporary, size, digest.hexdigest(), extension)
+
+
+def receive_image(upload) -> ReceivedUpload:
+    """Copy an uploaded image to a temporary file in UPLOAD_DIR.
+
+    Raises 400 if it is not a JPEG, PNG, GIF or WebP image and 413 if it
+    is over UPLOAD_MAX_BYTES.
+    """
+    try:
+        return _receive(upload.file, UPLOAD_DIR, UPLOAD_MAX_BYTES, True)
+    finally:
+        upload.file.close()
+
+
+def save_file(upload, path: str, max_bytes: int = IMPORT_MAX_BYTES) -> ReceivedUpload:
+    """Store any upload at path; raises 413 if it is over max_bytes"""
+    try:
+        received = _receive(upload.file, os.path.dirname(path) or ".", max_bytes, False)
+    finally:
+        upload.file.close()
+    os.replace(received.path, path)
+    return received._replace(path=path)
+
+
+def body_limit(path: str) -> int:
+    """Largest multipart request body accepted at path"""
+    if path in IMPORT_PATHS:
+        return IMPORT_MAX_BYTES + FORM_OVERHEAD
+    return UPLOAD_MAX_BYTES + FORM_OVERHEAD
+
+
+class UploadLimitMiddleware:
+    """Refuse multipart request bodies over body_limit() with 413 while they stream in"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = body_limit(scope["path"])
+        refusal = JSONResponse({"detail": _too_large(limit - FORM_OVERHEAD).detail}, status_code=413)
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            metrics.reject(413)
+            await refusal(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    # Ends the form parsing as if the client had gone away
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal responded
+            if exceeded:
+                return  # whatever the endpoint answers, the client gets the 413
+            responded = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not responded:
+            metrics.reject(413)
+            await refusal(scope, receive, send)
+
+
+def stats() -> dict:
+    return metrics.snapshot()
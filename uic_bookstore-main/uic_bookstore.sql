@@ -33,6 +33,7 @@ CREATE TABLE `students` (
   `email` varchar(100) NOT NULL,
   `student_id` varchar(20) NOT NULL,
   `password_hash` varchar(255) NOT NULL,
+  `profile_picture` varchar(255) DEFAULT NULL,
   `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
   `updated_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp()
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -68,6 +69,7 @@ CREATE TABLE `products` (
   `price` decimal(10,2) NOT NULL,
   `cost_price` decimal(10,2) NOT NULL,
   `stock` int(11) NOT NULL DEFAULT 0,
+  `stock_shards` int(11) NOT NULL DEFAULT 0,
   `min_stock` int(11) DEFAULT NULL,
   `description` text DEFAULT NULL,
   `image_url` varchar(255) DEFAULT NULL,
@@ -86,6 +88,16 @@ INSERT INTO `products` (`name`, `category`, `price`, `cost_price`, `stock`, `min
 ('PE Book', 'Books', 500.00, 400.00, 3, 5, 'Physical Education textbook', NULL),
 ('Scantron', 'Other', 5.00, 3.00, 45, 50, 'Scantron answer sheets', NULL); 
 
+-- Stock of hot products split across counter rows (see inventory.py)
+CREATE TABLE IF NOT EXISTS product_stock_shards (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    product_id INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    stock INTEGER NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_product_stock_shards_product_shard (product_id, shard),
+    FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+);
+
 -- Stock Adjustments History Table
 CREATE TABLE IF NOT EXISTS stock_adjustments (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
@@ -180,28 +192,65 @@ CREATE TABLE IF NOT EXISTS product_subscriptions (
     UNIQUE(student_id, product_id)
 );
 
+-- Unread notifications per student, kept by the API (see backend/notifications.py)
+CREATE TABLE IF NOT EXISTS student_unread_counts (
+    student_id INTEGER PRIMARY KEY,
+    unread INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (student_id) REFERENCES students (id) ON DELETE CASCADE
+);
+
 -- Create indexes for performance
 CREATE INDEX IF NOT EXISTS idx_notifications_student_id ON notifications (student_id);
 CREATE INDEX IF NOT EXISTS idx_notifications_product_id ON notifications (product_id);
 CREATE INDEX IF NOT EXISTS idx_notifications_created_at ON notifications (created_at);
+CREATE INDEX IF NOT EXISTS ix_notifications_student_created ON notifications (student_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_notifications_student_read_created ON notifications (student_id, is_read, created_at);
 CREATE INDEX IF NOT EXISTS idx_product_subscriptions_student_id ON product_subscriptions (student_id);
 CREATE INDEX IF NOT EXISTS idx_product_subscriptions_product_id ON product_subscriptions (product_id);
 
+-- Product changes waiting to be merged into one notification per subscriber
+-- (see backend/notification_coalescing.py)
+CREATE TABLE IF NOT EXISTS pending_notifications (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    product_id INTEGER NOT NULL,
+    type VARCHAR(50) NOT NULL,
+    field VARCHAR(50) NOT NULL,
+    old_value TEXT NULL,
+    new_value TEXT NULL,
+    adjustment_type VARCHAR(20) NULL,
+    reason VARCHAR(50) NULL,
+    created_at DATETIME NOT NULL,
+    FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_pending_notifications_product ON pending_notifications (product_id, id);
+CREATE INDEX IF NOT EXISTS ix_pending_notifications_created ON pending_notifications (created_at);
+
 -- Order tables
 CREATE TABLE IF NOT EXISTS orders (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
     customer_name TEXT NOT NULL,
-    status TEXT NOT NULL DEFAULT 'Pending',
+    status VARCHAR(20) NOT NULL DEFAULT 'Pending',
+    order_total DECIMAL(12,2) NOT NULL DEFAULT 0,
+    item_count INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Number of orders per status, maintained by the API
+CREATE TABLE IF NOT EXISTS order_status_counts (
+    status VARCHAR(20) PRIMARY KEY,
+    order_count INTEGER NOT NULL DEFAULT 0
+);
+
 CREATE TABLE IF NOT EXISTS order_items (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
     order_id INTEGER NOT NULL,
     product_id INTEGER NOT NULL,
     quantity INTEGER NOT NULL,
     price DECIMAL(10, 2) NOT NULL,
+    category VARCHAR(50) NOT NULL,
+    unit_cost DECIMAL(10, 2) NOT NULL,
     FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
     FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE RESTRICT
 );
@@ -209,19 +258,66 @@ CREATE TABLE IF NOT EXISTS order_items (
 -- Create indexes for orders tables
 CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);
 CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id);
+CREATE INDEX IF NOT EXISTS ix_order_items_order_product ON order_items (order_id, product_id);
+CREATE INDEX IF NOT EXISTS ix_orders_status_created_at ON orders (status, created_at);
+CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at);
 
 -- Sales reporting tables
+-- sales_daily is a per-day, per-category, per-product rollup of completed orders.
+-- The API keeps it up to date; backfill it with `python backend/sales_rollup.py`.
 CREATE TABLE IF NOT EXISTS sales_daily (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
     date DATE NOT NULL,
     category VARCHAR(50) NOT NULL,
+    product_id INTEGER NOT NULL,
     total_sales INTEGER NOT NULL DEFAULT 0,
-    revenue DECIMAL(10,2) NOT NULL DEFAULT 0,
-    cost DECIMAL(10,2) NOT NULL DEFAULT 0,
-    profit DECIMAL(10,2) NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    cost DECIMAL(12,2) NOT NULL DEFAULT 0,
+    profit DECIMAL(12,2) NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    UNIQUE(date, category)
+    UNIQUE KEY uq_sales_daily_date_category_product (date, category, product_id),
+    CONSTRAINT fk_sales_daily_product FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+);
+
+-- Uploaded images, stored once under the SHA-256 of their content, with the
+-- number of products, students and admins using each (see backend/blob_store.py)
+CREATE TABLE IF NOT EXISTS upload_blobs (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    filename VARCHAR(80) NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL,
+    unreferenced_at DATETIME NULL,
+    variants_ready BOOLEAN NOT NULL DEFAULT FALSE,
+    UNIQUE KEY uq_upload_blobs_filename (filename),
+    INDEX ix_upload_blobs_unreferenced (refcount, unreferenced_at)
+);
+
+-- Version counters of cached data, bumped by the API after every write
+-- (used when no Redis cache is configured)
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Background jobs queue (CSV order imports)
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    type VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    payload TEXT,
+    processed_count INTEGER NOT NULL DEFAULT 0,
+    rejected_count INTEGER NOT NULL DEFAULT 0,
+    result MEDIUMTEXT,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    heartbeat_at DATETIME NULL,
+    checkpoint TEXT,
+    INDEX ix_jobs_status_created_at (status, created_at)
 );
 
 -- Top selling products table for reporting
@@ -243,24 +339,6 @@ CREATE TABLE IF NOT EXISTS top_products (
 CREATE INDEX IF NOT EXISTS idx_sales_daily_date ON sales_daily (date);
 CREATE INDEX IF NOT EXISTS idx_sales_daily_category ON sales_daily (category);
 
--- Insert sample data for testing
-INSERT INTO sales_daily (date, category, total_sales, revenue, cost, profit) VALUES
-('2025-03-25', 'Uniform', 4, 1725.00, 1325.00, 400.00),
-('2025-03-25', 'Books', 2, 1500.00, 1200.00, 300.00),
-('2025-03-25', 'Other', 20, 100.00, 60.00, 40.00),
-('2025-03-26', 'Uniform', 3, 1300.00, 1000.00, 300.00),
-('2025-03-26', 'Books', 2, 1250.00, 1000.00, 250.00),
-('2025-03-26', 'Other', 15, 75.00, 45.00, 30.00),
-('2025-03-27', 'Uniform', 5, 2000.00, 1600.00, 400.00),
-('2025-03-27', 'Books', 3, 2250.00, 1800.00, 450.00),
-('2025-03-27', 'Other', 10, 50.00, 30.00, 20.00),
-('2025-03-28', 'Uniform', 4, 1800.00, 1400.00, 400.00),
-('2025-03-28', 'Books', 1, 750.00, 600.00, 150.00),
-('2025-03-28', 'Other', 5, 25.00, 15.00, 10.00),
-('2025-03-29', 'Uniform', 2, 900.00, 700.00, 200.00),
-('2025-03-29', 'Books', 3, 2250.00, 1800.00, 450.00),
-('2025-03-29', 'Other', 12, 60.00, 36.00, 24.00);
-
 -- This needs to come after the products are inserted for the foreign key constraint to work
 INSERT INTO top_products (product_id, start_date, end_date, units_sold, revenue) VALUES
 (1, '2025-03-25', '2025-03-31', 2, 900.00),  -- Polo